@@ -1,4 +1,5 @@
 import os
+import logging
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
@@ -14,6 +15,7 @@ from dotenv import load_dotenv
 
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
@@ -60,19 +62,17 @@ def register_user(req: RegisterRequest, db: Session = Depends(get_db)):
 
 @router.post("/login", response_model=TokenResponse)
 def login_user(req: LoginRequest, db: Session = Depends(get_db)):
-    print(f"🔐 Login attempt: username={req.username}, password={req.password}")
-
     user = db.query(User).filter(User.username == req.username).first()
     if not user:
-        print("❌ User not found")
+        logger.info("Login failed", extra={"username": req.username, "reason": "unknown user"})
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
     if not verify_password(req.password, user.password_hash):
-        print("❌ Invalid password")
+        logger.info("Login failed", extra={"username": req.username, "reason": "bad password"})
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    print("✅ Login successful")
+    logger.info("Login successful", extra={"username": req.username})
 
-    token = create_access_token({"sub": str(user.id)})
+    token = create_access_token({"sub": str(user.id), "username": user.username})
     return {"access_token": token}
 
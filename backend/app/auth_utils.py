@@ -1,7 +1,13 @@
 import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from uuid import UUID
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
+from sqlalchemy import event
 from sqlalchemy.orm import Session
 from app.pgsql.models import User
 from app.pgsql.database import get_db
@@ -12,31 +18,126 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 
+# Resolved users are cached per process for a short time to skip the DB lookup on every request
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+# Read-only endpoints may trust the signed token claims instead of loading the user at all
+AUTH_TRUST_CLAIMS = os.getenv("AUTH_TRUST_CLAIMS", "false").lower() == "true"
+
 # oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
 bearer_scheme = HTTPBearer()
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
-    db: Session = Depends(get_db)
-) -> User:
-    token = credentials.credentials
-    credentials_exception = HTTPException(
+
+class UserCache:
+    """Bounded TTL cache of detached User rows keyed by token subject (user id)."""
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def put(self, user_id, user):
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(AUTH_CACHE_TTL, AUTH_CACHE_SIZE)
+
+
+def invalidate_cached_user(user_id):
+    user_cache.invalidate(user_id)
+
+
+# Any password change or deletion flushed through the ORM drops the cached entry.
+# Other worker processes pick the change up once their entry expires (AUTH_CACHE_TTL).
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_on_user_change(mapper, connection, target):
+    invalidate_cached_user(target.id)
+
+
+@dataclass(frozen=True)
+class TokenUser:
+    """Principal built from signed token claims, without a DB round trip."""
+    id: UUID
+    username: str
+
+
+def credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+
+def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-
-        if user_id is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        raise credentials_exception()
+    if payload.get("sub") is None:
+        raise credentials_exception()
+    return payload
+
+
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+    db: Session = Depends(get_db)
+) -> User:
+    user_id: str = decode_token(credentials.credentials)["sub"]
+
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
 
     user = db.query(User).filter(User.id == user_id).first()
     if user is None:
-        raise credentials_exception
+        raise credentials_exception()
+
+    # detach so the cached row is never expired or refreshed by another session
+    db.expunge(user)
+    user_cache.put(user_id, user)
     return user
+
+
+def get_current_user_readonly(
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+    db: Session = Depends(get_db)
+):
+    """Principal for read-only endpoints; trusts the token claims when AUTH_TRUST_CLAIMS is on."""
+    if AUTH_TRUST_CLAIMS:
+        payload = decode_token(credentials.credentials)
+        if payload.get("username"):
+            try:
+                return TokenUser(id=UUID(payload["sub"]), username=payload["username"])
+            except ValueError:
+                raise credentials_exception()
+    return get_current_user(credentials, db)
@@ -1,30 +1,60 @@
 import os
 import io
+import logging
 import boto3
+from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 
+from app.metrics import timed, record_s3
+
 load_dotenv()
 
 AWS_REGION = os.getenv("AWS_REGION")
 AWS_S3_BUCKET = os.getenv("AWS_S3_BUCKET")
+S3_LOCAL_DIR = os.getenv("S3_LOCAL_DIR")  # filesystem stand-in for local runs and tests
+
+if S3_LOCAL_DIR:
+    from app.local_s3 import LocalS3Client
+    s3 = LocalS3Client(S3_LOCAL_DIR)
+else:
+    s3 = boto3.client(
+        "s3",
+        region_name=AWS_REGION,
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
+    )
 
-s3 = boto3.client(
-    "s3",
-    region_name=AWS_REGION,
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY")
-)
+logger = logging.getLogger(__name__)
 
 def upload_pickle_to_s3(obj, s3_key):
     buf = io.BytesIO()
     import pickle
     pickle.dump(obj, buf)
+    record_s3("put", buf.tell())
     buf.seek(0)
-    s3.upload_fileobj(buf, AWS_S3_BUCKET, s3_key)
+    with timed("s3_put"):
+        s3.upload_fileobj(buf, AWS_S3_BUCKET, s3_key)
+
+def upload_json_to_s3(obj, s3_key):
+    import json
+    body = json.dumps(obj).encode("utf-8")
+    record_s3("put", len(body))
+    with timed("s3_put"):
+        s3.put_object(Body=body, Bucket=AWS_S3_BUCKET, Key=s3_key, ContentType="application/json")
+
+def download_json_from_s3(s3_key):
+    import json
+    with timed("s3_get"):
+        response = s3.get_object(Bucket=AWS_S3_BUCKET, Key=s3_key)
+        body = response['Body'].read()
+    record_s3("get", len(body))
+    return json.loads(body)
 
 def download_pickle_from_s3(s3_key):
     buf = io.BytesIO()
-    s3.download_fileobj(AWS_S3_BUCKET, s3_key, buf)
+    with timed("s3_get"):
+        s3.download_fileobj(AWS_S3_BUCKET, s3_key, buf)
+    record_s3("get", buf.tell())
     buf.seek(0)
     import pickle
     return pickle.load(buf)
@@ -36,16 +66,18 @@ def upload_faiss_to_s3(index, s3_key):
     if isinstance(index, np.ndarray):
         raise ValueError("❌ Tried to upload a NumPy array instead of FAISS index")
 
-    print("✅ Saving FAISS index to S3:", s3_key)
-    print("🧪 FAISS index: is_trained =", index.is_trained, "ntotal =", index.ntotal)
+    logger.info("Saving FAISS index to S3", extra={"s3_key": s3_key, "is_trained": index.is_trained, "ntotal": index.ntotal})
 
-    serialized_index = faiss_s3.serialize_index(index)
+    with timed("faiss_serialize"):
+        serialized_index = faiss_s3.serialize_index(index)
 
     # ✅ Convert to bytes if it's a NumPy array
     if isinstance(serialized_index, np.ndarray):
         serialized_index = serialized_index.tobytes()
 
-    s3.put_object(Body=serialized_index, Bucket=AWS_S3_BUCKET, Key=s3_key)
+    record_s3("put", len(serialized_index))
+    with timed("s3_put"):
+        s3.put_object(Body=serialized_index, Bucket=AWS_S3_BUCKET, Key=s3_key)
 
 
 
@@ -53,24 +85,70 @@ def download_faiss_from_s3(s3_key):
     import faiss as faiss_s3
     import numpy as np
 
-    print("📥 Downloading FAISS index from S3:", s3_key)
-
-    response = s3.get_object(Bucket=AWS_S3_BUCKET, Key=s3_key)
-    serialized_index = response['Body'].read()
-    index = faiss_s3.deserialize_index(np.frombuffer(serialized_index, dtype=np.uint8))
-    print("✅ FAISS index loaded: ntotal =", index.ntotal)
+    with timed("s3_get"):
+        response = s3.get_object(Bucket=AWS_S3_BUCKET, Key=s3_key)
+        serialized_index = response['Body'].read()
+    record_s3("get", len(serialized_index))
+    with timed("faiss_deserialize"):
+        index = faiss_s3.deserialize_index(np.frombuffer(serialized_index, dtype=np.uint8))
+    logger.info("FAISS index loaded from S3", extra={"s3_key": s3_key, "ntotal": index.ntotal, "bytes": len(serialized_index)})
     return index
 
 
 
 def delete_from_s3(s3_key):
-    s3.delete_object(Bucket=AWS_S3_BUCKET, Key=s3_key)
+    with timed("s3_delete"):
+        s3.delete_object(Bucket=AWS_S3_BUCKET, Key=s3_key)
+
+def object_size(s3_key):
+    """Stored size in bytes, 0 if the object does not exist."""
+    try:
+        return s3.head_object(Bucket=AWS_S3_BUCKET, Key=s3_key)["ContentLength"]
+    except ClientError:
+        return 0
+
+def delete_prefix_from_s3(prefix):
+    params = {"Bucket": AWS_S3_BUCKET, "Prefix": prefix}
+    while True:
+        response = s3.list_objects_v2(**params)
+        for obj in response.get("Contents", []):
+            s3.delete_object(Bucket=AWS_S3_BUCKET, Key=obj["Key"])
+        if not response.get("IsTruncated"):
+            break
+        params["ContinuationToken"] = response["NextContinuationToken"]
+
+def upload_bytes_to_s3(data, s3_key, content_type=None):
+    extra = {"ContentType": content_type} if content_type else {}
+    record_s3("put", len(data))
+    with timed("s3_put"):
+        s3.put_object(Body=data, Bucket=AWS_S3_BUCKET, Key=s3_key, **extra)
 
 def s3_key_for(user_id, embedding_name, filename):
     return f"{user_id}/{embedding_name}/{filename}"
 
+def document_key_for(user_id, embedding_name, filename):
+    return f"{user_id}/{embedding_name}/documents/{filename}"
+
+def extracted_key_for(user_id, embedding_name, filename):
+    # extracted text + chunk boundaries of one document, written at ingestion
+    return f"{user_id}/{embedding_name}/extracted/{filename}.json"
+
+def get_object_stream(s3_key, byte_range=None, if_none_match=None):
+    """GetObject passing HTTP Range / If-None-Match straight through; the caller streams response['Body']."""
+    params = {"Bucket": AWS_S3_BUCKET, "Key": s3_key}
+    if byte_range:
+        params["Range"] = byte_range
+    if if_none_match:
+        params["IfNoneMatch"] = if_none_match
+    with timed("s3_get_stream"):
+        response = s3.get_object(**params)
+    record_s3("get", response.get("ContentLength", 0))
+    return response
+
 def download_file_bytes_from_s3(s3_key):
     buf = io.BytesIO()
-    s3.download_fileobj(AWS_S3_BUCKET, s3_key, buf)
+    with timed("s3_get"):
+        s3.download_fileobj(AWS_S3_BUCKET, s3_key, buf)
+    record_s3("get", buf.tell())
     buf.seek(0)
     return buf.read()
@@ -0,0 +1,159 @@
+# bm25.py — compact BM25 inverted index over chunk text, stored next to the FAISS index
+import re
+from collections import Counter
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"\w+(?:[-.]\w+)*")
+
+
+def tokenize(text):
+    # keeps terms like "BRCA1", "eq.3" and "k-means" intact
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """Okapi BM25 over a list of chunks; doc ids are positions in the chunks list.
+
+    Postings are stored CSR style in flat numpy arrays: the postings of term t
+    are doc_ids[offsets[t]:offsets[t + 1]] with matching term frequencies.
+    Removed docs are only flagged in the `deleted` bitmap (their postings still
+    count towards idf) until `compact` drops them; `add` appends docs without
+    re-tokenizing the existing ones.
+    """
+
+    def __init__(self, vocab, offsets, doc_ids, tfs, doc_lens, k1=1.5, b=0.75, deleted=None):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lens = doc_lens
+        self.k1 = k1
+        self.b = b
+        self.deleted = deleted if deleted is not None else np.zeros(len(doc_lens), dtype=bool)
+        self._update_avg_len()
+        self._update_idf()
+
+    def __setstate__(self, state):
+        # indexes pickled before tombstones existed
+        state.setdefault("deleted", np.zeros(len(state["doc_lens"]), dtype=bool))
+        self.__dict__.update(state)
+
+    def _update_avg_len(self):
+        live = self.doc_lens[~self.deleted]
+        self.avg_len = float(live.mean()) if len(live) else 0.0
+
+    def _update_idf(self):
+        df = np.diff(self.offsets).astype(np.float32)
+        self.idf = np.log1p((len(self.doc_lens) - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts, k1=1.5, b=0.75):
+        postings = {}
+        doc_lens = np.zeros(len(texts), dtype=np.int32)
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lens[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        vocab = {term: tid for tid, term in enumerate(postings)}
+        sizes = np.fromiter((len(p) for p in postings.values()), dtype=np.int64, count=len(postings))
+        offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        tfs = np.empty(offsets[-1], dtype=np.uint16)
+        for tid, plist in enumerate(postings.values()):
+            start, end = offsets[tid], offsets[tid + 1]
+            entries = np.array(plist, dtype=np.int64)
+            doc_ids[start:end] = entries[:, 0]
+            tfs[start:end] = np.minimum(entries[:, 1], np.iinfo(np.uint16).max)
+        return cls(vocab, offsets, doc_ids, tfs, doc_lens, k1=k1, b=b)
+
+    def __len__(self):
+        return len(self.doc_lens)
+
+    def add(self, texts):
+        """Append docs in place; their ids continue from len(self)."""
+        new = BM25Index.build(texts, k1=self.k1, b=self.b)
+        vocab = dict(self.vocab)
+        for term in new.vocab:
+            vocab.setdefault(term, len(vocab))
+        new_tids = np.fromiter((vocab[term] for term in new.vocab), dtype=np.int64, count=len(new.vocab))
+        terms = np.concatenate([
+            np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets)),
+            np.repeat(new_tids, np.diff(new.offsets))
+        ])
+        # stable sort keeps each term's existing postings ahead of the new docs, so doc ids stay ascending
+        order = np.argsort(terms, kind="stable")
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocab)), out=offsets[1:])
+
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = np.concatenate([self.doc_ids, new.doc_ids + len(self.doc_lens)])[order].astype(np.int32)
+        self.tfs = np.concatenate([self.tfs, new.tfs])[order]
+        self.doc_lens = np.concatenate([self.doc_lens, new.doc_lens])
+        self.deleted = np.concatenate([self.deleted, new.deleted])
+        self._update_avg_len()
+        self._update_idf()
+
+    def remove(self, doc_ids):
+        """Tombstone docs so they never match again."""
+        self.deleted[np.asarray(doc_ids, dtype=np.int64)] = True
+        self._update_avg_len()
+
+    def compact(self):
+        """Copy without the deleted docs; surviving docs are renumbered 0..n-1 in order."""
+        keep = ~self.deleted
+        remap = np.cumsum(keep) - 1
+        terms = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))
+        live = keep[self.doc_ids]
+        offsets = np.zeros(len(self.offsets), dtype=np.int64)
+        np.cumsum(np.bincount(terms[live], minlength=len(self.offsets) - 1), out=offsets[1:])
+        return BM25Index(
+            self.vocab, offsets, remap[self.doc_ids[live]].astype(np.int32), self.tfs[live],
+            self.doc_lens[keep], k1=self.k1, b=self.b
+        )
+
+    def search(self, query, k=6, doc_ids=None):
+        """Return [(score, doc_id), ...] best first, only for docs matching a query term.
+
+        `doc_ids` restricts the search to those docs.
+        """
+        if not len(self.doc_lens):
+            return []
+        scores = np.zeros(len(self.doc_lens), dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lens / max(self.avg_len, 1e-6))
+        for term in set(tokenize(query)):
+            tid = self.vocab.get(term)
+            if tid is None:
+                continue
+            start, end = self.offsets[tid], self.offsets[tid + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            # a term occurs at most once per doc in its posting list, so plain fancy-index add is safe
+            scores[docs] += self.idf[tid] * tf * (self.k1 + 1) / (tf + norm[docs])
+        scores[self.deleted] = 0
+        if doc_ids is not None:
+            allowed = np.zeros(len(scores), dtype=bool)
+            allowed[doc_ids] = True
+            scores[~allowed] = 0
+
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(float(scores[i]), int(i)) for i in matched]
+
+
+def reciprocal_rank_fusion(ranked_lists, k=60, limit=None):
+    """Fuse ranked lists of doc ids: score(d) = sum(1 / (k + rank)). Returns [(score, doc_id)]."""
+    fused = {}
+    for ranked in ranked_lists:
+        for rank, doc_id in enumerate(ranked, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    results = sorted(((score, doc_id) for doc_id, score in fused.items()), key=lambda r: r[0], reverse=True)
+    return results[:limit] if limit else results
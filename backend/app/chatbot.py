@@ -11,19 +11,34 @@ import docx
 import pandas as pd
 from PIL import Image
 import pytesseract
-import mistralai
 import re
 import pickle
-import aiohttp
+import logging
 
+from app.bm25 import BM25Index, reciprocal_rank_fusion
+from app.executors import run_cpu
+from app.metrics import timed, EMBED_BATCH_SIZE, DEADLINE_EXCEEDED, DEGRADED_ANSWERS
+from app.embed_client import embed_client
+from app.llm_gateway import llm_gateway, client, remaining, LLMUnavailable
 from dotenv import load_dotenv
 
 load_dotenv()
-mistralai_api_key = os.getenv("MISTRAL_KEY")
-EMBED_SERVER_URL = os.getenv("EMBED_SERVER_URL")
-EMBED_SERVER_PORT = os.getenv("EMBED_SERVER_PORT")
-
-client = mistralai.Mistral(api_key=mistralai_api_key)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")  # dense, hybrid or lexical
+RETRIEVAL_MODES = ("dense", "hybrid", "lexical")
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "8000"))  # characters per indexed chunk
+# /ask budget: the whole request, plus caps for the query embedding and the index searches;
+# the LLM gets whatever is left
+ASK_TIMEOUT = float(os.getenv("ASK_TIMEOUT", "60"))
+ASK_EMBED_TIMEOUT = float(os.getenv("ASK_EMBED_TIMEOUT", "10"))
+ASK_SEARCH_TIMEOUT = float(os.getenv("ASK_SEARCH_TIMEOUT", "10"))
+DEGRADED_EXCERPT_CHARS = int(os.getenv("DEGRADED_EXCERPT_CHARS", "500"))
+
+logger = logging.getLogger(__name__)
+
+# extraction stage label per extension, e.g. research_gpt_stage_seconds{stage="extract_pdf"}
+EXTRACT_STAGES = {".pdf": "pdf", ".docx": "docx", ".csv": "csv", ".txt": "txt",
+                  ".png": "image", ".jpg": "image", ".jpeg": "image", ".tiff": "image"}
 
 def extract_text_from_pdf_bytes(file_bytes):
     from PyPDF2 import PdfReader
@@ -31,7 +46,7 @@ def extract_text_from_pdf_bytes(file_bytes):
         reader = PdfReader(io.BytesIO(file_bytes))
         return "\n".join([p.extract_text() for p in reader.pages if p.extract_text()])
     except Exception as e:
-        print("PDF read error:", e)
+        logger.warning("PDF read error", extra={"error": str(e)})
         return ""
 
 def extract_text_from_docx_bytes(file_bytes):
@@ -39,7 +54,7 @@ def extract_text_from_docx_bytes(file_bytes):
         doc = docx.Document(io.BytesIO(file_bytes))
         return "\n".join([p.text for p in doc.paragraphs])
     except Exception as e:
-        print("DOCX read error:", e)
+        logger.warning("DOCX read error", extra={"error": str(e)})
         return ""
 
 def extract_text_from_csv_bytes(file_bytes):
@@ -47,7 +62,7 @@ def extract_text_from_csv_bytes(file_bytes):
         df = pd.read_csv(io.BytesIO(file_bytes))
         return df.to_csv(index=False)
     except Exception as e:
-        print("CSV read error:", e)
+        logger.warning("CSV read error", extra={"error": str(e)})
         return ""
 
 def extract_text_from_image_bytes(file_bytes):
@@ -55,12 +70,30 @@ def extract_text_from_image_bytes(file_bytes):
         image = Image.open(io.BytesIO(file_bytes))
         return pytesseract.image_to_string(image)
     except Exception as e:
-        print("Image OCR error:", e)
+        logger.warning("Image OCR error", extra={"error": str(e)})
         return ""
 
 
+def count_pages(file_bytes: bytes, filename: str):
+    """Page count of paged formats (PDF pages, image frames); None for everything else."""
+    ext = os.path.splitext(filename)[-1].lower()
+    try:
+        if ext == ".pdf":
+            return len(PyPDF2.PdfReader(io.BytesIO(file_bytes)).pages)
+        if ext in [".png", ".jpg", ".jpeg", ".tiff"]:
+            return getattr(Image.open(io.BytesIO(file_bytes)), "n_frames", 1)
+    except Exception as e:
+        logger.warning("Page count error", extra={"file": filename, "error": str(e)})
+    return None
+
+
 def extract_text_from_file(file_bytes: bytes, filename: str):
     ext = os.path.splitext(filename)[-1].lower()
+    with timed(f"extract_{EXTRACT_STAGES.get(ext, 'other')}"):
+        return extract_text_by_format(file_bytes, filename, ext)
+
+
+def extract_text_by_format(file_bytes, filename, ext):
     if ext == ".pdf":
         return extract_text_from_pdf_bytes(file_bytes)
     elif ext == ".docx":
@@ -72,7 +105,7 @@ def extract_text_from_file(file_bytes: bytes, filename: str):
     elif ext in [".png", ".jpg", ".jpeg", ".tiff"]:
         return extract_text_from_image_bytes(file_bytes)
     else:
-        print(f"Unsupported file format: {filename}")
+        logger.warning("Unsupported file format", extra={"file": filename})
         return ""
 
 
@@ -81,12 +114,28 @@ def split_text(text, chunk_size=10240):
         chunk_size = 500  # fallback chunk size
     return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
 
+def chunk_document(text, filename, chunk_size=CHUNK_SIZE):
+    """Split a document into chunk dicts that remember their character range in the extracted text."""
+    with timed("chunking"):
+        pieces = split_text(text, chunk_size)
+    chunks = []
+    for idx, chunk in enumerate(pieces):
+        start = idx * chunk_size
+        chunks.append({
+            "text": chunk,
+            "filename": filename,
+            "chunk_index": idx,
+            "start": start,
+            "end": start + len(chunk)
+        })
+    return chunks
+
 async def load_document_chunks(directory, chunk_size=10240):
     chunks = []
     patterns = ["*.pdf", "*.docx", "*.csv", "*.txt", "*.png", "*.jpg", "*.jpeg", "*.tiff"]
     for pattern in patterns:
         for file_path in glob.glob(os.path.join(directory, pattern)):
-            print(f"Processing: {file_path}")
+            logger.info("Processing file", extra={"path": file_path})
             text = extract_text_from_file(file_path)
             if text:
                 split_chunks = split_text(text, chunk_size)
@@ -114,17 +163,18 @@ def load_chunks_from_file(file_path, chunk_size=10240):
 
 
 async def get_text_embedding_async(input_text):
-    # url = "http://host.docker.internal:8000/v1/embeddings"
-    url = f"http://{EMBED_SERVER_URL}:{EMBED_SERVER_PORT}/v1/embeddings"
-    headers = {"Content-Type": "application/json"}
-    payload = {"input": input_text}
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=payload) as response:
-            response.raise_for_status()
-            data = await response.json()
-            embedding = data["data"][0]["embedding"]
-            return embedding
+    """Embed one query in the embedding server's priority lane (hedged across replicas)."""
+    EMBED_BATCH_SIZE.observe(1)
+    with timed("embed"):
+        embeddings = await embed_client.embed([input_text], priority="query")
+    return embeddings[0]
+
+async def get_text_embeddings_async(input_texts):
+    """Embed a list of texts in a single request to the embedding server."""
+    input_texts = list(input_texts)
+    EMBED_BATCH_SIZE.observe(len(input_texts))
+    with timed("embed_batch"):
+        return await embed_client.embed(input_texts, priority="bulk")
 
 # TODO: embedding using mistral, may need to delete
 async def get_text_embedding_async_bk(input_text):
@@ -139,22 +189,33 @@ async def get_text_embedding_async_bk(input_text):
     )
     return result.data[0].embedding
 
-async def run_mistral_async(user_message, model="mistral-large-latest"):
-    await asyncio.sleep(1)
-    loop = asyncio.get_running_loop()
-    chat_response = await loop.run_in_executor(
-        None,
-        lambda: client.chat.complete(
-            model=model,
-            messages=[{"role": "user", "content": user_message}]
-        )
-    )
-    return chat_response.choices[0].message.content
+async def run_mistral_async(user_message, model="mistral-large-latest", deadline=None):
+    """Chat completion through the LLM gateway (concurrency cap, queue, rate limits, retries)."""
+    return await llm_gateway.complete(user_message, model=model, deadline=deadline)
+
+
+class DeadlineExceeded(Exception):
+    """A request stage ran out of time (its own timeout or the request deadline)."""
+
+    def __init__(self, stage):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+
+async def within(awaitable, deadline, limit, stage):
+    """Await one stage, bounded by its own `limit` and by what is left before `deadline`."""
+    left = remaining(deadline)
+    timeout = limit if left is None else max(0.0, min(limit, left))
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        DEADLINE_EXCEEDED.labels(stage).inc()
+        raise DeadlineExceeded(stage)
 
 
 async def update_index(documents_dir, chunk_size, save_dir, append=False):
     import app.memory as memory
-    print("Updating index from:", documents_dir)
+    logger.info("Updating index", extra={"documents_dir": documents_dir})
 
     # Load existing if appending
     faiss_path = os.path.join(save_dir, "faiss.index")
@@ -174,7 +235,7 @@ async def update_index(documents_dir, chunk_size, save_dir, append=False):
     new_chunks = [c for c in all_chunks if c["filename"] not in old_filenames]
 
     if not new_chunks:
-        print("No new chunks to embed.")
+        logger.info("No new chunks to embed")
         memory.global_index = index
         memory.global_chunks = old_chunks
         return
@@ -185,13 +246,13 @@ async def update_index(documents_dir, chunk_size, save_dir, append=False):
     faiss.normalize_L2(emb_array)
 
     if index:
-        print("Appending to index...")
+        logger.info("Appending to index")
         start_id = len(old_chunks)
         ids = np.arange(start_id, start_id + len(new_chunks)).astype(np.int64)
         index.add_with_ids(emb_array, ids)
         all_chunks = old_chunks + new_chunks
     else:
-        print("Creating new index...")
+        logger.info("Creating new index")
         dim = emb_array.shape[1]
         index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
         ids = np.arange(len(new_chunks)).astype(np.int64)
@@ -208,20 +269,138 @@ async def update_index(documents_dir, chunk_size, save_dir, append=False):
 
 
 
-async def answer_question(question, index, chunks):
-    if not index or not chunks:
-        print("No index loaded.")
-        return None, []
+def file_chunk_ids(collection):
+    """{filename: (chunk ids, their chunk_index)} for a loaded collection, built once and cached in it."""
+    files = collection.get("file_ids")
+    if files is None:
+        grouped = {}
+        for chunk_id, chunk in enumerate(collection["chunks"]):
+            if chunk is not None:
+                ids, positions = grouped.setdefault(chunk["filename"], ([], []))
+                ids.append(chunk_id)
+                positions.append(chunk["chunk_index"])
+        files = {
+            filename: (np.array(ids, dtype=np.int64), np.array(positions, dtype=np.int64))
+            for filename, (ids, positions) in grouped.items()
+        }
+        collection["file_ids"] = files
+    return files
+
+
+def filter_chunk_ids(collection, filenames=None, chunk_ranges=None):
+    """Sorted ids of the chunks matching the filters, or None when there are no filters.
+
+    `chunk_ranges` is [{"filename": ..., "start": ..., "end": ...}] over chunk_index, end exclusive and optional.
+    """
+    if not filenames and not chunk_ranges:
+        return None
+    files = file_chunk_ids(collection)
+    selected = [files[f][0] for f in filenames or [] if f in files]
+    for chunk_range in chunk_ranges or []:
+        if chunk_range.get("filename") not in files:
+            continue
+        ids, positions = files[chunk_range["filename"]]
+        mask = positions >= (chunk_range.get("start") or 0)
+        if chunk_range.get("end") is not None:
+            mask &= positions < chunk_range["end"]
+        selected.append(ids[mask])
+    return np.unique(np.concatenate(selected)) if selected else np.array([], dtype=np.int64)
+
+
+def search_params(ids):
+    """FAISS search parameters restricting a search to sorted chunk ids.
+
+    A file's chunks are added together, so a single file is one contiguous id
+    range; anything else goes through a batch selector. Either way non-members
+    are skipped inside the index scan rather than filtered afterwards.
+    """
+    if ids is None:
+        return None
+    if len(ids) and ids[-1] - ids[0] + 1 == len(ids):
+        return faiss.SearchParameters(sel=faiss.IDSelectorRange(int(ids[0]), int(ids[-1]) + 1))
+    return faiss.SearchParameters(sel=faiss.IDSelectorBatch(ids))
+
+
+def search_index_ids(index, query_vec, k=6, ids=None):
+    """Search one FAISS index and return [(score, chunk_id), ...] best first (ids are chunk list slots)."""
+    with timed("faiss_search"):
+        distances, indices = index.search(query_vec, k, params=search_params(ids))
+    return [(float(score), int(idx)) for score, idx in zip(distances[0], indices[0]) if idx >= 0]
+
+
+def search_index_ids_batch(index, query_mat, k=6):
+    """One matrix search for many queries; returns a [(score, chunk_position), ...] list per query row."""
+    with timed("faiss_search_batch"):
+        distances, indices = index.search(query_mat, k)
+    return [
+        [(float(score), int(idx)) for score, idx in zip(row_d, row_i) if idx >= 0]
+        for row_d, row_i in zip(distances, indices)
+    ]
+
+
+def search_index(index, chunks, query_vec, k=6, ids=None):
+    """Search one FAISS index and return [(score, chunk), ...] best first."""
+    return [(score, chunks[idx]) for score, idx in search_index_ids(index, query_vec, k, ids) if idx < len(chunks)]
+
+
+def live_chunks(chunks):
+    """Chunks of a collection minus the tombstones (None) left by removed files."""
+    return [c for c in chunks if c is not None]
+
+
+def bm25_search(bm25, question, k=6, ids=None):
+    with timed("bm25_search"):
+        return bm25.search(question, k, ids)
+
+
+def build_bm25_index(chunks):
+    with timed("bm25_build"):
+        bm25 = BM25Index.build([c["text"] if c is not None else "" for c in chunks])
+    tombstones = [i for i, c in enumerate(chunks) if c is None]
+    if tombstones:
+        bm25.remove(tombstones)
+    return bm25
+
+
+async def retrieve(question, collection, mode="dense", k=6, query_vec=None, ids=None, deadline=None):
+    """Return [(score, chunk), ...] from one collection.
+
+    dense   — FAISS only
+    lexical — BM25 only, no embedding call at all
+    hybrid  — BM25 runs while the query is embedded and FAISS searched,
+              the two rankings are merged with reciprocal rank fusion
+
+    `ids` (from filter_chunk_ids) restricts both searches to those chunks.
+    With a `deadline`, the embedding and the searches are cut off at their
+    stage timeouts and DeadlineExceeded is raised.
+    """
+    index, chunks, bm25 = collection["index"], collection["chunks"], collection.get("bm25")
+    if mode != "dense" and bm25 is None:
+        mode = "dense"
+
+    if mode == "lexical":
+        hits = await within(run_cpu(bm25_search, bm25, question, k, ids), deadline, ASK_SEARCH_TIMEOUT, "search")
+        return [(score, chunks[idx]) for score, idx in hits]
+
+    if mode == "dense":
+        if query_vec is None:
+            query_vec = await within(embed_query(question), deadline, ASK_EMBED_TIMEOUT, "embed")
+        return await within(run_cpu(search_index, index, chunks, query_vec, k, ids), deadline, ASK_SEARCH_TIMEOUT, "search")
+
+    depth = k * 4
+    lexical_task = run_cpu(bm25_search, bm25, question, depth, ids)
+    if query_vec is None:
+        query_vec = await within(embed_query(question), deadline, ASK_EMBED_TIMEOUT, "embed")
+    dense_hits, lexical_hits = await within(
+        asyncio.gather(run_cpu(search_index_ids, index, query_vec, depth, ids), lexical_task),
+        deadline, ASK_SEARCH_TIMEOUT, "search"
+    )
+    fused = reciprocal_rank_fusion([[i for _, i in dense_hits], [i for _, i in lexical_hits]], limit=k)
+    return [(score, chunks[idx]) for score, idx in fused if idx < len(chunks)]
 
-    q_embed = await get_text_embedding_async(question)
-    query_vec = np.array([np.array(q_embed, dtype=np.float32)])
-    faiss.normalize_L2(query_vec)
-    distances, indices = index.search(query_vec, k=6)
-    evidence = []
-    for idx in indices[0]:
-        if 0 <= idx < len(chunks):
-            evidence.append(chunks[idx])
-    prompt = f"""
+
+def build_answer_prompt(question, evidence):
+    return f"""
 Below are excerpts extracted from original documents:
 ---------------------
 {chr(10).join([e['text'] for e in evidence])}
@@ -232,20 +411,158 @@ If the relevant evidence is not available, state so.
 Query: {question}
 Answer:
 """
-    answer = await run_mistral_async(prompt)
+
+
+def match_quoted_evidence(answer, chunks, collection=None):
+    """Map the quotes in an answer back to the chunks they came from."""
+    with timed("evidence_match"):
+        quoted = re.findall(r'\"(.+?)\"', answer, re.DOTALL)
+        quoted = [q.strip() for q in quoted if len(q.strip()) > 20]
+        filtered = []
+        for quote in quoted:
+            for chunk in chunks:
+                if chunk is not None and quote in chunk["text"]:
+                    item = {
+                        "text": quote,
+                        "filename": chunk["filename"],
+                        "chunk_index": chunk["chunk_index"]
+                    }
+                    if collection is not None:
+                        item["collection"] = collection
+                    filtered.append(item)
+                    break
+    return filtered
+
+
+async def embed_query(question):
+    q_embed = await get_text_embedding_async(question)
+    query_vec = np.array([np.array(q_embed, dtype=np.float32)])
+    faiss.normalize_L2(query_vec)
+    return query_vec
+
+
+async def embed_queries(questions):
+    q_embeds = await get_text_embeddings_async(questions)
+    query_mat = np.array(q_embeds, dtype=np.float32)
+    faiss.normalize_L2(query_mat)
+    return query_mat
+
+
+async def retrieve_batch(questions, collection, mode="dense", k=6):
+    """Batched `retrieve`: one embedding request and one matrix search for all questions."""
+    index, chunks, bm25 = collection["index"], collection["chunks"], collection.get("bm25")
+    if mode != "dense" and bm25 is None:
+        mode = "dense"
+    depth = k if mode == "dense" else k * 4
+
+    def lexical_search():
+        with timed("bm25_search_batch"):
+            return [bm25.search(q, depth) for q in questions]
+
+    if mode == "lexical":
+        rows = await run_cpu(lexical_search)
+    else:
+        lexical_task = run_cpu(lexical_search) if mode == "hybrid" else None
+        query_mat = await embed_queries(questions)
+        rows = await run_cpu(search_index_ids_batch, index, query_mat, depth)
+        if lexical_task is not None:
+            lexical_rows = await lexical_task
+            rows = [
+                reciprocal_rank_fusion([[i for _, i in dense], [i for _, i in lexical]], limit=k)
+                for dense, lexical in zip(rows, lexical_rows)
+            ]
+    return [[(score, chunks[idx]) for score, idx in row if idx < len(chunks)] for row in rows]
+
+
+async def answer_questions_batch(questions, collection, mode="dense", k=6, concurrency=BATCH_LLM_CONCURRENCY):
+    """Answer many questions against one collection, yielding (position, answer, evidence) as each finishes."""
+    all_hits = await retrieve_batch(questions, collection, mode=mode, k=k)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def answer_one(position, question, hits):
+        async with semaphore:
+            evidence = [chunk for _, chunk in hits]
+            try:
+                answer = await run_mistral_async(build_answer_prompt(question, evidence))
+            except Exception as e:
+                logger.warning("Batch answer error", extra={"position": position, "error": str(e)})
+                return position, None, []
+        return position, answer, await run_cpu(match_quoted_evidence, answer, collection["chunks"])
+
+    tasks = [asyncio.create_task(answer_one(i, q, h)) for i, (q, h) in enumerate(zip(questions, all_hits))]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def retrieval_only_answer(evidence):
+    """Fallback when the LLM cannot answer in time: the retrieved excerpts themselves."""
+    DEGRADED_ANSWERS.inc()
+    excerpts = [dict(e, text=e["text"][:DEGRADED_EXCERPT_CHARS]) for e in evidence]
+    lines = ["The answer could not be generated in time. These are the most relevant excerpts:"]
+    lines += [f'- {e["filename"]} (chunk {e["chunk_index"]}): "{e["text"]}"' for e in excerpts]
+    return "\n".join(lines), excerpts
+
+
+async def answer_question(question, index, chunks, bm25=None, mode="dense", ids=None, deadline=None):
+    """Returns (answer, evidence, degraded); degraded answers list the retrieved excerpts instead."""
+    if not index or not chunks:
+        logger.warning("No index loaded")
+        return None, [], False
+
+    hits = await retrieve(question, {"index": index, "chunks": chunks, "bm25": bm25}, mode=mode, k=6, ids=ids, deadline=deadline)
+    evidence = [chunk for _, chunk in hits]
+    try:
+        answer = await run_mistral_async(build_answer_prompt(question, evidence), deadline=deadline)
+    except LLMUnavailable as e:
+        if not evidence:
+            raise
+        logger.warning("Answering from retrieval only", extra={"error": str(e)})
+        return *retrieval_only_answer(evidence), True
 
     # Extract quoted evidence for matching
-    quoted = re.findall(r'\"(.+?)\"', answer, re.DOTALL)
-    quoted = [q.strip() for q in quoted if len(q.strip()) > 20]
-    filtered = []
-    for quote in quoted:
-        for idx, chunk in enumerate(chunks):
-            if quote in chunk["text"]:
-                filtered.append({
-                    "text": quote,
-                    "filename": chunk["filename"],
-                    "chunk_index": chunk["chunk_index"]
-                })
-                break
-
-    return answer, filtered
+    return answer, await run_cpu(match_quoted_evidence, answer, chunks), False
+
+
+async def answer_question_multi(question, collections, k=6, mode="dense", ids=None, deadline=None):
+    """Answer a question against several collections at once.
+
+    `collections` maps collection name -> {"index": ..., "chunks": ..., "bm25": ...};
+    `ids` optionally maps collection name -> chunk ids to restrict that collection to.
+    The question is embedded once, every collection is searched concurrently
+    and the hits are merged by score, so the cost is close to the slowest search.
+    Returns (answer, evidence, degraded) like answer_question.
+    """
+    collections = {name: c for name, c in collections.items() if c.get("index") and c.get("chunks")}
+    if not collections:
+        logger.warning("No index loaded")
+        return None, [], False
+
+    query_vec = None if mode == "lexical" else await within(embed_query(question), deadline, ASK_EMBED_TIMEOUT, "embed")
+    names = list(collections)
+    results = await asyncio.gather(*(
+        retrieve(question, collections[name], mode=mode, k=k, query_vec=query_vec, ids=(ids or {}).get(name), deadline=deadline)
+        for name in names
+    ))
+
+    hits = [(score, name, chunk) for name, result in zip(names, results) for score, chunk in result]
+    hits.sort(key=lambda h: h[0], reverse=True)
+    evidence = [chunk for _, _, chunk in hits[:k]]
+    try:
+        answer = await run_mistral_async(build_answer_prompt(question, evidence), deadline=deadline)
+    except LLMUnavailable as e:
+        if not evidence:
+            raise
+        logger.warning("Answering from retrieval only", extra={"error": str(e)})
+        sources = [dict(chunk, collection=name) for _, name, chunk in hits[:k]]
+        return *retrieval_only_answer(sources), True
+
+    # Quotes are matched within each collection so evidence carries its source
+    matched = await asyncio.gather(*(
+        run_cpu(match_quoted_evidence, answer, collections[name]["chunks"], collection=name)
+        for name in names
+    ))
+    return answer, [item for items in matched for item in items], False
@@ -0,0 +1,143 @@
+# collection_store.py — loads collections (FAISS index + chunks) from S3 and caches them in memory
+#
+# The cache keeps the most recently used collections up to COLLECTION_CACHE_MB of stored
+# index + chunks + BM25 bytes and evicts the least recently used beyond that.
+import os
+import time
+import pickle
+import asyncio
+import logging
+
+import app.memory as memory
+from app.aws_s3_utils import download_file_bytes_from_s3, download_faiss_from_s3, object_size, s3_key_for
+from app.chatbot import build_bm25_index
+from app.metrics import timed, COLLECTION_LOADS
+
+from dotenv import load_dotenv
+
+load_dotenv()
+COLLECTION_CACHE_MB = float(os.getenv("COLLECTION_CACHE_MB", os.getenv("WARMUP_MEMORY_MB", "2048")))
+
+logger = logging.getLogger(__name__)
+
+# in-flight downloads by collection version; concurrent loaders of the same version share one
+_loads = {}
+
+
+def load_collection_from_s3(chunks_path, faiss_path, bm25_path=None):
+    """Download a collection; its "size" is the stored bytes, taken from the downloads themselves."""
+    data = download_file_bytes_from_s3(chunks_path)
+    chunks = pickle.loads(data)
+    size = len(data)
+    index = download_faiss_from_s3(faiss_path)
+    if not hasattr(index, "ntotal"):
+        raise ValueError("❌ FAISS index object is invalid (not really an index)")
+    size += index.ntotal * (index.d * 4 + 8)  # float32 vectors + int64 ids, what the serialized index holds
+
+    bm25 = None
+    if bm25_path:
+        try:
+            data = download_file_bytes_from_s3(bm25_path)
+            bm25 = pickle.loads(data)
+        except Exception:
+            bm25 = None
+    if bm25 is None or len(bm25) != len(chunks):
+        # collections embedded before the lexical index existed
+        bm25 = build_bm25_index(chunks)
+        data = b""
+    size += len(data) or sum(a.nbytes for a in (bm25.offsets, bm25.doc_ids, bm25.tfs, bm25.doc_lens))
+    return {"chunks": chunks, "index": index, "bm25": bm25, "size": size}
+
+
+def collection_version(embedding):
+    """Identifies the stored collection: its S3 keys plus the row's version counter."""
+    return (embedding.chunks_path, embedding.faiss_path, embedding.version or 0)
+
+
+def stored_size(user_id, name, chunks_path, faiss_path):
+    """Bytes of the stored index, chunks and BM25 index, for sizing a collection before it is downloaded."""
+    keys = (faiss_path, chunks_path, s3_key_for(user_id, name, "bm25.pkl"))
+    return sum(object_size(key) for key in keys if key)
+
+
+def cached_bytes():
+    return sum(c.get("size", 0) for c in memory.collections.values())
+
+
+def cache_collection(user_id, name, collection, version=None):
+    collection["name"] = name
+    collection["version"] = version
+    collection["loaded_at"] = time.time()
+    memory.collections.pop((user_id, name), None)
+    memory.collections[(user_id, name)] = collection
+    evict_collections(COLLECTION_CACHE_MB * 1024 * 1024)
+    return collection
+
+
+def touch_collection(user_id, name):
+    """Mark a cached collection as just used."""
+    if (user_id, name) in memory.collections:
+        memory.collections.move_to_end((user_id, name))
+
+
+def evict_collections(budget):
+    """Drop least recently used collections until the cache fits `budget` bytes; the newest always stays."""
+    total = cached_bytes()
+    while total > budget and len(memory.collections) > 1:
+        (user_id, name), collection = memory.collections.popitem(last=False)
+        total -= collection.get("size", 0)
+        if memory.user_sessions.get(user_id) is collection:
+            del memory.user_sessions[user_id]
+        logger.info("Collection evicted from cache", extra={"embedding": name, "bytes": collection.get("size", 0)})
+
+
+def drop_collection(user_id, name):
+    memory.collections.pop((user_id, name), None)
+
+
+async def _load(user_id, name, version):
+    chunks_path, faiss_path, _ = version
+    with timed("collection_load"):
+        collection = await asyncio.to_thread(
+            load_collection_from_s3, chunks_path, faiss_path, s3_key_for(user_id, name, "bm25.pkl")
+        )
+    current = memory.collections.get((user_id, name))
+    if current is not None and current.get("version") and current["version"][2] > version[2]:
+        # a newer version was cached while this one downloaded; serve it to our callers only
+        collection.update(name=name, version=version, loaded_at=time.time())
+        return collection
+    return cache_collection(user_id, name, collection, version)
+
+
+async def get_collection(user_id, embedding, reload=False):
+    """Return the in-memory collection for an embedding row, downloading it from S3 if needed.
+
+    The cached copy is used while it matches the row's version. Concurrent calls for
+    the same version await a single download and get the same (read-only) objects.
+    """
+    version = collection_version(embedding)
+    cached = memory.collections.get((user_id, embedding.name))
+    if not reload and cached is not None and cached.get("version") == version:
+        COLLECTION_LOADS.labels("cached").inc()
+        touch_collection(user_id, embedding.name)
+        return cached
+
+    if not embedding.chunks_path or not embedding.faiss_path:
+        raise ValueError(f"Embedding paths missing for '{embedding.name}'")
+
+    task = _loads.get(version)
+    if task is None:
+        COLLECTION_LOADS.labels("loaded").inc()
+        task = asyncio.ensure_future(_load(user_id, embedding.name, version))
+        _loads[version] = task
+        task.add_done_callback(lambda _: _loads.pop(version, None))
+    else:
+        COLLECTION_LOADS.labels("coalesced").inc()
+    # shielded: a caller that goes away must not cancel the download the others are waiting on
+    return await asyncio.shield(task)
+
+
+async def get_collections(user_id, embeddings):
+    """Load several collections concurrently; returns {embedding_name: collection}."""
+    collections = await asyncio.gather(*(get_collection(user_id, e) for e in embeddings))
+    return {e.name: c for e, c in zip(embeddings, collections)}
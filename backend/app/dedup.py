@@ -0,0 +1,110 @@
+# dedup.py — content hashes for uploaded files and MinHash/LSH near-duplicate detection for chunks
+import hashlib
+import zlib
+
+import numpy as np
+
+from app.bm25 import tokenize
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def shingles(text, size=5):
+    """crc32 of every `size`-word window of the text (uint64 array, possibly empty)."""
+    tokens = tokenize(text)
+    if len(tokens) < size:
+        return np.array([zlib.crc32(" ".join(tokens).encode())] if tokens else [], dtype=np.uint64)
+    grams = {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+    return np.fromiter((zlib.crc32(g.encode()) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+class MinHasher:
+    """MinHash signatures with `num_perm` universal hash functions (a * x + b) mod p.
+
+    a, b and the shingle hashes are all below 2**32, so a * x + b fits in uint64.
+    """
+
+    def __init__(self, num_perm=128, seed=1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, int(MAX_HASH), num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, int(MAX_HASH), num_perm, dtype=np.uint64)
+
+    def signature(self, text):
+        hashes = shingles(text)
+        if len(hashes) == 0:
+            return None
+        return ((np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME).min(axis=0)
+
+
+class NearDuplicateIndex:
+    """LSH over MinHash signatures.
+
+    Signatures are split into `bands` bands; texts sharing any band are
+    candidates, and a candidate counts as a near-duplicate when the estimated
+    Jaccard similarity of their shingle sets is at least `threshold`.
+    """
+
+    def __init__(self, threshold=0.85, num_perm=128, bands=16):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = []
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def query(self, signature):
+        """Id of an indexed near-duplicate of `signature`, or None."""
+        seen = set()
+        for band, key in zip(self.buckets, self._band_keys(signature)):
+            for candidate in band.get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if np.mean(self.signatures[candidate] == signature) >= self.threshold:
+                    return candidate
+        return None
+
+    def add(self, signature):
+        doc_id = len(self.signatures)
+        self.signatures.append(signature)
+        for band, key in zip(self.buckets, self._band_keys(signature)):
+            band.setdefault(key, []).append(doc_id)
+        return doc_id
+
+
+def find_near_duplicate_chunks(existing_texts, new_texts, threshold=0.85):
+    """Positions in `new_texts` that near-duplicate an existing text or an earlier new text.
+
+    Returns {new position: ("existing" | "new", position of the original)}.
+    """
+    index = NearDuplicateIndex(threshold)
+    origins = []
+    for pos, text in enumerate(existing_texts):
+        signature = index.hasher.signature(text)
+        if signature is not None:
+            index.add(signature)
+            origins.append(("existing", pos))
+
+    duplicates = {}
+    for pos, text in enumerate(new_texts):
+        signature = index.hasher.signature(text)
+        if signature is None:
+            continue
+        match = index.query(signature)
+        if match is not None:
+            duplicates[pos] = origins[match]
+            continue
+        index.add(signature)
+        origins.append(("new", pos))
+    return duplicates
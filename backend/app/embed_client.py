@@ -0,0 +1,227 @@
+# embed_client.py — embedding server client with client-side load balancing across replicas
+#
+# EMBED_SERVER_URLS=host1:8000,host2:8000 (or the single EMBED_SERVER_URL + EMBED_SERVER_PORT).
+# Each call goes to the healthy replica with the fewest requests in flight. A replica
+# that fails EMBED_EJECT_AFTER times in a row, or fails its health check, is ejected
+# until a health check passes again. Failed calls (connection errors, 429, 5xx) are
+# retried on another replica with jittered exponential backoff. Query embeddings
+# still pending after the EMBED_HEDGE_PERCENTILE latency are duplicated to a second
+# replica and the first answer wins.
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+
+import aiohttp
+import numpy as np
+
+from app.metrics import EMBED_REQUESTS, EMBED_HEDGES
+from dotenv import load_dotenv
+
+load_dotenv()
+EMBED_SERVER_URL = os.getenv("EMBED_SERVER_URL")
+EMBED_SERVER_PORT = os.getenv("EMBED_SERVER_PORT")
+EMBED_SERVER_URLS = os.getenv("EMBED_SERVER_URLS")  # comma separated host:port or http(s):// URLs
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "300"))
+EMBED_RETRIES = int(os.getenv("EMBED_RETRIES", "4"))
+EMBED_BACKOFF_BASE = float(os.getenv("EMBED_BACKOFF_BASE", "0.2"))  # seconds
+EMBED_BACKOFF_MAX = float(os.getenv("EMBED_BACKOFF_MAX", "10"))
+EMBED_EJECT_AFTER = int(os.getenv("EMBED_EJECT_AFTER", "3"))  # consecutive failures
+EMBED_HEALTH_PATH = os.getenv("EMBED_HEALTH_PATH", "/ready")
+EMBED_HEALTH_INTERVAL = float(os.getenv("EMBED_HEALTH_INTERVAL", "5"))
+EMBED_HEDGE_PERCENTILE = float(os.getenv("EMBED_HEDGE_PERCENTILE", "95"))  # 0 disables hedging
+EMBED_HEDGE_MIN_SAMPLES = int(os.getenv("EMBED_HEDGE_MIN_SAMPLES", "20"))
+
+logger = logging.getLogger(__name__)
+
+
+class EmbedServerError(Exception):
+    """An embedding request failed on every attempt."""
+
+
+class RetryableError(Exception):
+    def __init__(self, message, retry_after=None, busy=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.busy = busy  # 429: the replica is overloaded, not broken
+
+
+def replica_urls():
+    if EMBED_SERVER_URLS:
+        entries = [u.strip() for u in EMBED_SERVER_URLS.split(",") if u.strip()]
+    else:
+        entries = [f"{EMBED_SERVER_URL}:{EMBED_SERVER_PORT}"]
+    return [(u if u.startswith(("http://", "https://")) else f"http://{u}").rstrip("/") for u in entries]
+
+
+class Replica:
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.failures = 0  # consecutive
+        self.ejected = False
+
+    def succeeded(self):
+        self.failures = 0
+
+    def failed(self):
+        self.failures += 1
+        if self.failures >= EMBED_EJECT_AFTER and not self.ejected:
+            self.ejected = True
+            logger.warning("Embedding replica ejected", extra={"replica": self.url, "failures": self.failures})
+
+
+class EmbedClient:
+    def __init__(self, urls):
+        self.replicas = [Replica(u) for u in urls]
+        self.query_latencies = deque(maxlen=500)  # seconds, successful query embeddings
+        self._session = None
+        self._loop = None
+        self._health_task = None
+
+    def _ensure_started(self):
+        """One aiohttp session and health-check task per event loop (the API and each worker run their own)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=EMBED_TIMEOUT))
+            self._health_task = loop.create_task(self._health_checks()) if len(self.replicas) > 1 else None
+        return self._session
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+        if self._session is not None:
+            await self._session.close()
+        self._session = self._loop = self._health_task = None
+
+    def pick(self, exclude=()):
+        """Least outstanding requests among healthy replicas (random among ties); ejected ones only as a last resort."""
+        candidates = [r for r in self.replicas if r not in exclude] or list(self.replicas)
+        healthy = [r for r in candidates if not r.ejected] or candidates
+        fewest = min(r.outstanding for r in healthy)
+        return random.choice([r for r in healthy if r.outstanding == fewest])
+
+    async def _health_checks(self):
+        while True:
+            await asyncio.sleep(EMBED_HEALTH_INTERVAL)
+            await asyncio.gather(*(self._check(r) for r in self.replicas))
+
+    async def _check(self, replica):
+        try:
+            async with self._session.get(replica.url + EMBED_HEALTH_PATH, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                healthy = response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            healthy = False
+        if healthy and replica.ejected:
+            logger.info("Embedding replica back in rotation", extra={"replica": replica.url})
+            replica.ejected = False
+            replica.failures = 0
+        elif not healthy and not replica.ejected:
+            logger.warning("Embedding replica failed its health check", extra={"replica": replica.url})
+            replica.ejected = True
+
+    async def _post(self, replica, payload):
+        session = self._ensure_started()
+        replica.outstanding += 1
+        try:
+            async with session.post(replica.url + "/v1/embeddings", json=payload) as response:
+                if response.status == 429 or response.status >= 500:
+                    retry_after = response.headers.get("Retry-After")
+                    raise RetryableError(
+                        f"HTTP {response.status} from {replica.url}",
+                        float(retry_after) if retry_after and retry_after.isdigit() else None,
+                        busy=response.status == 429
+                    )
+                response.raise_for_status()
+                data = await response.json()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            raise RetryableError(f"{type(e).__name__} from {replica.url}: {e}") from e
+        finally:
+            replica.outstanding -= 1
+        items = sorted(data["data"], key=lambda d: d["index"])
+        return [d["embedding"] for d in items]
+
+    async def _attempt(self, replica, payload):
+        try:
+            vectors = await self._post(replica, payload)
+        except RetryableError as e:
+            # busy means back off, but keep the replica in rotation
+            if not e.busy:
+                replica.failed()
+            EMBED_REQUESTS.labels(replica.url, "busy" if e.busy else "error").inc()
+            raise
+        replica.succeeded()
+        EMBED_REQUESTS.labels(replica.url, "ok").inc()
+        return vectors
+
+    async def _with_retries(self, payload):
+        tried = []
+        last_error = None
+        for attempt in range(EMBED_RETRIES + 1):
+            replica = self.pick(exclude=tried)
+            try:
+                return await self._attempt(replica, payload)
+            except RetryableError as e:
+                last_error = e
+                tried = [replica]  # prefer a different replica next time
+                if attempt == EMBED_RETRIES:
+                    break
+                # full jitter, at least the server's Retry-After when there is nowhere else to go
+                delay = random.uniform(0, min(EMBED_BACKOFF_MAX, EMBED_BACKOFF_BASE * 2 ** attempt))
+                if e.retry_after is not None and len(self.replicas) == 1:
+                    delay = max(delay, min(e.retry_after, EMBED_BACKOFF_MAX))
+                logger.info("Retrying embedding request", extra={"attempt": attempt + 1, "delay": round(delay, 3), "error": str(e)})
+                await asyncio.sleep(delay)
+        raise EmbedServerError(f"Embedding request failed after {EMBED_RETRIES + 1} attempts: {last_error}")
+
+    def hedge_delay(self):
+        if EMBED_HEDGE_PERCENTILE <= 0 or len(self.replicas) < 2 or len(self.query_latencies) < EMBED_HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(self.query_latencies, EMBED_HEDGE_PERCENTILE))
+
+    async def embed(self, texts, priority="bulk"):
+        payload = {"input": list(texts), "priority": priority}
+        if priority != "query":
+            return await self._with_retries(payload)
+
+        start = time.perf_counter()
+        delay = self.hedge_delay()
+        if delay is None:
+            vectors = await self._with_retries(payload)
+        else:
+            vectors = await self._hedged(payload, delay)
+        self.query_latencies.append(time.perf_counter() - start)
+        return vectors
+
+    async def _hedged(self, payload, delay):
+        primary = asyncio.ensure_future(self._with_retries(payload))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+
+            # least-outstanding routing sends the duplicate to a replica other than the slow one
+            EMBED_HEDGES.labels("sent").inc()
+            hedge = asyncio.ensure_future(self._with_retries(payload))
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            EMBED_HEDGES.labels("won").inc()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # the loser, or both requests when the caller is cancelled
+            for task in pending:
+                task.cancel()
+
+
+embed_client = EmbedClient(replica_urls())
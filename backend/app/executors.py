@@ -0,0 +1,42 @@
+# executors.py — dedicated thread pool for CPU-bound retrieval work (FAISS, BM25, evidence matching)
+import os
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import faiss
+
+from dotenv import load_dotenv
+
+load_dotenv()
+CPU_COUNT = os.cpu_count() or 1
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", str(min(8, CPU_COUNT))))
+# FAISS releases the GIL, so searches on different threads really run in parallel.
+# Keep workers * OpenMP threads close to the core count so they don't oversubscribe.
+FAISS_OMP_THREADS = int(os.getenv("FAISS_OMP_THREADS", str(max(1, CPU_COUNT // RETRIEVAL_WORKERS))))
+
+
+def _init_worker():
+    # OpenMP thread counts are per calling thread, so set it in every pool thread
+    faiss.omp_set_num_threads(FAISS_OMP_THREADS)
+
+
+faiss.omp_set_num_threads(FAISS_OMP_THREADS)
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_WORKERS,
+    thread_name_prefix="retrieval",
+    initializer=_init_worker
+)
+
+
+def run_cpu(func, *args, **kwargs):
+    """Schedule CPU-bound work on the retrieval pool; returns an awaitable future."""
+    loop = asyncio.get_running_loop()
+    # run in a copy of the caller's context so per-request timings follow the work
+    context = contextvars.copy_context()
+    return loop.run_in_executor(retrieval_executor, partial(context.run, func, *args, **kwargs))
+
+
+def shutdown_executors():
+    retrieval_executor.shutdown(wait=False, cancel_futures=True)
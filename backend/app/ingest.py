@@ -0,0 +1,728 @@
+# ingest.py — durable ingestion jobs: staged uploads, batched embedding with S3 checkpoints, index merge
+# Jobs are rows in `ingestion_jobs`; the API enqueues them and `ingest_worker.py` processes them.
+import os
+import io
+import socket
+import logging
+import asyncio
+import mimetypes
+import uuid
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+import faiss
+from sqlalchemy import select, update, delete, or_, and_
+from sqlalchemy.dialects.postgresql import insert
+
+from app.pgsql.database import AsyncSessionLocal
+from app.pgsql.models import Embedding, IngestionJob, Document
+from app.dedup import content_hash, find_near_duplicate_chunks
+from app.metrics import timed
+from app.chatbot import extract_text_from_file, count_pages, chunk_document, get_text_embeddings_async, build_bm25_index, live_chunks, CHUNK_SIZE
+from app.collection_store import load_collection_from_s3
+from app.aws_s3_utils import (
+    upload_bytes_to_s3, download_file_bytes_from_s3, upload_json_to_s3, upload_pickle_to_s3,
+    download_pickle_from_s3, upload_faiss_to_s3, delete_prefix_from_s3,
+    delete_from_s3, s3_key_for, extracted_key_for, document_key_for
+)
+
+from dotenv import load_dotenv
+
+load_dotenv()
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "16"))  # chunks per embedding request / checkpoint
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "2"))
+INGEST_HEARTBEAT_INTERVAL = float(os.getenv("INGEST_HEARTBEAT_INTERVAL", "15"))
+INGEST_STALE_AFTER = float(os.getenv("INGEST_STALE_AFTER", "120"))  # running jobs without a heartbeat are reclaimed
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+INGEST_RETRY_BACKOFF = float(os.getenv("INGEST_RETRY_BACKOFF", "30"))  # seconds before the 1st retry, doubling
+INGEST_RETRY_BACKOFF_MAX = float(os.getenv("INGEST_RETRY_BACKOFF_MAX", "600"))
+CHUNK_DEDUP = os.getenv("CHUNK_DEDUP", "false").lower() == "true"  # default for the /embed-files dedup_chunks flag
+CHUNK_DEDUP_THRESHOLD = float(os.getenv("CHUNK_DEDUP_THRESHOLD", "0.85"))  # estimated Jaccard similarity
+COMPACT_TOMBSTONE_RATIO = float(os.getenv("COMPACT_TOMBSTONE_RATIO", "0.2"))  # queue a compaction above this share of removed chunks
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobFailed(Exception):
+    """Permanent failure; the job is not retried."""
+
+
+def document_media_type(filename):
+    return mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+
+def extracted_document(filename, doc_chunks):
+    return {
+        "filename": filename,
+        "chunk_size": CHUNK_SIZE,
+        "chunks": [
+            {"chunk_index": c["chunk_index"], "start": c.get("start"), "end": c.get("end"), "text": c["text"]}
+            for c in doc_chunks
+        ]
+    }
+
+
+def add_to_index(index, old_chunks, new_chunks, new_embeddings, bm25=None):
+    """Normalize and add new chunk vectors to the collection index (CPU bound).
+
+    The new chunks are appended to `bm25` in place when it covers `old_chunks`.
+    """
+    emb_array = np.array(new_embeddings, dtype=np.float32)
+    faiss.normalize_L2(emb_array)
+
+    if index:
+        start_id = len(old_chunks)
+        ids = np.arange(start_id, start_id + len(new_chunks)).astype(np.int64)
+        index.add_with_ids(emb_array, ids)
+        all_chunks = old_chunks + new_chunks
+    else:
+        dim = emb_array.shape[1]
+        index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        ids = np.arange(len(new_chunks)).astype(np.int64)
+        index.add_with_ids(emb_array, ids)
+        all_chunks = new_chunks
+
+    # Lexical index over every chunk in the collection
+    if bm25 is not None and len(bm25) == len(old_chunks):
+        with timed("bm25_add"):
+            bm25.add([c["text"] for c in new_chunks])
+    else:
+        bm25 = build_bm25_index(all_chunks)
+    return index, all_chunks, bm25
+
+
+def remove_from_index(index, chunks, bm25, filenames):
+    """Remove every chunk of `filenames` from the collection, in place.
+
+    Chunk ids are slots in the chunks list: the vectors leave FAISS through
+    remove_ids, the slots become None tombstones and BM25 flags them deleted,
+    so the ids of all other chunks stay valid. Returns the number removed.
+    """
+    filenames = set(filenames)
+    ids = [i for i, c in enumerate(chunks) if c is not None and c["filename"] in filenames]
+    if ids:
+        index.remove_ids(np.array(ids, dtype=np.int64))
+        for i in ids:
+            chunks[i] = None
+        if bm25 is not None:
+            bm25.remove(ids)
+    return len(ids)
+
+
+def tombstone_ratio(chunks):
+    return sum(c is None for c in chunks) / len(chunks) if chunks else 0.0
+
+
+def compact_collection(index, chunks, bm25):
+    """Drop the tombstones and renumber the surviving chunks 0..n-1 (FAISS ids and BM25 docs alike)."""
+    keep = np.array([c is not None for c in chunks], dtype=bool)
+    remap = np.cumsum(keep) - 1
+    ids = faiss.vector_to_array(index.id_map)
+    vectors = index.index.reconstruct_n(0, index.ntotal)
+    compacted = faiss.IndexIDMap(faiss.IndexFlatIP(index.d))
+    if len(ids):
+        compacted.add_with_ids(vectors, remap[ids].astype(np.int64))
+
+    chunks = live_chunks(chunks)
+    if bm25 is not None and len(bm25) == len(keep):
+        bm25 = bm25.compact()
+    else:
+        bm25 = build_bm25_index(chunks)
+    return compacted, chunks, bm25
+
+
+def save_collection(user_id, name, index, chunks, bm25):
+    """Upload a collection to its S3 keys; returns (chunks_path, faiss_path)."""
+    faiss_index_key = s3_key_for(user_id, name, "faiss.index")
+    chunks_pkl_key = s3_key_for(user_id, name, "chunks.pkl")
+    upload_faiss_to_s3(index, faiss_index_key)
+    upload_pickle_to_s3(chunks, chunks_pkl_key)
+    upload_pickle_to_s3(bm25, s3_key_for(user_id, name, "bm25.pkl"))
+    return chunks_pkl_key, faiss_index_key
+
+
+def job_prefix(user_id, embedding_name, job_id):
+    return s3_key_for(user_id, embedding_name, f"jobs/{job_id}")
+
+
+def checkpoint_key(prefix, batch_no):
+    return f"{prefix}/checkpoints/{batch_no:06d}.npy"
+
+
+def upload_array(array, s3_key):
+    buf = io.BytesIO()
+    np.save(buf, array, allow_pickle=False)
+    upload_bytes_to_s3(buf.getvalue(), s3_key)
+
+
+def download_array(s3_key):
+    return np.load(io.BytesIO(download_file_bytes_from_s3(s3_key)), allow_pickle=False)
+
+
+def job_status(job):
+    return {
+        "job_id": str(job.id),
+        "kind": job.kind,
+        "status": job.status,
+        "total_chunks": job.total_chunks,
+        "embedded_chunks": job.embedded_chunks,
+        "files": [f["filename"] for f in job.files],
+        "attempts": job.attempts,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None
+    }
+
+
+async def load_documents(db, embedding_id):
+    result = await db.execute(select(Document).where(Document.embedding_id == embedding_id))
+    return result.scalars().all()
+
+
+async def backfill_documents(db, embedding, chunks=None, check_all=False):
+    """Add documents rows for files embedded before the documents table existed; returns the collection's documents.
+
+    Those files are only known from the stored chunks, so they get no content hash or size
+    and dedup by name. Unless `check_all` is set, a collection that has any documents row
+    counts as backfilled and its chunks are not downloaded.
+    """
+    documents = await load_documents(db, embedding.id)
+    if (documents and not check_all) or not embedding.chunks_path:
+        return documents
+    if chunks is None:
+        chunks = await asyncio.to_thread(download_pickle_from_s3, embedding.chunks_path)
+    known = {d.filename for d in documents}
+    counts = Counter(c["filename"] for c in live_chunks(chunks) if c["filename"] not in known)
+    if not counts:
+        return documents
+    await db.execute(
+        insert(Document).on_conflict_do_nothing(index_elements=[Document.embedding_id, Document.filename]),
+        [{"id": uuid.uuid4(), "embedding_id": embedding.id, "filename": filename, "chunk_count": count, "duplicate_chunks": 0}
+         for filename, count in counts.items()]
+    )
+    await db.commit()
+    logger.info("Documents backfilled from chunks", extra={"embedding_id": str(embedding.id), "files": len(counts)})
+    return await load_documents(db, embedding.id)
+
+
+async def backfill_all_documents():
+    """Backfill documents rows for every stored collection; returns the number of collections checked."""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(Embedding).where(Embedding.chunks_path.isnot(None)))
+        embeddings = result.scalars().all()
+        for embedding in embeddings:
+            try:
+                await backfill_documents(db, embedding, check_all=True)
+            except Exception as e:
+                await db.rollback()
+                logger.warning("Documents backfill failed", extra={"embedding_id": str(embedding.id), "error": str(e)})
+    return len(embeddings)
+
+
+def partition_uploads(uploads, existing_docs, replace=False):
+    """Split uploads [(filename, content_hash)] into new ones and skipped ones.
+
+    An upload is skipped when its name already appeared earlier in the same upload,
+    when its bytes are already in the collection (under any name, or earlier in the
+    same upload), or when a different file with the same name is, unless `replace`
+    is set. Returns (positions of the kept uploads, [{"filename", "reason"}]).
+    """
+    by_hash = {d.content_hash: d.filename for d in existing_docs if d.content_hash}
+    by_name = {d.filename: d.content_hash for d in existing_docs}
+    kept, skipped, seen = [], [], set()
+    for position, (filename, digest) in enumerate(uploads):
+        if filename in seen:
+            skipped.append({"filename": filename, "reason": "repeated in this upload"})
+            continue
+        seen.add(filename)
+        if digest in by_hash:
+            original = by_hash[digest]
+            reason = "already in collection" if original == filename else f"duplicate of {original}"
+            skipped.append({"filename": filename, "reason": reason})
+        elif filename in by_name and not replace:
+            skipped.append({"filename": filename, "reason": "a different version is already in the collection"})
+        else:
+            kept.append(position)
+            by_hash[digest] = filename
+            by_name[filename] = digest
+    return kept, skipped
+
+
+async def enqueue_job(db, user_id, embedding, files, append=True, dedup_chunks=CHUNK_DEDUP, kind="ingest"):
+    """Stage uploaded files in S3 and persist a queued job. `files` is [(filename, bytes)].
+
+    kind "replace" swaps out files of the same name instead of skipping them.
+    """
+    names = [filename for filename, _ in files]
+    if len(set(names)) != len(names):
+        raise ValueError("Each file in a job needs a distinct name (they are staged by name)")
+    job_id = uuid.uuid4()
+    prefix = job_prefix(user_id, embedding.name, job_id)
+    staged = []
+    for filename, contents in files:
+        s3_key = f"{prefix}/uploads/{filename}"
+        await asyncio.to_thread(upload_bytes_to_s3, contents, s3_key, document_media_type(filename))
+        staged.append({"filename": filename, "s3_key": s3_key, "content_hash": content_hash(contents)})
+
+    job = IngestionJob(
+        id=job_id,
+        embedding_id=embedding.id,
+        user_id=user_id,
+        kind=kind,
+        status="queued",
+        append=append,
+        files=staged,
+        batch_size=INGEST_BATCH_SIZE,
+        total_chunks=0,
+        embedded_chunks=0,
+        checkpoint_batches=0,
+        dedup_chunks=dedup_chunks,
+        attempts=0
+    )
+    db.add(job)
+    await db.commit()
+    return job
+
+
+def maintenance_job(user_id, embedding_id, kind, filenames=()):
+    return IngestionJob(
+        id=uuid.uuid4(),
+        embedding_id=embedding_id,
+        user_id=user_id,
+        kind=kind,
+        status="queued",
+        append=True,
+        files=[{"filename": f} for f in filenames],
+        batch_size=0,
+        total_chunks=0,
+        embedded_chunks=0,
+        checkpoint_batches=0,
+        attempts=0
+    )
+
+
+async def enqueue_delete_job(db, user_id, embedding, filenames):
+    job = maintenance_job(user_id, embedding.id, "delete", filenames)
+    db.add(job)
+    await db.commit()
+    return job
+
+
+async def queue_compaction(db, user_id, embedding_id):
+    """Add a compaction job to the session unless one is already waiting for this collection."""
+    result = await db.execute(
+        select(IngestionJob.id).where(
+            IngestionJob.embedding_id == embedding_id,
+            IngestionJob.kind == "compact",
+            IngestionJob.status.in_(("queued", "running"))
+        )
+    )
+    if result.first() is None:
+        db.add(maintenance_job(user_id, embedding_id, "compact"))
+
+
+async def update_job(job_id, owner=None, **values):
+    """Update a job row; with `owner`, only while that worker still holds the job. Returns whether a row changed."""
+    values["updated_at"] = datetime.now(timezone.utc)
+    query = update(IngestionJob).where(IngestionJob.id == job_id)
+    if owner is not None:
+        query = query.where(IngestionJob.worker_id == owner)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(query.values(**values))
+        await db.commit()
+    return result.rowcount > 0
+
+
+async def claim_job(worker_id):
+    """Take the oldest queued job that is due (or a running one whose worker stopped heartbeating)."""
+    now = datetime.now(timezone.utc)
+    stale = now - timedelta(seconds=INGEST_STALE_AFTER)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(IngestionJob)
+            .where(or_(
+                and_(IngestionJob.status == "queued", or_(IngestionJob.run_after.is_(None), IngestionJob.run_after <= now)),
+                and_(IngestionJob.status == "running", IngestionJob.heartbeat_at < stale)
+            ))
+            .order_by(IngestionJob.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        job = result.scalars().first()
+        if job is None:
+            return None
+        job.status = "running"
+        job.worker_id = worker_id
+        job.heartbeat_at = now
+        job.attempts += 1
+        await db.commit()
+        return job
+
+
+async def heartbeat(job_id, worker_id, run):
+    """Keep the job's heartbeat fresh; cancel `run` if another worker has reclaimed the job."""
+    while True:
+        await asyncio.sleep(INGEST_HEARTBEAT_INTERVAL)
+        try:
+            owned = await update_job(job_id, owner=worker_id, heartbeat_at=datetime.now(timezone.utc))
+        except Exception as e:
+            # a missed beat is fine as long as the next ones land before INGEST_STALE_AFTER
+            logger.warning("Ingestion heartbeat failed", extra={"job_id": str(job_id), "error": str(e)})
+            continue
+        if not owned:
+            logger.warning("Ingestion job reclaimed by another worker", extra={"job_id": str(job_id), "worker_id": worker_id})
+            run.cancel()
+            return
+
+
+def retry_delay(attempts):
+    return min(INGEST_RETRY_BACKOFF_MAX, INGEST_RETRY_BACKOFF * 2 ** max(0, attempts - 1))
+
+
+async def discard_staged_files(job):
+    """Delete the staged uploads and checkpoints of a job that will not run again."""
+    prefixes = {f["s3_key"].rsplit("/uploads/", 1)[0] for f in job.files if f.get("s3_key")}
+    for prefix in prefixes:
+        try:
+            await asyncio.to_thread(delete_prefix_from_s3, prefix + "/")
+        except Exception as e:
+            logger.warning("Could not delete staged files", extra={"job_id": str(job.id), "prefix": prefix, "error": str(e)})
+
+
+async def extract_documents(job, existing_docs):
+    """Download, dedup by content hash, extract and chunk the staged files.
+
+    Each document is a dict with filename, contents, content_hash, pages, chunks
+    (every chunk, for the extracted text) and indexed (the chunks to embed).
+    """
+    uploads = []
+    for staged in job.files:
+        contents = await asyncio.to_thread(download_file_bytes_from_s3, staged["s3_key"])
+        uploads.append((staged["filename"], contents, staged.get("content_hash") or content_hash(contents)))
+    kept, skipped = partition_uploads(
+        [(f, digest) for f, _, digest in uploads], existing_docs, replace=job.kind == "replace"
+    )
+
+    documents = []
+    for filename, contents, digest in (uploads[i] for i in kept):
+        text = await asyncio.to_thread(extract_text_from_file, contents, filename)
+        if not text:
+            skipped.append({"filename": filename, "reason": "no text extracted"})
+            continue
+        doc_chunks = chunk_document(text, filename)
+        documents.append({
+            "filename": filename, "contents": contents, "content_hash": digest,
+            "pages": await asyncio.to_thread(count_pages, contents, filename),
+            "chunks": doc_chunks, "indexed": doc_chunks
+        })
+    return documents, skipped
+
+
+def drop_near_duplicate_chunks(documents, existing_chunks, threshold=CHUNK_DEDUP_THRESHOLD):
+    """Leave chunks that near-duplicate the collection (or each other) out of `indexed`."""
+    new_chunks = [(doc, c) for doc in documents for c in doc["chunks"]]
+    duplicates = find_near_duplicate_chunks(
+        [c["text"] for c in live_chunks(existing_chunks)], [c["text"] for _, c in new_chunks], threshold
+    )
+    for doc in documents:
+        doc["indexed"] = []
+    for pos, (doc, chunk) in enumerate(new_chunks):
+        if pos not in duplicates:
+            doc["indexed"].append(chunk)
+    return len(duplicates)
+
+
+async def embed_with_checkpoints(job, prefix, chunks):
+    """Embed chunks batch by batch; each batch is saved to S3 so a restarted job resumes after it."""
+    batch_size = job.batch_size
+    vectors = []
+    for batch_no, start in enumerate(range(0, len(chunks), batch_size)):
+        key = checkpoint_key(prefix, batch_no)
+        if batch_no < job.checkpoint_batches:
+            vectors.append(await asyncio.to_thread(download_array, key))
+            continue
+
+        batch = chunks[start:start + batch_size]
+        embedded = np.array(await get_text_embeddings_async([c["text"] for c in batch]), dtype=np.float32)
+        await asyncio.to_thread(upload_array, embedded, key)
+        vectors.append(embedded)
+        await update_job(
+            job.id,
+            checkpoint_batches=batch_no + 1,
+            embedded_chunks=start + len(batch),
+            heartbeat_at=datetime.now(timezone.utc)
+        )
+    return np.vstack(vectors)
+
+
+def merge_into_collection(user_id, name, chunks_path, faiss_path, append, documents, vectors, replace=()):
+    """Add the embedded documents to the collection in S3, first removing the files in `replace`.
+
+    `vectors[doc["rows"]]` are the embeddings of each document's indexed chunks.
+    Returns (embedded documents, skipped files, new (chunks_path, faiss_path) or None, tombstone ratio).
+    """
+    if append and chunks_path and faiss_path:
+        collection = load_collection_from_s3(chunks_path, faiss_path, s3_key_for(user_id, name, "bm25.pkl"))
+        old_chunks, index, bm25 = collection["chunks"], collection["index"], collection["bm25"]
+    else:
+        old_chunks, index, bm25 = [], None, None
+    removed = remove_from_index(index, old_chunks, bm25, replace) if index is not None and replace else 0
+    # collections embedded before the documents table only know their files from the chunks
+    old_filenames = {c["filename"] for c in live_chunks(old_chunks)}
+
+    new_chunks, keep_rows, embedded, skipped = [], [], [], []
+    for doc in documents:
+        if doc["filename"] in old_filenames:
+            skipped.append({"filename": doc["filename"], "reason": "already in collection"})
+            continue
+        new_chunks.extend(doc["indexed"])
+        keep_rows.extend(doc["rows"])
+        embedded.append(doc)
+
+        upload_bytes_to_s3(doc["contents"], document_key_for(user_id, name, doc["filename"]), document_media_type(doc["filename"]))
+        upload_json_to_s3(extracted_document(doc["filename"], doc["chunks"]), extracted_key_for(user_id, name, doc["filename"]))
+
+    if new_chunks:
+        index, all_chunks, bm25 = add_to_index(index, old_chunks, new_chunks, vectors[keep_rows], bm25)
+    elif removed:
+        all_chunks = old_chunks
+    else:
+        return embedded, skipped, None, tombstone_ratio(old_chunks)
+
+    paths = save_collection(user_id, name, index, all_chunks, bm25)
+    return embedded, skipped, paths, tombstone_ratio(all_chunks)
+
+
+def delete_files_from_collection(user_id, name, chunks_path, faiss_path, filenames):
+    """Remove files from the stored collection; returns (chunks removed, tombstone ratio)."""
+    collection = load_collection_from_s3(chunks_path, faiss_path, s3_key_for(user_id, name, "bm25.pkl"))
+    chunks, index, bm25 = collection["chunks"], collection["index"], collection["bm25"]
+    removed = remove_from_index(index, chunks, bm25, filenames)
+    if removed:
+        save_collection(user_id, name, index, chunks, bm25)
+    for filename in filenames:
+        delete_from_s3(document_key_for(user_id, name, filename))
+        delete_from_s3(extracted_key_for(user_id, name, filename))
+    return removed, tombstone_ratio(chunks)
+
+
+def compact_stored_collection(user_id, name, chunks_path, faiss_path):
+    """Rewrite the stored collection without tombstones; returns the number of slots reclaimed."""
+    collection = load_collection_from_s3(chunks_path, faiss_path, s3_key_for(user_id, name, "bm25.pkl"))
+    chunks = collection["chunks"]
+    tombstones = sum(c is None for c in chunks)
+    if tombstones:
+        index, chunks, bm25 = compact_collection(collection["index"], chunks, collection["bm25"])
+        save_collection(user_id, name, index, chunks, bm25)
+    return tombstones
+
+
+async def lock_embedding(db, embedding_id):
+    result = await db.execute(select(Embedding).where(Embedding.id == embedding_id).with_for_update())
+    embedding = result.scalars().first()
+    if embedding is None:
+        raise JobFailed("Embedding was deleted")
+    return embedding
+
+
+async def run_job(job):
+    if job.kind == "delete":
+        return await run_delete_job(job)
+    if job.kind == "compact":
+        return await run_compact_job(job)
+
+    async with AsyncSessionLocal() as db:
+        embedding = await db.get(Embedding, job.embedding_id)
+        if embedding is None:
+            raise JobFailed("Embedding was deleted")
+        embedding_name, chunks_path = embedding.name, embedding.chunks_path
+        existing_docs = await backfill_documents(db, embedding) if job.append else []
+    prefix = job_prefix(job.user_id, embedding_name, job.id)
+
+    # Step 1: dedup by content hash, extract and split (deterministic, so checkpoints line up on resume)
+    documents, skipped = await extract_documents(job, existing_docs)
+    duplicate_chunks = 0
+    if documents and job.dedup_chunks:
+        existing_chunks = []
+        if job.append and chunks_path:
+            existing_chunks = await asyncio.to_thread(download_pickle_from_s3, chunks_path)
+        with timed("near_duplicate_detection"):
+            duplicate_chunks = await asyncio.to_thread(drop_near_duplicate_chunks, documents, existing_chunks)
+
+    if not documents:
+        if not skipped:
+            raise JobFailed("No valid files found")
+        await finish_job(job, prefix, [], skipped, 0)
+        return
+
+    chunks = []
+    for doc in documents:
+        doc["rows"] = range(len(chunks), len(chunks) + len(doc["indexed"]))  # rows of its vectors
+        chunks.extend(doc["indexed"])
+    if job.checkpoint_batches and job.total_chunks != len(chunks):
+        # the collection changed since the last attempt, so the saved batches no longer line up
+        job.checkpoint_batches = 0
+        await update_job(job.id, checkpoint_batches=0, embedded_chunks=0)
+    await update_job(job.id, total_chunks=len(chunks))
+
+    # Step 2: embed in checkpointed batches
+    vectors = await embed_with_checkpoints(job, prefix, chunks) if chunks else np.zeros((0, 0), dtype=np.float32)
+
+    # Step 3: merge under a row lock so concurrent jobs on one collection don't overwrite each other
+    async with AsyncSessionLocal() as db:
+        embedding = await lock_embedding(db, job.embedding_id)
+
+        # re-check against documents committed by other jobs since step 1
+        replace = job.kind == "replace"
+        if job.append:
+            kept, late_skipped = partition_uploads(
+                [(doc["filename"], doc["content_hash"]) for doc in documents], await load_documents(db, embedding.id),
+                replace=replace
+            )
+            skipped += late_skipped
+            documents = [documents[i] for i in kept]
+        else:
+            await db.execute(delete(Document).where(Document.embedding_id == embedding.id))
+        replaced = [doc["filename"] for doc in documents] if replace else []
+        if replaced:
+            await db.execute(delete(Document).where(Document.embedding_id == embedding.id, Document.filename.in_(replaced)))
+
+        embedded, merge_skipped, paths, ratio = await asyncio.to_thread(
+            merge_into_collection, job.user_id, embedding.name, embedding.chunks_path, embedding.faiss_path,
+            job.append, documents, vectors, replaced
+        )
+        if paths:
+            embedding.chunks_path, embedding.faiss_path = paths
+        embedding.version += 1
+        if ratio > COMPACT_TOMBSTONE_RATIO:
+            await queue_compaction(db, job.user_id, embedding.id)
+        for doc in embedded:
+            db.add(Document(
+                embedding_id=embedding.id,
+                filename=doc["filename"],
+                content_hash=doc["content_hash"],
+                size_bytes=len(doc["contents"]),
+                pages=doc["pages"],
+                s3_key=document_key_for(job.user_id, embedding.name, doc["filename"]),
+                chunk_count=len(doc["indexed"]),
+                duplicate_chunks=len(doc["chunks"]) - len(doc["indexed"])
+            ))
+        await db.commit()
+
+    await finish_job(job, prefix, [doc["filename"] for doc in embedded], skipped + merge_skipped, duplicate_chunks, len(chunks))
+
+
+async def finish_job(job, prefix, embedded, skipped, duplicate_chunks, embedded_chunks=0):
+    message = "Embedding complete" if embedded else "No new files to embed"
+    await update_job(
+        job.id,
+        owner=job.worker_id,
+        status="succeeded",
+        embedded_chunks=embedded_chunks,
+        result={
+            "message": message,
+            "embedded_files": embedded,
+            "skipped_files": skipped,
+            "duplicate_chunks": duplicate_chunks
+        },
+        error=None
+    )
+    await asyncio.to_thread(delete_prefix_from_s3, prefix + "/")
+
+
+async def run_delete_job(job):
+    filenames = [f["filename"] for f in job.files]
+    async with AsyncSessionLocal() as db:
+        embedding = await lock_embedding(db, job.embedding_id)
+        removed, ratio = 0, 0.0
+        if embedding.chunks_path and embedding.faiss_path:
+            removed, ratio = await asyncio.to_thread(
+                delete_files_from_collection, job.user_id, embedding.name,
+                embedding.chunks_path, embedding.faiss_path, filenames
+            )
+        await db.execute(delete(Document).where(Document.embedding_id == embedding.id, Document.filename.in_(filenames)))
+        if removed:
+            embedding.version += 1
+        if ratio > COMPACT_TOMBSTONE_RATIO:
+            await queue_compaction(db, job.user_id, embedding.id)
+        await db.commit()
+
+    message = f"Removed {removed} chunks" if removed else "File not found in collection"
+    await update_job(
+        job.id,
+        owner=job.worker_id,
+        status="succeeded",
+        result={"message": message, "deleted_files": filenames if removed else [], "removed_chunks": removed},
+        error=None
+    )
+
+
+async def run_compact_job(job):
+    async with AsyncSessionLocal() as db:
+        embedding = await lock_embedding(db, job.embedding_id)
+        reclaimed = 0
+        if embedding.chunks_path and embedding.faiss_path:
+            reclaimed = await asyncio.to_thread(
+                compact_stored_collection, job.user_id, embedding.name, embedding.chunks_path, embedding.faiss_path
+            )
+        if reclaimed:
+            embedding.version += 1
+        await db.commit()
+
+    await update_job(
+        job.id,
+        owner=job.worker_id,
+        status="succeeded",
+        result={"message": f"Reclaimed {reclaimed} chunk slots", "reclaimed_chunks": reclaimed},
+        error=None
+    )
+
+
+async def timed_run(job):
+    with timed(f"job_{job.kind}"):
+        await run_job(job)
+
+
+async def run_worker(worker_id=None):
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    logger.info("Ingestion worker started", extra={"worker_id": worker_id})
+    while True:
+        try:
+            job = await claim_job(worker_id)
+        except Exception as e:
+            logger.error("Could not claim ingestion job", extra={"worker_id": worker_id, "error": str(e)})
+            job = None
+        if job is None:
+            await asyncio.sleep(INGEST_POLL_INTERVAL)
+            continue
+
+        logger.info("Running ingestion job", extra={"job_id": str(job.id), "kind": job.kind, "attempt": job.attempts})
+        run = asyncio.create_task(timed_run(job))
+        beat = asyncio.create_task(heartbeat(job.id, worker_id, run))
+        try:
+            await asyncio.wait({run})
+        finally:
+            beat.cancel()
+            run.cancel()
+        if run.cancelled():
+            continue  # reclaimed by another worker, which now owns the job and its status
+        error = run.exception()
+        if error is None:
+            logger.info("Ingestion job done", extra={"job_id": str(job.id), "kind": job.kind})
+            continue
+
+        retry = not isinstance(error, JobFailed) and job.attempts < INGEST_MAX_ATTEMPTS
+        logger.error("Ingestion job failed", extra={"job_id": str(job.id), "kind": job.kind, "retry": retry, "error": str(error)})
+        values = {"status": "queued" if retry else "failed", "error": str(error)}
+        if retry:
+            values["run_after"] = datetime.now(timezone.utc) + timedelta(seconds=retry_delay(job.attempts))
+        try:
+            owned = await update_job(job.id, owner=worker_id, **values)
+        except Exception as e:
+            logger.error("Could not record ingestion job failure", extra={"job_id": str(job.id), "error": str(e)})
+            continue  # left running; reclaimed once its heartbeat goes stale
+        if owned and not retry:
+            await discard_staged_files(job)
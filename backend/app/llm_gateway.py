@@ -0,0 +1,207 @@
+# llm_gateway.py — admission control, rate limiting and retries in front of the Mistral chat API
+#
+# At most LLM_MAX_IN_FLIGHT completions run at once; up to LLM_MAX_QUEUE more wait
+# in FIFO order and anything beyond that is rejected straight away. A caller's
+# deadline (time.monotonic() value) is checked before queueing, bounds the wait,
+# and bounds every attempt, so requests nobody will wait for never reach the
+# provider. Provider quotas are enforced with token buckets (requests/s and
+# tokens/min), and 429/5xx/network errors are retried with jittered backoff.
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+
+import httpx
+import mistralai
+from mistralai import models as mistral_models
+
+from app.metrics import observe, timed, LLM_QUEUE_DEPTH, LLM_IN_FLIGHT, LLM_QUEUE_WAIT, LLM_REQUESTS
+from dotenv import load_dotenv
+
+load_dotenv()
+mistralai_api_key = os.getenv("MISTRAL_KEY")
+MISTRAL_SERVER_URL = os.getenv("MISTRAL_SERVER_URL")  # override the Mistral API endpoint (benchmarks/stub_services.py)
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_RATE_LIMIT_RPS = float(os.getenv("LLM_RATE_LIMIT_RPS", "0"))  # provider requests/s, 0 = unlimited
+LLM_RATE_BURST = float(os.getenv("LLM_RATE_BURST", "2"))
+LLM_TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))  # 0 = unlimited
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "500"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # seconds per attempt
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+
+client = mistralai.Mistral(api_key=mistralai_api_key, server_url=MISTRAL_SERVER_URL)
+logger = logging.getLogger(__name__)
+
+
+class LLMUnavailable(Exception):
+    """No answer: the gateway is saturated, the deadline cannot be met, or the provider kept failing."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def remaining(deadline):
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class TokenBucket:
+    """`rate` tokens per second up to `capacity`. reserve() debits now and returns how long to wait."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Admission:
+    """FIFO limiter: `limit` holders at a time, waiters served in arrival order."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.waiters = deque()
+
+    async def acquire(self, timeout=None):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        LLM_QUEUE_DEPTH.set(len(self.waiters))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException:
+            if future.done() and not future.cancelled():
+                self.release()  # the slot was handed over just as we gave up
+            else:
+                future.cancel()
+            raise
+        finally:
+            if future in self.waiters:
+                self.waiters.remove(future)
+            LLM_QUEUE_DEPTH.set(len(self.waiters))
+
+    def release(self):
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)  # hand the slot over directly
+                return
+        self.active -= 1
+
+
+class LLMGateway:
+    def __init__(self, llm_client):
+        self.client = llm_client
+        self.admission = Admission(LLM_MAX_IN_FLIGHT)
+        self.requests = TokenBucket(LLM_RATE_LIMIT_RPS, LLM_RATE_BURST) if LLM_RATE_LIMIT_RPS > 0 else None
+        self.tokens = TokenBucket(LLM_TOKENS_PER_MINUTE / 60, LLM_TOKENS_PER_MINUTE) if LLM_TOKENS_PER_MINUTE > 0 else None
+        self.call_seconds = 2.0  # EWMA of provider latency, for wait estimates
+
+    def estimated_wait(self):
+        if self.admission.active < self.admission.limit and not self.admission.waiters:
+            return 0.0
+        return (len(self.admission.waiters) + 1) * self.call_seconds / self.admission.limit
+
+    async def complete(self, prompt, model="mistral-large-latest", deadline=None):
+        """Chat completion text for one user message; raises LLMUnavailable instead of overloading."""
+        if len(self.admission.waiters) >= LLM_MAX_QUEUE:
+            LLM_REQUESTS.labels("rejected_queue_full").inc()
+            raise LLMUnavailable("LLM queue is full", retry_after=self.estimated_wait())
+        left = remaining(deadline)
+        if left is not None and (left <= 0 or self.estimated_wait() > left):
+            LLM_REQUESTS.labels("rejected_deadline").inc()
+            raise LLMUnavailable("LLM queue wait exceeds the request deadline", retry_after=self.estimated_wait())
+
+        start = time.monotonic()
+        try:
+            await self.admission.acquire(timeout=left)
+        except asyncio.TimeoutError:
+            LLM_REQUESTS.labels("rejected_deadline").inc()
+            raise LLMUnavailable("Request deadline passed while waiting for the LLM", retry_after=self.estimated_wait())
+        waited = time.monotonic() - start
+        LLM_QUEUE_WAIT.observe(waited)
+        observe("llm_queue_wait", waited)
+
+        LLM_IN_FLIGHT.inc()
+        try:
+            return await self._complete_with_retries(prompt, model, deadline)
+        finally:
+            LLM_IN_FLIGHT.dec()
+            self.admission.release()
+
+    async def _rate_limit(self, prompt, deadline):
+        estimated_tokens = len(prompt) // 4 + LLM_COMPLETION_TOKENS_ESTIMATE
+        reservations = [(b, a) for b, a in ((self.requests, 1), (self.tokens, estimated_tokens)) if b is not None]
+        delay = max((bucket.reserve(amount) for bucket, amount in reservations), default=0.0)
+        left = remaining(deadline)
+        if left is not None and delay >= left:
+            for bucket, amount in reservations:
+                bucket.refund(amount)
+            LLM_REQUESTS.labels("rejected_rate_limit").inc()
+            raise LLMUnavailable("LLM rate limit leaves no time before the request deadline", retry_after=delay)
+        if delay > 0:
+            with timed("llm_rate_limit"):
+                await asyncio.sleep(delay)
+
+    async def _complete_with_retries(self, prompt, model, deadline):
+        last_error = None
+        for attempt in range(LLM_RETRIES + 1):
+            await self._rate_limit(prompt, deadline)
+            left = remaining(deadline)
+            timeout = LLM_TIMEOUT if left is None else min(LLM_TIMEOUT, left)
+            retry_after = None
+            start = time.monotonic()
+            try:
+                with timed("llm"):
+                    response = await asyncio.wait_for(
+                        self.client.chat.complete_async(model=model, messages=[{"role": "user", "content": prompt}]),
+                        timeout
+                    )
+                self.call_seconds = 0.8 * self.call_seconds + 0.2 * (time.monotonic() - start)
+                LLM_REQUESTS.labels("ok").inc()
+                return response.choices[0].message.content
+            except mistral_models.MistralError as e:
+                if e.status_code != 429 and e.status_code < 500:
+                    LLM_REQUESTS.labels("error").inc()
+                    raise
+                header = e.headers.get("retry-after")
+                retry_after = float(header) if header and header.replace(".", "", 1).isdigit() else None
+                last_error = e
+            except (httpx.TransportError, mistral_models.NoResponseError, asyncio.TimeoutError) as e:
+                last_error = e
+            LLM_REQUESTS.labels("retry").inc()
+
+            if attempt == LLM_RETRIES:
+                break
+            delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            left = remaining(deadline)
+            if left is not None and delay >= left:
+                break
+            logger.info("Retrying LLM call", extra={"attempt": attempt + 1, "delay": round(delay, 3), "error": str(last_error)[:200]})
+            await asyncio.sleep(delay)
+
+        LLM_REQUESTS.labels("failed").inc()
+        raise LLMUnavailable(f"LLM call failed: {type(last_error).__name__}: {str(last_error)[:200]}", retry_after=LLM_BACKOFF_MAX)
+
+
+llm_gateway = LLMGateway(client)
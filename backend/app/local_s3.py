@@ -0,0 +1,145 @@
+# local_s3.py — filesystem-backed stand-in for the subset of the boto3 S3 client used by the backend
+# Enabled by setting S3_LOCAL_DIR; objects live at <S3_LOCAL_DIR>/<bucket>/<key>.
+import os
+import io
+import re
+import hashlib
+import shutil
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+
+def _client_error(status, code, operation):
+    return ClientError(
+        {"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}},
+        operation
+    )
+
+
+class LocalStreamingBody:
+    """Mimics botocore's StreamingBody (read / iter_chunks / close)."""
+
+    def __init__(self, path, start, length):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = length
+
+    def read(self, amt=None):
+        if amt is None or amt > self._remaining:
+            amt = self._remaining
+        data = self._file.read(amt)
+        self._remaining -= len(data)
+        return data
+
+    def iter_chunks(self, chunk_size=1024 * 1024):
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        self._file.close()
+
+
+class LocalS3Client:
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        # every key maps to exactly one file under its bucket: no "..", "." or empty segments that
+        # would let a key built from user input ("alice/../bob/...") resolve into another prefix
+        segments = key.split("/")
+        if (not bucket or bucket in (".", "..") or "/" in bucket or os.sep in bucket
+                or any(s in ("", ".", "..") or os.sep in s for s in segments)):
+            raise _client_error(400, "InvalidObjectName", "Path")
+        bucket_dir = os.path.abspath(os.path.join(self.root, bucket))
+        path = os.path.abspath(os.path.join(bucket_dir, *segments))
+        if not path.startswith(bucket_dir + os.sep):
+            raise _client_error(400, "InvalidObjectName", "Path")
+        return path
+
+    def _etag(self, path):
+        md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                md5.update(block)
+        return f'"{md5.hexdigest()}"'
+
+    def put_object(self, Body, Bucket, Key, ContentType=None, **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(Body, (bytes, bytearray, memoryview)):
+            Body = io.BytesIO(Body)
+        with open(path + ".tmp", "wb") as f:
+            shutil.copyfileobj(Body, f)
+        os.replace(path + ".tmp", path)
+        return {"ETag": self._etag(path)}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, **kwargs):
+        self.put_object(Fileobj, Bucket, Key)
+
+    def download_fileobj(self, Bucket, Key, Fileobj, **kwargs):
+        response = self.get_object(Bucket=Bucket, Key=Key)
+        body = response["Body"]
+        try:
+            for data in body.iter_chunks():
+                Fileobj.write(data)
+        finally:
+            body.close()
+
+    def head_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise _client_error(404, "404", "HeadObject")
+        stat = os.stat(path)
+        return {
+            "ContentLength": stat.st_size,
+            "ETag": self._etag(path),
+            "LastModified": datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+        }
+
+    def get_object(self, Bucket, Key, Range=None, IfNoneMatch=None, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise _client_error(404, "NoSuchKey", "GetObject")
+        head = self.head_object(Bucket, Key)
+        if IfNoneMatch and IfNoneMatch == head["ETag"]:
+            raise _client_error(304, "304", "GetObject")
+
+        size = head["ContentLength"]
+        start, end = 0, size - 1
+        response = {"ETag": head["ETag"], "LastModified": head["LastModified"], "ContentType": "binary/octet-stream"}
+        if Range:
+            match = re.match(r"^bytes=(\d*)-(\d*)$", Range)
+            if match and match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), size - 1)
+            elif match and match.group(2):
+                start = max(size - int(match.group(2)), 0)
+            if start >= size:
+                raise _client_error(416, "InvalidRange", "GetObject")
+            response["ContentRange"] = f"bytes {start}-{end}/{size}"
+
+        response["ContentLength"] = end - start + 1 if size else 0
+        response["Body"] = LocalStreamingBody(path, start, response["ContentLength"])
+        return response
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        if os.path.isfile(path):
+            os.remove(path)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        base = os.path.join(self.root, Bucket)
+        contents = []
+        for dirpath, _, filenames in os.walk(base):
+            for filename in filenames:
+                key = os.path.relpath(os.path.join(dirpath, filename), base).replace(os.sep, "/")
+                if key.startswith(Prefix) and not key.endswith(".tmp"):
+                    contents.append({"Key": key, "Size": os.path.getsize(os.path.join(dirpath, filename))})
+        contents.sort(key=lambda c: c["Key"])
+        return {"Contents": contents, "KeyCount": len(contents), "IsTruncated": False}
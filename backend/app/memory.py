@@ -1,8 +1,11 @@
 import faiss
 import pickle
 import os
+from collections import OrderedDict
 
 global_index = None
 global_chunks = []
 embedded_filenames = set()
-user_sessions = {}  # key = user_id, value = { "index": ..., "chunks": ... }
\ No newline at end of file
+user_sessions = {}  # key = user_id, value = { "index": ..., "chunks": ... }
+collections = OrderedDict()  # key = (user_id, embedding_name), value = { "index": ..., "chunks": ... }; least recently used first
+selected_embeddings = {}  # key = user_id, value = name of the embedding last opened with /load-embedding
\ No newline at end of file
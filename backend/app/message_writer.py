@@ -0,0 +1,145 @@
+# message_writer.py — write-behind queue that persists chat messages in bulk off the request path
+import os
+import time
+import asyncio
+import logging
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from app.pgsql.database import AsyncSessionLocal
+from app.pgsql.models import Message
+from app.metrics import timed, CHAT_MESSAGES_DROPPED
+
+from dotenv import load_dotenv
+
+load_dotenv()
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "0.5"))  # seconds
+MESSAGE_FLUSH_BATCH = int(os.getenv("MESSAGE_FLUSH_BATCH", "200"))
+MESSAGE_MAX_PENDING = int(os.getenv("MESSAGE_MAX_PENDING", "5000"))
+MESSAGE_MAX_WAIT = float(os.getenv("MESSAGE_MAX_WAIT", "10"))  # seconds a caller retries a full buffer before rows are dropped
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """Buffers Message rows and writes them with one bulk INSERT per flush.
+
+    Rows are flushed every `flush_interval` seconds or as soon as
+    `flush_batch` rows are waiting. A single writer inserts rows in the order
+    they were queued, and created_at is stamped by the caller, so the order
+    of messages within a collection is preserved. When more than
+    `max_pending` rows are waiting (e.g. Postgres is down) callers retry the
+    flush with backoff for up to `max_wait` seconds; rows still over the limit
+    after that are dropped, oldest first, and counted in
+    research_gpt_chat_messages_dropped.
+    """
+
+    def __init__(self, flush_interval=MESSAGE_FLUSH_INTERVAL, flush_batch=MESSAGE_FLUSH_BATCH, max_pending=MESSAGE_MAX_PENDING,
+                 max_wait=MESSAGE_MAX_WAIT):
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.max_pending = max_pending
+        self.max_wait = max_wait
+        self._pending = []
+        self._in_flight = []  # rows taken by the flush that is writing right now
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, attempts=3):
+        """Stop the background loop and flush everything that is still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for _ in range(attempts):
+            await self.flush()
+            if not self._pending:
+                return
+            await asyncio.sleep(self.flush_interval)
+        logger.error("Chat messages could not be persisted at shutdown", extra={"pending": len(self._pending)})
+
+    def has_pending(self, embedding_id=None):
+        """Rows not yet committed, queued or being written; flush() waits for both."""
+        rows = self._pending + self._in_flight
+        if embedding_id is None:
+            return bool(rows)
+        return any(row["embedding_id"] == embedding_id for row in rows)
+
+    async def add(self, *rows):
+        """Queue message rows (dicts of Message columns)."""
+        self._pending.extend(rows)
+        if self._task is None:
+            # no background loop (scripts, tests): write through
+            await self.flush()
+        elif len(self._pending) >= self.flush_batch:
+            self._wakeup.set()
+        if len(self._pending) > self.max_pending:
+            await self._relieve()
+
+    async def _relieve(self):
+        """Flush with backoff until the buffer is back under max_pending, then drop the oldest overflow."""
+        deadline = time.monotonic() + self.max_wait
+        delay = self.flush_interval
+        while True:
+            await self.flush()
+            remaining = deadline - time.monotonic()
+            if len(self._pending) <= self.max_pending or remaining <= 0:
+                break
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 5.0)
+
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            CHAT_MESSAGES_DROPPED.inc(overflow)
+            logger.error("Dropping chat messages, write buffer full", extra={"rows": overflow, "max_pending": self.max_pending})
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def _write(self, rows):
+        with timed("message_flush"):
+            async with AsyncSessionLocal() as db:
+                await db.execute(insert(Message), rows)
+                await db.commit()
+
+    async def flush(self):
+        async with self._flush_lock:
+            rows, self._pending = self._pending, []
+            if not rows:
+                return 0
+            self._in_flight = rows
+            try:
+                await self._write(rows)
+            except IntegrityError:
+                # one bad row (e.g. its collection was deleted meanwhile) must not sink the batch
+                for row in rows:
+                    try:
+                        await self._write([row])
+                    except IntegrityError as e:
+                        logger.error("Dropping chat message", extra={"message_id": str(row["id"]), "error": str(e)})
+            except Exception as e:
+                logger.warning("Chat message flush failed, will retry", extra={"rows": len(rows), "error": str(e)})
+                self._pending[:0] = rows
+                return 0
+            finally:
+                self._in_flight = []
+            return len(rows)
+
+
+message_writer = MessageWriter()
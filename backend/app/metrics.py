@@ -0,0 +1,136 @@
+# metrics.py — per-stage latency histograms for Prometheus and per-request Server-Timing
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+
+from prometheus_client import Histogram, Counter, Gauge, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import event
+
+from dotenv import load_dotenv
+
+load_dotenv()
+# set when the API runs with several worker processes (see prometheus_client multiprocess mode)
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "research_gpt_stage_seconds", "Time spent in one pipeline stage", ["stage"], buckets=LATENCY_BUCKETS
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "research_gpt_http_request_seconds", "HTTP request latency", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+EMBED_BATCH_SIZE = Histogram(
+    "research_gpt_embed_batch_size", "Texts per embedding request", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+)
+S3_BYTES = Counter("research_gpt_s3_bytes", "Bytes transferred to and from S3", ["op"])
+EMBED_REQUESTS = Counter("research_gpt_embed_requests", "Embedding server calls per replica", ["replica", "outcome"])
+EMBED_HEDGES = Counter("research_gpt_embed_hedges", "Hedged query embedding requests", ["outcome"])
+LLM_QUEUE_DEPTH = Gauge("research_gpt_llm_queue_depth", "LLM calls waiting for a slot", multiprocess_mode="livesum")
+LLM_IN_FLIGHT = Gauge("research_gpt_llm_in_flight", "LLM calls in progress", multiprocess_mode="livesum")
+LLM_QUEUE_WAIT = Histogram("research_gpt_llm_queue_wait_seconds", "Time LLM calls waited for a slot", buckets=LATENCY_BUCKETS)
+LLM_REQUESTS = Counter("research_gpt_llm_requests", "LLM gateway outcomes", ["outcome"])
+DEADLINE_EXCEEDED = Counter("research_gpt_deadline_exceeded", "Request stages cut off by their timeout or the request deadline", ["stage"])
+DEGRADED_ANSWERS = Counter("research_gpt_degraded_answers", "Retrieval-only answers returned instead of an LLM answer")
+COLLECTION_LOADS = Counter("research_gpt_collection_loads", "get_collection calls by how they were served", ["outcome"])
+CLIENT_DISCONNECTS = Counter("research_gpt_client_disconnects", "Requests abandoned because the client went away", ["route"])
+CHAT_MESSAGES_DROPPED = Counter("research_gpt_chat_messages_dropped", "Chat messages dropped because the write buffer stayed full")
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# (stage, seconds) pairs of the current request, for the Server-Timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def observe(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage):
+    """Time a block into research_gpt_stage_seconds{stage=...} and the request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def record_s3(op, nbytes):
+    if nbytes:
+        S3_BYTES.labels(op).inc(nbytes)
+
+
+def instrument_engine(engine, stage="db_query"):
+    """Time every statement executed on a (sync) SQLAlchemy engine."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        observe(stage, time.perf_counter() - conn.info["query_start"].pop())
+
+
+def server_timing_header(timings):
+    """`stage;dur=<ms>` per stage (summed when a stage ran several times), in first-seen order."""
+    totals, counts = {}, {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+        counts[stage] = counts.get(stage, 0) + 1
+    parts = []
+    for stage, seconds in totals.items():
+        desc = f';desc="x{counts[stage]}"' if counts[stage] > 1 else ""
+        parts.append(f"{stage};dur={seconds * 1000:.1f}{desc}")
+    return ", ".join(parts)
+
+
+def metrics_payload():
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: request latency histogram for every route, plus a
+    Server-Timing header (per-stage durations) on `server_timing_paths`."""
+
+    def __init__(self, app, server_timing_paths=()):
+        self.app = app
+        self.server_timing_paths = set(server_timing_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = [] if scope["path"] in self.server_timing_paths else None
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                if timings is not None:
+                    total = ("total", time.perf_counter() - start)
+                    header = server_timing_header(timings + [total])
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status["code"])
+            ).observe(time.perf_counter() - start)
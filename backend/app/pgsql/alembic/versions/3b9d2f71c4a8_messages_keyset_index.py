@@ -0,0 +1,28 @@
+"""Composite index for keyset pagination of chat history
+
+Revision ID: 3b9d2f71c4a8
+Revises: fe37a6c55164
+Create Date: 2026-10-19 10:12:41.503217
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9d2f71c4a8'
+down_revision: Union[str, None] = 'fe37a6c55164'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_messages_embedding_created_id', 'messages', ['embedding_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_embedding_created_id', table_name='messages')
@@ -0,0 +1,28 @@
+"""Version counter on embeddings
+
+Revision ID: a7c4e9d20b58
+Revises: f1b3c8e7a254
+Create Date: 2026-10-19 21:36:05.402117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c4e9d20b58'
+down_revision: Union[str, None] = 'f1b3c8e7a254'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('embeddings', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('embeddings', 'version')
@@ -0,0 +1,30 @@
+"""Last use time on embeddings
+
+Revision ID: b3e8f15c6d92
+Revises: a7c4e9d20b58
+Create Date: 2026-10-19 22:04:51.736284
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3e8f15c6d92'
+down_revision: Union[str, None] = 'a7c4e9d20b58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('embeddings', sa.Column('last_used_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index('ix_embeddings_last_used_at', 'embeddings', ['last_used_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_embeddings_last_used_at', table_name='embeddings')
+    op.drop_column('embeddings', 'last_used_at')
@@ -0,0 +1,46 @@
+"""Documents table with content hashes; near-duplicate chunk flag on ingestion jobs
+
+Revision ID: c5a7e2d94b16
+Revises: 8e41c0a95d27
+Create Date: 2026-10-19 19:41:07.512093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5a7e2d94b16'
+down_revision: Union[str, None] = '8e41c0a95d27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'documents',
+        sa.Column('id', sa.UUID(), nullable=False),
+        sa.Column('embedding_id', sa.UUID(), nullable=False),
+        sa.Column('filename', sa.String(length=500), nullable=False),
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('size_bytes', sa.BigInteger(), nullable=False),
+        sa.Column('chunk_count', sa.Integer(), nullable=False),
+        sa.Column('duplicate_chunks', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['embedding_id'], ['embeddings.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_documents_embedding_filename', 'documents', ['embedding_id', 'filename'], unique=True)
+    op.create_index('ix_documents_embedding_content_hash', 'documents', ['embedding_id', 'content_hash'], unique=False)
+    op.add_column('ingestion_jobs', sa.Column('dedup_chunks', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('ingestion_jobs', 'dedup_chunks')
+    op.drop_index('ix_documents_embedding_content_hash', table_name='documents')
+    op.drop_index('ix_documents_embedding_filename', table_name='documents')
+    op.drop_table('documents')
@@ -0,0 +1,28 @@
+"""Retry backoff on ingestion jobs
+
+Revision ID: c9d1a7e4f360
+Revises: b3e8f15c6d92
+Create Date: 2026-10-20 09:12:37.584102
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9d1a7e4f360'
+down_revision: Union[str, None] = 'b3e8f15c6d92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('ingestion_jobs', sa.Column('run_after', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('ingestion_jobs', 'run_after')
@@ -0,0 +1,28 @@
+"""Job kind on ingestion jobs (ingest, replace, delete, compact)
+
+Revision ID: d2f8a61b7c30
+Revises: c5a7e2d94b16
+Create Date: 2026-10-19 20:12:44.903517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2f8a61b7c30'
+down_revision: Union[str, None] = 'c5a7e2d94b16'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('ingestion_jobs', sa.Column('kind', sa.String(length=20), server_default='ingest', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('ingestion_jobs', 'kind')
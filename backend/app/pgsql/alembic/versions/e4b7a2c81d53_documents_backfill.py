@@ -0,0 +1,32 @@
+"""Documents backfilled from collections embedded before the documents table
+
+Revision ID: e4b7a2c81d53
+Revises: c9d1a7e4f360
+Create Date: 2026-10-20 14:03:51.226417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b7a2c81d53'
+down_revision: Union[str, None] = 'c9d1a7e4f360'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # files only known from the stored chunks have no upload bytes to hash or measure
+    op.alter_column('documents', 'content_hash', existing_type=sa.String(length=64), nullable=True)
+    op.alter_column('documents', 'size_bytes', existing_type=sa.BigInteger(), nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM documents WHERE content_hash IS NULL OR size_bytes IS NULL")
+    op.alter_column('documents', 'size_bytes', existing_type=sa.BigInteger(), nullable=False)
+    op.alter_column('documents', 'content_hash', existing_type=sa.String(length=64), nullable=False)
@@ -0,0 +1,30 @@
+"""Page count and S3 key on documents
+
+Revision ID: f1b3c8e7a254
+Revises: d2f8a61b7c30
+Create Date: 2026-10-19 20:47:31.118620
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1b3c8e7a254'
+down_revision: Union[str, None] = 'd2f8a61b7c30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('documents', sa.Column('pages', sa.Integer(), nullable=True))
+    op.add_column('documents', sa.Column('s3_key', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('documents', 's3_key')
+    op.drop_column('documents', 'pages')
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Index
+from sqlalchemy import Column, Integer, BigInteger, String, Text, ForeignKey, DateTime, Index, Boolean
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime,   timezone
 import uuid
@@ -26,9 +26,13 @@ class Embedding(Base):
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     faiss_path = Column(String, nullable=True)  # local path or S3 key
     chunks_path = Column(String, nullable=True)  # local path or S3 key
+    version = Column(Integer, nullable=False, default=0)  # bumped whenever the stored index/chunks change
+    last_used_at = Column(DateTime(timezone=True), nullable=True)  # last question or load, for warm-up
 
     user = relationship("User", back_populates="embeddings")
     messages = relationship("Message", back_populates="embedding", cascade="all, delete-orphan")
+    jobs = relationship("IngestionJob", back_populates="embedding", cascade="all, delete-orphan")
+    documents = relationship("Document", back_populates="embedding", cascade="all, delete-orphan")
 
 class Message(Base):
     __tablename__ = 'messages'
@@ -38,13 +42,60 @@ class Message(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     role = Column(String(10), nullable=False)  # 'user' or 'bot'
     content = Column(Text, nullable=False)
-    evidence = Column(JSONB, nullable=True) # JSONB for pgsql
+    evidence = Column(JSONB(none_as_null=True), nullable=True) # JSONB for pgsql; None stays SQL NULL in bulk inserts
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
 
     embedding = relationship("Embedding", back_populates="messages")
     user = relationship("User", back_populates="messages")
 
+class IngestionJob(Base):
+    __tablename__ = 'ingestion_jobs'
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    embedding_id = Column(UUID(as_uuid=True), ForeignKey("embeddings.id"), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    kind = Column(String(20), nullable=False, default="ingest")  # ingest, replace, delete, compact
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, succeeded, failed
+    append = Column(Boolean, nullable=False, default=True)
+    files = Column(JSONB, nullable=False)  # [{"filename": ..., "s3_key": ..., "content_hash": ...}] staged uploads
+    batch_size = Column(Integer, nullable=False)
+    total_chunks = Column(Integer, nullable=False, default=0)
+    embedded_chunks = Column(Integer, nullable=False, default=0)
+    checkpoint_batches = Column(Integer, nullable=False, default=0)  # embedded batches saved to S3
+    dedup_chunks = Column(Boolean, nullable=False, default=False)  # drop near-duplicate chunks (MinHash/LSH)
+    attempts = Column(Integer, nullable=False, default=0)
+    worker_id = Column(String(100), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    run_after = Column(DateTime(timezone=True), nullable=True)  # retry backoff: not claimed before this
+    result = Column(JSONB, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    embedding = relationship("Embedding", back_populates="jobs")
+
+class Document(Base):
+    __tablename__ = 'documents'
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    embedding_id = Column(UUID(as_uuid=True), ForeignKey("embeddings.id"), nullable=False)
+    filename = Column(String(500), nullable=False)
+    content_hash = Column(String(64), nullable=True)  # sha256 of the uploaded bytes; None for files backfilled from chunks
+    size_bytes = Column(BigInteger, nullable=True)
+    pages = Column(Integer, nullable=True)  # PDF pages / image frames; None for text formats
+    s3_key = Column(String, nullable=True)  # original upload
+    chunk_count = Column(Integer, nullable=False)  # chunks added to the index
+    duplicate_chunks = Column(Integer, nullable=False, default=0)  # near-duplicate chunks left out of the index
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+    embedding = relationship("Embedding", back_populates="documents")
+
 Index("ix_messages_embedding_id", Message.embedding_id)
 Index("ix_messages_user_id", Message.user_id)
 Index("ix_messages_created_at", Message.created_at)
-
+Index("ix_messages_embedding_created_id", Message.embedding_id, Message.created_at, Message.id)  # keyset pagination of chat history
+Index("ix_ingestion_jobs_status_created_at", IngestionJob.status, IngestionJob.created_at)
+Index("ix_ingestion_jobs_embedding_id", IngestionJob.embedding_id)
+Index("ix_documents_embedding_filename", Document.embedding_id, Document.filename, unique=True)
+Index("ix_documents_embedding_content_hash", Document.embedding_id, Document.content_hash)
+Index("ix_embeddings_last_used_at", Embedding.last_used_at)
@@ -0,0 +1,148 @@
+# warmup.py — keeps the collections people are about to use in memory
+#
+# Usage is recorded on embeddings.last_used_at (at most once per USAGE_RECORD_INTERVAL
+# per collection and process). At startup the WARMUP_COLLECTIONS most recently used
+# collections are loaded in the background, most recent first, while they fit in the
+# collection cache budget (COLLECTION_CACHE_MB of stored index + chunks). /list-embeddings
+# (the first call after login) prefetches the user's most recently used collection, at
+# most once per PREFETCH_INTERVAL, so their first question doesn't wait for S3.
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+
+from sqlalchemy import select, update
+
+import app.memory as memory
+from app.pgsql.database import AsyncSessionLocal
+from app.pgsql.models import Embedding
+from app.collection_store import get_collection, collection_version, stored_size, cached_bytes, COLLECTION_CACHE_MB
+from app.metrics import timed
+
+from dotenv import load_dotenv
+
+load_dotenv()
+WARMUP_COLLECTIONS = int(os.getenv("WARMUP_COLLECTIONS", "20"))  # 0 disables startup preloading
+WARMUP_WINDOW_DAYS = float(os.getenv("WARMUP_WINDOW_DAYS", "7"))  # only collections used this recently
+USAGE_RECORD_INTERVAL = float(os.getenv("USAGE_RECORD_INTERVAL", "60"))  # seconds
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "300"))  # seconds between prefetches for one user
+
+logger = logging.getLogger(__name__)
+
+
+def is_cached(embedding):
+    cached = memory.collections.get((embedding.user_id, embedding.name))
+    return cached is not None and cached.get("version") == collection_version(embedding)
+
+
+class Warmup:
+    def __init__(self):
+        self._recorded = {}  # embedding_id -> time.monotonic() of the last usage write
+        self._prefetched = {}  # user_id -> time.monotonic() of the last prefetch
+        self._tasks = set()
+        self._startup = None
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def start(self):
+        if self._startup is None and WARMUP_COLLECTIONS > 0:
+            self._startup = self._spawn(self.preload())
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._startup = None
+
+    def record_usage(self, embedding_id):
+        """Note that a collection was used; written in the background, rate-limited per collection."""
+        now = time.monotonic()
+        last = self._recorded.get(embedding_id)
+        if last is not None and now - last < USAGE_RECORD_INTERVAL:
+            return
+        self._recorded[embedding_id] = now
+        self._spawn(self._write_usage(embedding_id))
+
+    async def _write_usage(self, embedding_id):
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(Embedding).where(Embedding.id == embedding_id).values(last_used_at=datetime.now(timezone.utc))
+                )
+                await db.commit()
+        except Exception as e:
+            logger.warning("Could not record collection usage", extra={"embedding_id": str(embedding_id), "error": str(e)})
+
+    async def preload(self):
+        """Load the most recently used collections while they fit in the collection cache."""
+        since = datetime.now(timezone.utc) - timedelta(days=WARMUP_WINDOW_DAYS)
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(Embedding)
+                    .where(Embedding.last_used_at >= since, Embedding.chunks_path.isnot(None), Embedding.faiss_path.isnot(None))
+                    .order_by(Embedding.last_used_at.desc())
+                    .limit(WARMUP_COLLECTIONS)
+                )
+                embeddings = result.scalars().all()
+        except Exception as e:
+            logger.warning("Collection warm-up skipped", extra={"error": str(e)})
+            return
+
+        # what is already cached counts, so warm-up never evicts a collection
+        budget = COLLECTION_CACHE_MB * 1024 * 1024 - cached_bytes()
+        loaded = []
+        with timed("collection_warmup"):
+            for embedding in embeddings:
+                if is_cached(embedding):
+                    continue
+                size = await asyncio.to_thread(
+                    stored_size, embedding.user_id, embedding.name, embedding.chunks_path, embedding.faiss_path
+                )
+                if size > budget:
+                    continue  # too big for what is left; a smaller, less recent one may still fit
+                try:
+                    await get_collection(embedding.user_id, embedding)
+                except Exception as e:
+                    logger.warning("Collection warm-up failed", extra={"embedding": embedding.name, "error": str(e)})
+                    continue
+                budget -= size
+                loaded.append(embedding.name)
+        logger.info("Collections warmed up", extra={"collections": len(loaded), "candidates": len(embeddings)})
+
+    def prefetch_recent(self, user_id):
+        """Start loading the user's most recently used collection in the background.
+
+        /list-embeddings is polled by the UI, so this runs at most once per PREFETCH_INTERVAL
+        per user; the lookup and the load both happen off the request path.
+        """
+        now = time.monotonic()
+        last = self._prefetched.get(user_id)
+        if last is not None and now - last < PREFETCH_INTERVAL:
+            return
+        self._prefetched[user_id] = now
+        self._spawn(self._prefetch_recent(user_id))
+
+    async def _prefetch_recent(self, user_id):
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(Embedding)
+                    .where(Embedding.user_id == user_id, Embedding.last_used_at.isnot(None),
+                           Embedding.chunks_path.isnot(None), Embedding.faiss_path.isnot(None))
+                    .order_by(Embedding.last_used_at.desc())
+                    .limit(1)
+                )
+                embedding = result.scalars().first()
+            if embedding is not None and not is_cached(embedding):
+                await get_collection(user_id, embedding)
+        except Exception as e:
+            logger.warning("Collection prefetch failed", extra={"user_id": str(user_id), "error": str(e)})
+
+
+warmup = Warmup()
@@ -0,0 +1,262 @@
+# load_test.py — end-to-end load test of the API against local stand-ins
+#   python -m benchmarks.load_test --users 20 --asks-per-user 10
+#
+# Boots the stub embedding/Mistral server (benchmarks/stub_services.py), the API
+# (main:app) and the ingestion worker with S3_LOCAL_DIR pointing at a temporary
+# directory, then drives concurrent users through
+# register -> login -> embed-files (until the ingestion job finishes) -> load-embedding -> ask
+# and reports p50/p95/p99 latency and requests per second for every step.
+# Postgres comes from DATABASE_URL (or --database-url); tables are created if missing.
+# Pass --api-url to drive an API that is already running instead.
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import aiohttp
+import numpy as np
+
+from dotenv import load_dotenv
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PERCENTILES = (50, 95, 99)
+
+load_dotenv(os.path.join(BACKEND_DIR, ".env"))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def synthetic_document(seed, size_kb):
+    """Deterministic pseudo-text drawn from a small vocabulary so questions hit real terms."""
+    rng = np.random.default_rng(seed)
+    words = [f"term{i}" for i in range(2000)]
+    text, size = [], 0
+    while size < size_kb * 1024:
+        sentence = " ".join(rng.choice(words, rng.integers(8, 20))) + ".\n"
+        text.append(sentence)
+        size += len(sentence)
+    return "".join(text)
+
+
+class Recorder:
+    """Latency samples per step: (start, end, ok)."""
+
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, step, start, end, ok=True):
+        self.samples.setdefault(step, []).append((start, end, ok))
+
+    def summary(self):
+        report = {}
+        for step, samples in self.samples.items():
+            durations = np.array([end - start for start, end, ok in samples if ok])
+            window = max(end for _, end, _ in samples) - min(start for start, _, _ in samples)
+            entry = {
+                "requests": len(samples),
+                "errors": sum(1 for *_, ok in samples if not ok),
+                "rps": round(len(samples) / window, 2) if window > 0 else None,
+            }
+            for p in PERCENTILES:
+                entry[f"p{p}_ms"] = round(float(np.percentile(durations, p)) * 1000, 1) if len(durations) else None
+            report[step] = entry
+        return report
+
+
+async def timed_request(recorder, step, session, method, url, expect=200, **kwargs):
+    start = time.perf_counter()
+    try:
+        async with session.request(method, url, **kwargs) as response:
+            body = await response.read()
+            ok = response.status == expect
+    except aiohttp.ClientError:
+        body, ok = b"", False
+    recorder.add(step, start, time.perf_counter(), ok)
+    if not ok:
+        return None
+    return json.loads(body) if body else {}
+
+
+async def run_user(user_no, args, api, recorder):
+    username = f"bench-{uuid.uuid4().hex[:12]}"
+    timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        credentials = {"username": username, "password": "bench-password"}
+        if await timed_request(recorder, "register", session, "POST", f"{api}/register", json=credentials) is None:
+            return
+        login = await timed_request(recorder, "login", session, "POST", f"{api}/login", json=credentials)
+        if login is None:
+            return
+        headers = {"Authorization": f"Bearer {login['access_token']}"}
+
+        form = aiohttp.FormData()
+        form.add_field("name", "bench")
+        for i in range(args.files_per_user):
+            text = synthetic_document(user_no * 1000 + i, args.doc_kb)
+            form.add_field("files", text.encode(), filename=f"doc{i}.txt", content_type="text/plain")
+        ingest_start = time.perf_counter()
+        queued = await timed_request(recorder, "embed-files", session, "POST", f"{api}/embed-files", data=form, headers=headers)
+        if queued is None or "job_id" not in queued:
+            return
+
+        # ingestion: upload accepted -> job finished in the worker
+        status = None
+        while time.perf_counter() - ingest_start < args.ingest_timeout:
+            await asyncio.sleep(args.poll_interval)
+            job = await timed_request(recorder, "ingest-jobs", session, "GET", f"{api}/ingest-jobs/{queued['job_id']}", headers=headers)
+            status = job and job["status"]
+            if status in ("succeeded", "failed"):
+                break
+        recorder.add("ingest (end to end)", ingest_start, time.perf_counter(), status == "succeeded")
+        if status != "succeeded":
+            return
+
+        if await timed_request(recorder, "load-embedding", session, "GET", f"{api}/load-embedding", params={"name": "bench"}, headers=headers) is None:
+            return
+
+        rng = np.random.default_rng(user_no)
+        for _ in range(args.asks_per_user):
+            question = "What is said about " + " and ".join(f"term{t}" for t in rng.integers(0, 2000, 3)) + "?"
+            await timed_request(recorder, "ask", session, "POST", f"{api}/ask", json={"question": question, "embedding": "bench"}, headers=headers)
+
+
+async def wait_ready(url, processes=(), timeout=60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if any(p.poll() is not None for p in processes):
+                raise RuntimeError(f"a service exited before {url} became ready")
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+def start_services(args, s3_dir):
+    """Stub server, API and ingestion worker as subprocesses; returns (api url, stub url, processes)."""
+    stub_port, api_port = free_port(), free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=args.database_url,
+        S3_LOCAL_DIR=s3_dir,
+        AWS_S3_BUCKET=os.getenv("AWS_S3_BUCKET") or "research-gpt-bench",
+        EMBED_SERVER_URL="127.0.0.1",
+        EMBED_SERVER_PORT=str(stub_port),
+        MISTRAL_SERVER_URL=f"http://127.0.0.1:{stub_port}",
+        MISTRAL_KEY=os.getenv("MISTRAL_KEY") or "stub",
+        SECRET_KEY=os.getenv("SECRET_KEY") or uuid.uuid4().hex,
+        ALGORITHM=os.getenv("ALGORITHM") or "HS256",
+        STUB_LLM_LATENCY_MS=str(args.llm_latency_ms),
+        STUB_EMBED_LATENCY_MS=str(args.embed_latency_ms),
+        INGEST_POLL_INTERVAL="0.2",
+        LOG_LEVEL=os.getenv("LOG_LEVEL") or "WARNING",
+    )
+    subprocess.run(
+        [sys.executable, "-c",
+         "from app.pgsql.models import Base; from app.pgsql.database import engine; Base.metadata.create_all(engine)"],
+        cwd=BACKEND_DIR, env=env, check=True
+    )
+
+    uvicorn = [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--log-level", "warning"]
+    processes = [
+        subprocess.Popen(uvicorn + ["benchmarks.stub_services:app", "--port", str(stub_port)], cwd=BACKEND_DIR, env=env),
+        subprocess.Popen(uvicorn + ["main:app", "--port", str(api_port), "--workers", str(args.api_workers)], cwd=BACKEND_DIR, env=env),
+        subprocess.Popen([sys.executable, "ingest_worker.py", "--processes", str(args.ingest_workers)], cwd=BACKEND_DIR, env=env),
+    ]
+    return f"http://127.0.0.1:{api_port}", f"http://127.0.0.1:{stub_port}", processes
+
+
+def stop_services(processes):
+    for p in processes:
+        p.terminate()
+    for p in processes:
+        try:
+            p.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+
+def print_report(report, wall):
+    print(f"\n{'step':<22}{'requests':>9}{'errors':>8}{'rps':>9}" + "".join(f"{'p' + str(p) + ' ms':>11}" for p in PERCENTILES))
+    for step, entry in report.items():
+        cells = "".join(f"{entry[f'p{p}_ms'] if entry[f'p{p}_ms'] is not None else '-':>11}" for p in PERCENTILES)
+        print(f"{step:<22}{entry['requests']:>9}{entry['errors']:>8}{entry['rps'] or '-':>9}{cells}")
+    print(f"\nwall time {wall:.1f}s")
+
+
+async def run(args):
+    processes = []
+    s3_dir = tempfile.mkdtemp(prefix="research-gpt-bench-s3-")
+    try:
+        if args.api_url:
+            api = args.api_url.rstrip("/")
+            await wait_ready(api.rsplit("/api", 1)[0] + "/metrics")
+        else:
+            api_root, stub, processes = start_services(args, s3_dir)
+            await wait_ready(f"{stub}/health", processes)
+            await wait_ready(f"{api_root}/metrics", processes)
+            api = f"{api_root}/api"
+
+        recorder = Recorder()
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(args.concurrency or args.users)
+
+        async def user(n):
+            async with semaphore:
+                await run_user(n, args, api, recorder)
+
+        await asyncio.gather(*(user(n) for n in range(args.users)))
+        wall = time.perf_counter() - start
+    finally:
+        stop_services(processes)
+        shutil.rmtree(s3_dir, ignore_errors=True)
+
+    report = recorder.summary()
+    print_report(report, wall)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "wall_seconds": round(wall, 2), "steps": report}, f, indent=2)
+        print(f"results written to {args.json}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Research-GPT end-to-end load test")
+    parser.add_argument("--users", type=int, default=10, help="simulated users")
+    parser.add_argument("--concurrency", type=int, default=0, help="users active at once (default: all)")
+    parser.add_argument("--files-per-user", type=int, default=2)
+    parser.add_argument("--doc-kb", type=int, default=40, help="size of each uploaded document")
+    parser.add_argument("--asks-per-user", type=int, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--embed-latency-ms", type=float, default=5)
+    parser.add_argument("--api-workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--ingest-workers", type=int, default=1, help="ingestion worker processes")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--api-url", help="drive an already running API (e.g. http://127.0.0.1:8888/api) instead of booting one")
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--ingest-timeout", type=float, default=300)
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if not args.api_url and not args.database_url:
+        parser.error("set DATABASE_URL or pass --database-url")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# microbench.py — CPU-bound retrieval hot paths on synthetic collections
+#   python -m benchmarks.microbench --sizes 1000,10000,100000 --output microbench.json
+#   python -m benchmarks.microbench --sizes 1000000 --index-types flat,hnsw   # needs ~4 GB per 1M x 768 vectors
+#
+# Every benchmark calls the same code the API and the ingestion worker run
+# (split_text / chunk_document, normalize_L2 + add_with_ids, search_index_ids,
+# match_quoted_evidence, chunk pickles, faiss.serialize_index) so the numbers
+# track changes to those functions. Results are written as one flat JSON record
+# per (benchmark, size, index type); data is seeded, so runs are reproducible.
+import os
+import sys
+import json
+import time
+import pickle
+import platform
+import argparse
+import subprocess
+from datetime import datetime, timezone
+
+import faiss
+import numpy as np
+
+from app.chatbot import split_text, chunk_document, search_index_ids, search_params, match_quoted_evidence, CHUNK_SIZE
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS = np.array([f"term{i}" for i in range(5000)])
+
+
+def measure(fn, repeat):
+    """Run fn `repeat` times; returns (seconds per run list, last result)."""
+    times, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def summarize(times):
+    times = np.array(times)
+    return {
+        "runs": len(times),
+        "min_s": float(times.min()),
+        "median_s": float(np.median(times)),
+        "p95_s": float(np.percentile(times, 95)),
+        "p99_s": float(np.percentile(times, 99)),
+    }
+
+
+def synthetic_text(rng, n_chars):
+    words = rng.choice(WORDS, n_chars // 7 + 1)
+    return " ".join(words)[:n_chars]
+
+
+def synthetic_chunks(rng, size, chunk_chars):
+    """`size` chunk dicts over a handful of files, shaped like chunk_document output."""
+    files = max(1, size // 500)
+    chunks = []
+    for i in range(size):
+        text = synthetic_text(rng, chunk_chars)
+        chunks.append({
+            "text": text, "filename": f"file{i % files}.txt", "chunk_index": i // files,
+            "start": 0, "end": len(text)
+        })
+    return chunks
+
+
+def synthetic_vectors(rng, size, dim, block=100_000):
+    vectors = np.empty((size, dim), dtype=np.float32)
+    for start in range(0, size, block):
+        stop = min(size, start + block)
+        vectors[start:stop] = rng.standard_normal((stop - start, dim), dtype=np.float32)
+    return vectors
+
+
+def build_index(index_type, vectors, ids):
+    """Normalized vectors into an IDMap'ed index, as ingest.add_to_index does for "flat"."""
+    dim = vectors.shape[1]
+    if index_type == "flat":
+        base = faiss.IndexFlatIP(dim)
+    elif index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efSearch = 64
+    elif index_type == "ivf":
+        nlist = max(1, min(int(4 * np.sqrt(len(vectors))), len(vectors) // 39))  # faiss wants >= 39 points per list
+        base = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        sample = vectors[np.random.default_rng(0).choice(len(vectors), min(len(vectors), 50 * nlist), replace=False)]
+        base.train(sample)
+        base.nprobe = 16
+    else:
+        raise ValueError(f"Unknown index type '{index_type}'")
+    index = faiss.IndexIDMap(base)
+    index.add_with_ids(vectors, ids)
+    return index
+
+
+def bench_text(results, rng, size, args):
+    # split_text / chunk_document over a document that yields `size` chunks
+    text = synthetic_text(rng, size * args.chunk_chars)
+    times, _ = measure(lambda: split_text(text, args.chunk_chars), args.repeat)
+    results.append({"benchmark": "split_text", "size": size, **summarize(times)})
+    times, _ = measure(lambda: chunk_document(text, "doc.txt", args.chunk_chars), args.repeat)
+    results.append({"benchmark": "chunk_document", "size": size, **summarize(times)})
+
+
+def bench_vectors(results, rng, size, chunks, args):
+    vectors = synthetic_vectors(rng, size, args.dim)
+    ids = np.arange(size, dtype=np.int64)
+
+    def normalize():
+        copy = vectors.copy()
+        faiss.normalize_L2(copy)
+        return copy
+
+    times, normalized = measure(normalize, args.repeat)
+    results.append({"benchmark": "normalize_L2", "size": size, "dim": args.dim, **summarize(times)})
+    del vectors
+
+    queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+    faiss.normalize_L2(queries)
+    one_file = [i for i, c in enumerate(chunks) if c["filename"] == "file0.txt"]
+
+    for index_type in args.index_types:
+        start = time.perf_counter()
+        index = build_index(index_type, normalized, ids)
+        build_s = time.perf_counter() - start
+        results.append({"benchmark": "index_build", "size": size, "dim": args.dim, "index_type": index_type,
+                        "runs": 1, "min_s": build_s, "median_s": build_s, "p95_s": build_s, "p99_s": build_s})
+
+        # single-query latency through search_index_ids (the /ask path)
+        latencies = []
+        for q in queries:
+            t0 = time.perf_counter()
+            search_index_ids(index, q.reshape(1, -1), args.k)
+            latencies.append(time.perf_counter() - t0)
+        results.append({"benchmark": "search", "size": size, "dim": args.dim, "index_type": index_type,
+                        "k": args.k, **summarize(latencies)})
+
+        # restricted to one file's chunks (filters / chunk ranges)
+        params = search_params(np.array(one_file, dtype=np.int64))
+        if index_type == "ivf":
+            # IVF indexes only take their own parameter type; keep the selector's owner alive
+            selector_owner = params
+            params = faiss.SearchParametersIVF(sel=selector_owner.sel, nprobe=faiss.downcast_index(index.index).nprobe)
+        latencies = []
+        for q in queries:
+            t0 = time.perf_counter()
+            index.search(q.reshape(1, -1), args.k, params=params)
+            latencies.append(time.perf_counter() - t0)
+        results.append({"benchmark": "search_filtered", "size": size, "dim": args.dim, "index_type": index_type,
+                        "k": args.k, "selected": len(one_file), **summarize(latencies)})
+
+        # all queries in one matrix search (/ask-batch)
+        times, _ = measure(lambda: index.search(queries, args.k), args.repeat)
+        entry = summarize(times)
+        entry["qps"] = args.queries / entry["median_s"]
+        results.append({"benchmark": "search_batch", "size": size, "dim": args.dim, "index_type": index_type,
+                        "k": args.k, "queries": args.queries, **entry})
+
+        if index_type == "flat":
+            def round_trip():
+                return faiss.deserialize_index(faiss.serialize_index(index))
+            times, _ = measure(lambda: faiss.serialize_index(index), args.repeat)
+            serialized = faiss.serialize_index(index)
+            results.append({"benchmark": "faiss_serialize", "size": size, "dim": args.dim,
+                            "bytes": int(serialized.nbytes), **summarize(times)})
+            times, _ = measure(lambda: faiss.deserialize_index(serialized), args.repeat)
+            results.append({"benchmark": "faiss_deserialize", "size": size, "dim": args.dim, **summarize(times)})
+            times, _ = measure(round_trip, args.repeat)
+            results.append({"benchmark": "faiss_round_trip", "size": size, "dim": args.dim, **summarize(times)})
+            del serialized
+        del index
+
+
+def bench_chunks(results, rng, size, chunks, args):
+    # answers quoting text from chunks spread over the collection (worst case: the last one)
+    positions = [0, size // 2, size - 1]
+    quotes = [chunks[p]["text"][10:90] for p in positions]
+    answer = "Answer.\nEvidence: " + " ".join(f'"{q}"' for q in quotes)
+    times, matched = measure(lambda: match_quoted_evidence(answer, chunks), args.repeat)
+    results.append({"benchmark": "evidence_match", "size": size, "quotes": len(quotes),
+                    "matched": len(matched), **summarize(times)})
+
+    times, payload = measure(lambda: pickle.dumps(chunks), args.repeat)
+    results.append({"benchmark": "chunks_pickle_dumps", "size": size, "bytes": len(payload), **summarize(times)})
+    times, _ = measure(lambda: pickle.loads(payload), args.repeat)
+    results.append({"benchmark": "chunks_pickle_loads", "size": size, **summarize(times)})
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "faiss": faiss.__version__,
+        "faiss_omp_threads": faiss.omp_get_max_threads(),
+        "numpy": np.__version__,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Research-GPT retrieval microbenchmarks")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma separated chunk counts")
+    parser.add_argument("--dim", type=int, default=768, help="embedding dimension (jina-embeddings-v2-base: 768)")
+    parser.add_argument("--chunk-chars", type=int, default=1000,
+                        help=f"characters per synthetic chunk (the API uses CHUNK_SIZE={CHUNK_SIZE})")
+    parser.add_argument("--index-types", default="flat,hnsw,ivf", help="flat (what the API builds), hnsw, ivf")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip", default="", help="comma separated groups to skip: text, vectors, chunks")
+    parser.add_argument("--output", default="microbench.json")
+    args = parser.parse_args()
+    args.index_types = [t for t in args.index_types.split(",") if t]
+    skip = set(args.skip.split(","))
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        rng = np.random.default_rng(args.seed)
+        print(f"size {size}...", flush=True)
+        chunks = synthetic_chunks(rng, size, args.chunk_chars)
+        if "text" not in skip:
+            bench_text(results, rng, size, args)
+        if "chunks" not in skip:
+            bench_chunks(results, rng, size, chunks, args)
+        if "vectors" not in skip:
+            bench_vectors(results, rng, size, chunks, args)
+        del chunks
+
+    for r in results:
+        label = r["benchmark"] + (f"[{r['index_type']}]" if "index_type" in r else "")
+        print(f"{label:<28}{r['size']:>9}  median {r['median_s'] * 1000:10.3f} ms  p99 {r['p99_s'] * 1000:10.3f} ms")
+
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment(), "config": vars(args), "results": results}, f, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
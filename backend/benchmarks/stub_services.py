@@ -0,0 +1,75 @@
+# stub_services.py — local stand-ins for the embedding server and the Mistral chat API
+#   uvicorn benchmarks.stub_services:app --port 9100
+# Embeddings are deterministic (seeded by the text) so runs are reproducible;
+# latencies are set with STUB_EMBED_LATENCY_MS / STUB_LLM_LATENCY_MS.
+import os
+import time
+import uuid
+import zlib
+import asyncio
+
+import numpy as np
+from fastapi import FastAPI, Request
+
+from dotenv import load_dotenv
+
+load_dotenv()
+STUB_EMBED_DIM = int(os.getenv("STUB_EMBED_DIM", "768"))
+STUB_EMBED_LATENCY_MS = float(os.getenv("STUB_EMBED_LATENCY_MS", "5"))  # per request
+STUB_EMBED_LATENCY_PER_TEXT_MS = float(os.getenv("STUB_EMBED_LATENCY_PER_TEXT_MS", "1"))
+STUB_LLM_LATENCY_MS = float(os.getenv("STUB_LLM_LATENCY_MS", "300"))
+STUB_LLM_JITTER_MS = float(os.getenv("STUB_LLM_JITTER_MS", "50"))
+
+app = FastAPI()
+rng = np.random.default_rng()
+
+
+def fake_embedding(text, dim=STUB_EMBED_DIM):
+    vector = np.random.default_rng(zlib.crc32(text.encode())).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    await asyncio.sleep((STUB_EMBED_LATENCY_MS + STUB_EMBED_LATENCY_PER_TEXT_MS * len(texts)) / 1000)
+    return {
+        "object": "list",
+        "data": [{"object": "embedding", "embedding": fake_embedding(t), "index": i} for i, t in enumerate(texts)],
+        "model": "stub-embeddings",
+        "usage": {"total_tokens": sum(len(t) for t in texts)}
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt = body["messages"][-1]["content"]
+    delay = max(0.0, STUB_LLM_LATENCY_MS + rng.uniform(-STUB_LLM_JITTER_MS, STUB_LLM_JITTER_MS))
+    await asyncio.sleep(delay / 1000)
+
+    # quote the first context line so evidence matching has something to find
+    context = prompt.split("---------------------\n")
+    quote = context[1].strip().splitlines()[0][:80] if len(context) > 1 and context[1].strip() else ""
+    content = f'Stub answer. Evidence: "{quote}"' if quote else "Stub answer."
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": uuid.uuid4().hex,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+    }
+
+
+@app.get("/health")
+@app.get("/ready")
+def health():
+    return {"status": "ok"}
@@ -1,41 +1,112 @@
 import os
-import io
+import re
+import math
+import time
+import base64
+import asyncio
+import logging
 import shutil
 import json
 import pickle
-import numpy as np
-import faiss
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from fastapi import FastAPI, Request, UploadFile, File, Form, Response, HTTPException, Depends, APIRouter, Query
 from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from passlib.context import CryptContext
 from typing import List
+from urllib.parse import quote
+from email.utils import format_datetime
+from botocore.exceptions import ClientError, HTTPClientError, ConnectionError as S3ConnectionError
 
 from app.auth import router as auth_router
 
 import uuid
-from sqlalchemy.orm import Session
-from app.pgsql.database import get_db
-from app.auth_utils import get_current_user
-from app.pgsql.models import Base, User, Embedding, Message
+from sqlalchemy import select, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.pgsql.database import get_async_db, AsyncSessionLocal
+from app.auth_utils import get_current_user, get_current_user_readonly
+from app.pgsql.models import Base, User, Embedding, Message, IngestionJob, Document
 from app.pgsql.models import User
 
-from app.chatbot import extract_text_from_file, split_text, load_document_chunks, load_chunks_from_file, get_text_embedding_async, answer_question, run_mistral_async
+from app.chatbot import extract_text_from_file, chunk_document, load_document_chunks, load_chunks_from_file, answer_question, answer_question_multi, answer_questions_batch, run_mistral_async, DeadlineExceeded, ASK_TIMEOUT, live_chunks, filter_chunk_ids, RETRIEVAL_MODE, RETRIEVAL_MODES
 import app.memory as memory
+from app.executors import run_cpu
+from app.message_writer import message_writer
+from app.llm_gateway import LLMUnavailable
+from app.warmup import warmup
+from app.metrics import CLIENT_DISCONNECTS
+from app.ingest import enqueue_job, enqueue_delete_job, job_status, load_documents, backfill_documents, partition_uploads, extracted_document, document_media_type, CHUNK_DEDUP
+from app.dedup import content_hash
+from app.collection_store import get_collection, get_collections, drop_collection, touch_collection, collection_version
 
-from app.aws_s3_utils import s3, AWS_S3_BUCKET, upload_pickle_to_s3, download_pickle_from_s3, upload_faiss_to_s3, download_faiss_from_s3, delete_from_s3, s3_key_for
+from app.aws_s3_utils import upload_json_to_s3, download_json_from_s3, extracted_key_for, document_key_for, get_object_stream, delete_from_s3, delete_prefix_from_s3, s3_key_for
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
+BATCH_ASK_MAX_QUESTIONS = int(os.getenv("BATCH_ASK_MAX_QUESTIONS", "500"))
+PREVIEW_STREAM_CHUNK_SIZE = int(os.getenv("PREVIEW_STREAM_CHUNK_SIZE", str(256 * 1024)))
+PREVIEW_CACHE_CONTROL = "private, max-age=300, must-revalidate"
+BYTE_RANGE_RE = re.compile(r"^bytes=(\d+-\d*|-\d+)$")
+
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+async def get_user_embedding(db: AsyncSession, user_id, name):
+    result = await db.execute(select(Embedding).filter_by(user_id=user_id, name=name))
+    return result.scalars().first()
+
+
+def collection_load_error(e, user_id, name):
+    """Log a failed collection download; 503 when S3 is unreachable or failing, 500 otherwise."""
+    logger.error("Collection download failed", extra={"user_id": str(user_id), "embedding": name, "error": str(e)}, exc_info=e)
+    transient = isinstance(e, (S3ConnectionError, HTTPClientError)) or (
+        isinstance(e, ClientError) and e.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0) >= 500
+    )
+    return HTTPException(status_code=503 if transient else 500, detail=f"Failed to load embedding from S3: {e}")
+
+
+def message_row(user_id, embedding_id, role, content, evidence=None, created_at=None):
+    return {
+        "id": uuid.uuid4(),
+        "user_id": user_id,
+        "embedding_id": embedding_id,
+        "role": role,
+        "content": content,
+        "evidence": evidence,
+        "created_at": created_at or datetime.now(timezone.utc)
+    }
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def cancel_on_disconnect(request, awaitable):
+    """Await `awaitable`, cancelling it (and the embedding/LLM calls it is waiting on) if the client goes away."""
+    work = asyncio.ensure_future(awaitable)
+
+    async def disconnected():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+
+    watcher = asyncio.ensure_future(disconnected())
+    try:
+        done, _ = await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not work.done():
+            work.cancel()
+    if work not in done:
+        CLIENT_DISCONNECTS.labels(request.url.path).inc()
+        raise ClientDisconnected()
+    return work.result()
+
 
 @router.get("/test-auth")
-def test_auth(current_user: User = Depends(get_current_user)):
-    print("✔️ Auth route hit")
+def test_auth(current_user: User = Depends(get_current_user_readonly)):
     return {"user_name": str(current_user.username)}
 
 
@@ -43,320 +114,674 @@ def test_auth(current_user: User = Depends(get_current_user)):
 async def embed_files(
     name: str = Form(...),
     append: bool = Form(True),
+    dedup_chunks: bool = Form(CHUNK_DEDUP),
     files: List[UploadFile] = File(...),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    """Queue an ingestion job; poll /ingest-jobs/{job_id} for progress."""
     user_id = current_user.id
 
     # Get or create embedding entry in the DB
-    embedding = db.query(Embedding).filter_by(user_id=user_id, name=name).first()
+    embedding = await get_user_embedding(db, user_id, name)
     if not embedding:
         embedding = Embedding(id=uuid.uuid4(), user_id=user_id, name=name)
         db.add(embedding)
-        db.commit()
-        db.refresh(embedding)
-
-    faiss_index_key = s3_key_for(user_id, name, "faiss.index")
-    chunks_pkl_key = s3_key_for(user_id, name, "chunks.pkl")
-
-    # Load previous chunks/index if appending
-    if append:
-        try:
-            old_chunks = download_pickle_from_s3(chunks_pkl_key)
-            old_filenames = {c["filename"] for c in old_chunks}
-            index = download_faiss_from_s3(faiss_index_key)
-        except:
-            old_chunks = []
-            old_filenames = set()
-            index = None
-    else:
-        old_chunks = []
-        old_filenames = set()
-        index = None
+        await db.commit()
 
     # Read new file contents early to avoid UploadFile closure
     new_files = []
     for file in files:
-        if file.filename in old_filenames:
-            continue
         contents = await file.read()
         new_files.append((file.filename, contents))
 
+    # Repeated names, and files whose bytes (or name) are already in the collection, are not staged at all
+    kept, skipped = partition_uploads(
+        [(filename, content_hash(contents)) for filename, contents in new_files],
+        await load_documents(db, embedding.id) if append else []
+    )
+    new_files = [new_files[i] for i in kept]
+
     if not new_files:
-        return Response("No new files to embed", media_type="text/plain")
+        return {"status": "skipped", "message": "No new files to embed", "skipped_files": skipped}
 
-    async def streamer(index, old_chunks):
-        all_chunks = []
+    job = await enqueue_job(db, user_id, embedding, new_files, append=append, dedup_chunks=dedup_chunks)
+    return {"status": "queued", "job_id": str(job.id), "files": [f for f, _ in new_files], "skipped_files": skipped}
 
-        # Step 1: Read text and split
-        for filename, contents in new_files:
-            text = extract_text_from_file(contents, filename)
-            if not text:
-                continue
 
-            split_chunks = split_text(text, chunk_size=8000)
-            for idx, chunk in enumerate(split_chunks):
-                all_chunks.append({
-                    "text": chunk,
-                    "filename": filename,
-                    "chunk_index": idx
-                })
-            yield f"PROGRESS: {len(all_chunks)}/{len(all_chunks)}\n"
-
-        if not all_chunks:
-            yield "PROGRESS: 0/0\n"
-            yield json.dumps({"status": "error", "message": "No valid files found"})
-            return
-
-        # Step 2: Embed
-        new_embeddings = []
-        for idx, chunk in enumerate(all_chunks):
-            emb = await get_text_embedding_async(chunk["text"])
-            new_embeddings.append(emb)
-            yield f"PROGRESS: {idx + 1}/{len(all_chunks)}\n"
-
-        # embedded files uploaded to S3
-        for filename, contents in new_files:
-            s3_key = f"{user_id}/{name}/documents/{filename}"
-            s3.upload_fileobj(io.BytesIO(contents), AWS_S3_BUCKET, s3_key)
-
-        # Step 3: FAISS
-        emb_array = np.array(new_embeddings, dtype=np.float32)
-        faiss.normalize_L2(emb_array)
-
-        if index:
-            start_id = len(old_chunks)
-            ids = np.arange(start_id, start_id + len(all_chunks)).astype(np.int64)
-            index.add_with_ids(emb_array, ids)
-            all_chunks = old_chunks + all_chunks
-        else:
-            dim = emb_array.shape[1]
-            index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
-            ids = np.arange(len(all_chunks)).astype(np.int64)
-            index.add_with_ids(emb_array, ids)
-
-        # Step 4: Save to S3
-        embedding.faiss_path = faiss_index_key
-        embedding.chunks_path = chunks_pkl_key
-        db.add(embedding)
-        db.commit()
+@router.post("/replace-file")
+async def replace_file(
+    name: str = Form(...),
+    dedup_chunks: bool = Form(CHUNK_DEDUP),
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Queue a job that swaps one file of a collection for a new version (same filename)."""
+    embedding = await get_user_embedding(db, current_user.id, name)
+    if not embedding:
+        raise HTTPException(status_code=404, detail="Embedding not found")
 
-        upload_faiss_to_s3(index, faiss_index_key)
-        upload_pickle_to_s3(all_chunks, chunks_pkl_key)
+    contents = await file.read()
+    kept, skipped = partition_uploads(
+        [(file.filename, content_hash(contents))], await load_documents(db, embedding.id), replace=True
+    )
+    if not kept:
+        return {"status": "skipped", "message": "File is unchanged", "skipped_files": skipped}
 
-        memory.user_sessions[user_id] = {
-            "chunks": all_chunks,
-            "index": index
-        }
+    job = await enqueue_job(
+        db, current_user.id, embedding, [(file.filename, contents)], dedup_chunks=dedup_chunks, kind="replace"
+    )
+    return {"status": "queued", "job_id": str(job.id), "files": [file.filename]}
 
-        yield json.dumps({"status": "success", "message": "Embedding complete"})
 
-    return StreamingResponse(streamer(index, old_chunks), media_type="text/plain")
+@router.post("/delete-file")
+async def delete_file(
+    name: str = Query(...),
+    filename: str = Query(...),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Queue a job that removes one file's chunks from a collection without re-embedding the rest."""
+    embedding = await get_user_embedding(db, current_user.id, name)
+    if not embedding:
+        raise HTTPException(status_code=404, detail="Embedding not found")
 
+    job = await enqueue_delete_job(db, current_user.id, embedding, [filename])
+    return {"status": "queued", "job_id": str(job.id)}
 
 
+async def get_user_job(db: AsyncSession, user_id, job_id):
+    try:
+        job_uuid = uuid.UUID(job_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Job not found")
+    result = await db.execute(
+        select(IngestionJob).where(IngestionJob.id == job_uuid, IngestionJob.user_id == user_id)
+    )
+    job = result.scalars().first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/ingest-jobs/{job_id}")
+async def ingest_job_progress(
+    job_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_readonly)
+):
+    job = await get_user_job(db, current_user.id, job_id)
+
+    if job.status == "succeeded":
+        # The worker rewrote the collection in S3; drop a copy this process loaded before that
+        embedding = await db.get(Embedding, job.embedding_id)
+        cached = memory.collections.get((current_user.id, embedding.name)) if embedding else None
+        if cached and cached.get("loaded_at", 0) < job.updated_at.timestamp():
+            drop_collection(current_user.id, embedding.name)
+
+    return job_status(job)
+
+
+@router.get("/ingest-jobs")
+async def list_ingest_jobs(
+    name: str = Query(...),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_readonly)
+):
+    embedding = await get_user_embedding(db, current_user.id, name)
+    if not embedding:
+        raise HTTPException(status_code=404, detail="Embedding not found")
+    result = await db.execute(
+        select(IngestionJob)
+        .where(IngestionJob.embedding_id == embedding.id)
+        .order_by(IngestionJob.created_at.desc())
+        .limit(limit)
+    )
+    return {"jobs": [job_status(job) for job in result.scalars().all()]}
+
 
 @router.post("/ask")
 async def ask_question(
     request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
+    asked_at = datetime.now(timezone.utc)
     body = await request.json()
     question = body.get("question")
     embedding_name = body.get("embedding")
+    embedding_names = body.get("embeddings") or []
     open_mode = body.get("open_mode", False)
+    retrieval_mode = body.get("retrieval_mode", RETRIEVAL_MODE)
+    if retrieval_mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"retrieval_mode must be one of {', '.join(RETRIEVAL_MODES)}")
+    # seconds the client is willing to wait, capped at ASK_TIMEOUT; every stage below shares this budget
+    timeout = body.get("timeout", ASK_TIMEOUT)
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0:
+        raise HTTPException(status_code=400, detail="timeout must be a positive number of seconds")
+    deadline = time.monotonic() + min(timeout, ASK_TIMEOUT)
+    if not isinstance(embedding_names, list) or not all(isinstance(n, str) and n for n in embedding_names):
+        raise HTTPException(status_code=400, detail="embeddings must be a list of collection names")
+    if not embedding_name and embedding_names:
+        embedding_name = embedding_names[0]
     if not question or not embedding_name:
         raise HTTPException(status_code=400, detail="Missing question or embedding name")
+    if not isinstance(question, str) or not isinstance(embedding_name, str):
+        raise HTTPException(status_code=400, detail="question and embedding must be strings")
+
+    # Optional metadata filters: {"filenames": [...], "chunk_ranges": [{"filename", "start", "end"}]}
+    filters = body.get("filters") or {}
+    if not isinstance(filters, dict):
+        raise HTTPException(status_code=400, detail="filters must be an object")
+    filenames = filters.get("filenames") or []
+    chunk_ranges = filters.get("chunk_ranges") or []
+    if (not isinstance(filenames, list) or not all(isinstance(f, str) for f in filenames)
+            or not isinstance(chunk_ranges, list) or not all(isinstance(r, dict) for r in chunk_ranges)):
+        raise HTTPException(status_code=400, detail="filters.filenames must be a list of names and filters.chunk_ranges a list of objects")
+    for chunk_range in chunk_ranges:
+        bounds = (chunk_range.get("start"), chunk_range.get("end"))
+        if not isinstance(chunk_range.get("filename"), str) or not all(
+                b is None or (isinstance(b, int) and not isinstance(b, bool)) for b in bounds):
+            raise HTTPException(status_code=400, detail="filters.chunk_ranges need a filename and integer start/end")
 
     # Get embedding session
-    embedding = db.query(Embedding).filter_by(user_id=current_user.id, name=embedding_name).first()
+    embedding = await get_user_embedding(db, current_user.id, embedding_name)
     if not embedding:
         raise HTTPException(status_code=404, detail="Embedding not found")
-
-    # Save user's question
-    user_msg = Message(
-        id=uuid.uuid4(),
-        user_id=current_user.id,
-        embedding_id=embedding.id,
-        role="user",
-        content=question,
-        created_at=datetime.now(timezone.utc)
-    )
-    db.add(user_msg)
-    db.commit()
-
-    # Generate response based on mode
-    if open_mode:
-        prompt = f"Answer the following question as best you can using your general knowledge:\n\n{question}\n\nAnswer:"
-        answer = await run_mistral_async(prompt)
-        evidence = []
-    else:
-        session = memory.user_sessions.get(current_user.id)
-        if not session:
+    warmup.record_usage(embedding.id)
+
+    # Federated mode: search every requested collection in one query
+    federated = [n for n in embedding_names if n != embedding_name]
+    if federated:
+        result = await db.execute(
+            select(Embedding).where(Embedding.user_id == current_user.id, Embedding.name.in_(federated))
+        )
+        others = result.scalars().all()
+        if len(others) != len(set(federated)):
+            raise HTTPException(status_code=404, detail="Embedding not found")
+        targets = [embedding] + others
+        for other in others:
+            warmup.record_usage(other.id)
+
+    # Load the collections and resolve filters before anything is persisted
+    ids = None
+    if not open_mode:
+        if any(not e.chunks_path or not e.faiss_path for e in (targets if federated else [embedding])):
             raise HTTPException(status_code=400, detail="No embedding loaded")
+        if federated:
+            try:
+                collections = await get_collections(current_user.id, targets)
+            except Exception as e:
+                raise collection_load_error(e, current_user.id, embedding_name)
+        else:
+            session = memory.user_sessions.get(current_user.id)
+            if (not session or session.get("name") != embedding_name or session.get("version") != collection_version(embedding)
+                    or memory.collections.get((current_user.id, embedding_name)) is not session):
+                try:
+                    session = await get_collection(current_user.id, embedding)
+                except Exception as e:
+                    raise collection_load_error(e, current_user.id, embedding_name)
+                memory.user_sessions[current_user.id] = session
+            else:
+                touch_collection(current_user.id, embedding_name)
+            collections = {embedding_name: session}
+
+        if filenames or chunk_ranges:
+            ids = {}
+            for name, collection in collections.items():
+                selected = await run_cpu(filter_chunk_ids, collection, filenames, chunk_ranges)
+                if len(selected):
+                    ids[name] = selected
+            if not ids:
+                raise HTTPException(status_code=400, detail="No chunks match the filters")
+            collections = {name: c for name, c in collections.items() if name in ids}
 
-        answer, evidence = await answer_question(question, session["index"], session["chunks"])
+    # Generate response based on mode
+    async def generate():
+        if open_mode:
+            prompt = f"Answer the following question as best you can using your general knowledge:\n\n{question}\n\nAnswer:"
+            return await run_mistral_async(prompt, deadline=deadline), [], False
+        if federated:
+            return await answer_question_multi(question, collections, mode=retrieval_mode, ids=ids, deadline=deadline)
+        return await answer_question(
+            question, session["index"], session["chunks"], bm25=session.get("bm25"), mode=retrieval_mode,
+            ids=ids[embedding_name] if ids else None, deadline=deadline
+        )
 
+    try:
+        answer, evidence, degraded = await cancel_on_disconnect(request, generate())
+    except ClientDisconnected:
+        logger.info("Client disconnected, /ask abandoned", extra={"user_id": str(current_user.id)})
+        return Response(status_code=499)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except LLMUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after or 1))})
+
+    # Save the exchange (written behind, in order, by the message writer); abandoned requests save nothing
+    await message_writer.add(message_row(current_user.id, embedding.id, "user", question, created_at=asked_at))
     if not answer:
         return JSONResponse({"error": "No answer generated"}, status_code=400)
 
-    bot_msg = Message(
-        id=uuid.uuid4(),
-        user_id=current_user.id,
-        embedding_id=embedding.id,
-        role="bot",
-        content=answer,
-        evidence=evidence,
-        created_at=datetime.now(timezone.utc)
-    )
-    db.add(bot_msg)
-    db.commit()
+    await message_writer.add(message_row(current_user.id, embedding.id, "bot", answer, evidence))
 
     return {
         "answer": answer,
-        "evidence": evidence
+        "evidence": evidence,
+        "degraded": degraded
+    }
+
+
+@router.post("/ask-batch")
+async def ask_batch(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+):
+    body = await request.json()
+    questions = body.get("questions") or []
+    embedding_name = body.get("embedding")
+    retrieval_mode = body.get("retrieval_mode", RETRIEVAL_MODE)
+    if not questions or not embedding_name or not all(isinstance(q, str) and q for q in questions):
+        raise HTTPException(status_code=400, detail="Missing questions or embedding name")
+    if len(questions) > BATCH_ASK_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_ASK_MAX_QUESTIONS} questions per batch")
+    if retrieval_mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"retrieval_mode must be one of {', '.join(RETRIEVAL_MODES)}")
+
+    embedding = await get_user_embedding(db, current_user.id, embedding_name)
+    if not embedding:
+        raise HTTPException(status_code=404, detail="Embedding not found")
+
+    try:
+        collection = await get_collection(current_user.id, embedding)
+    except Exception as e:
+        raise collection_load_error(e, current_user.id, embedding_name)
+
+    user_id = current_user.id
+    embedding_id = embedding.id
+
+    async def streamer():
+        async for position, answer, evidence in answer_questions_batch(questions, collection, mode=retrieval_mode):
+            if not answer:
+                yield json.dumps({"index": position, "question": questions[position], "error": "No answer generated"}) + "\n"
+                continue
+
+            # Stamp each question right before its answer so chat history keeps the pairs together.
+            # Persist the pair before streaming it, so a disconnect or a later failure keeps what was answered.
+            answered_at = datetime.now(timezone.utc)
+            await message_writer.add(
+                message_row(
+                    user_id, embedding_id, "user", questions[position],
+                    created_at=answered_at - timedelta(microseconds=1)
+                ),
+                message_row(user_id, embedding_id, "bot", answer, evidence, created_at=answered_at)
+            )
+            yield json.dumps({"index": position, "question": questions[position], "answer": answer, "evidence": evidence}) + "\n"
+
+    return StreamingResponse(streamer(), media_type="application/x-ndjson")
+
+
+def document_info(document):
+    return {
+        "filename": document.filename,
+        "size_bytes": document.size_bytes,
+        "pages": document.pages,
+        "chunk_count": document.chunk_count,
+        "content_hash": document.content_hash,
+        "created_at": document.created_at.isoformat() if document.created_at else None
     }
 
 
 @router.get("/list-embeddings")
 async def list_embeddings(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_readonly)
 ):
-    embeddings = (
-        db.query(Embedding)
-        .filter_by(user_id=current_user.id)
+    # One grouped query; collections stay listable without touching S3
+    result = await db.execute(
+        select(
+            Embedding.name,
+            Embedding.created_at,
+            func.count(Document.id),
+            func.coalesce(func.sum(Document.chunk_count), 0),
+            func.coalesce(func.sum(Document.size_bytes), 0)
+        )
+        .outerjoin(Document, Document.embedding_id == Embedding.id)
+        .where(Embedding.user_id == current_user.id)
+        .group_by(Embedding.id)
         .order_by(Embedding.created_at.desc())
-        .all()
     )
-    return {"embeddings": [e.name for e in embeddings]}
+    rows = result.all()
+    # typically the first call after login: start loading the collection the user will most likely open
+    if rows:
+        warmup.prefetch_recent(current_user.id)
+    return {
+        "embeddings": [name for name, *_ in rows],
+        "collections": [
+            {
+                "name": name,
+                "created_at": created_at.isoformat() if created_at else None,
+                "documents": documents,
+                "chunks": int(chunks),
+                "size_bytes": int(size_bytes)
+            }
+            for name, created_at, documents, chunks, size_bytes in rows
+        ]
+    }
+
+
+@router.get("/list-documents")
+async def list_documents(
+    name: str = Query(...),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_readonly)
+):
+    embedding = await get_user_embedding(db, current_user.id, name)
+    if not embedding:
+        raise HTTPException(status_code=404, detail="Embedding not found")
+    documents = sorted(await load_documents(db, embedding.id), key=lambda d: d.filename)
+    return {"documents": [document_info(d) for d in documents]}
+
 
 @router.get("/load-embedding")
 async def load_embedding(
     name: str = Query(...),
-    db: Session = Depends(get_db),
+    preload: bool = Query(False),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
+    """Select a collection; the file list comes from the documents table and the index loads on first question."""
     user_id = current_user.id
-    print(f"🟢 Start loading embedding '{name}' for user {user_id}")
 
-    embedding = db.query(Embedding).filter_by(user_id=user_id, name=name).first()
+    embedding = await get_user_embedding(db, user_id, name)
     if not embedding:
         raise HTTPException(status_code=404, detail="Embedding not found")
 
-    print("🧩 Found embedding in DB:")
-    print("  chunks_path:", embedding.chunks_path)
-    print("  faiss_path:", embedding.faiss_path)
-
     if not embedding.chunks_path or not embedding.faiss_path:
         raise HTTPException(status_code=400, detail="Embedding paths missing in DB")
 
-    try:
-        print("📥 Downloading chunks from S3...")
-        chunks = download_pickle_from_s3(embedding.chunks_path)
-
-        print("📥 Downloading FAISS index from S3...")
-        index = download_faiss_from_s3(embedding.faiss_path)
-
-        print("🧠 Type of FAISS index:", type(index))
-        if not hasattr(index, "ntotal"):
-            raise ValueError("❌ FAISS index object is invalid (not really an index)")
+    documents = sorted(await load_documents(db, embedding.id), key=lambda d: d.filename)
+    memory.selected_embeddings[user_id] = name
+    warmup.record_usage(embedding.id)
 
-        print("✅ S3 downloads succeeded")
-    except Exception as e:
-        print(f"❌ S3 download error: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to load embedding from S3: {e}")
+    # Collections embedded before the documents table only know their files from the chunks
+    if preload or not documents:
+        try:
+            session = await get_collection(user_id, embedding, reload=preload)
+        except Exception as e:
+            raise collection_load_error(e, user_id, name)
+        memory.user_sessions[user_id] = session
+        if not documents:
+            documents = sorted(await backfill_documents(db, embedding, session["chunks"]), key=lambda d: d.filename)
+    else:
+        session = memory.collections.get((user_id, name))
+        if session is not None and session.get("version") != collection_version(embedding):
+            session = None  # stale; the next question loads the current version
+        if session is not None:
+            memory.user_sessions[user_id] = session
 
-    memory.user_sessions[user_id] = {
-        "chunks": chunks,
-        "index": index
+    file_names = [d.filename for d in documents]
+    return {
+        "status": "success",
+        "files": file_names,
+        "documents": [document_info(d) for d in documents],
+        "loaded": session is not None
     }
 
-    file_names = list({chunk["filename"] for chunk in chunks})
-    return {"status": "success", "files": file_names}
-
 
 
 @router.post("/delete-embedding")
 async def delete_embedding(
     name: str = Query(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
-    embedding = db.query(Embedding).filter_by(user_id=current_user.id, name=name).first()
+    embedding = await get_user_embedding(db, current_user.id, name)
     if not embedding:
         raise HTTPException(status_code=404, detail="Embedding not found")
 
-    # Remove from database (cascade deletes messages)
-    db.delete(embedding)
-    db.commit()
+    # Remove from database (cascade deletes messages), after any queued messages landed
+    if message_writer.has_pending(embedding.id):
+        await message_writer.flush()
+    await db.delete(embedding)
+    await db.commit()
 
     # Remove from memory
     memory.user_sessions.pop(current_user.id, None)
+    if memory.selected_embeddings.get(current_user.id) == name:
+        memory.selected_embeddings.pop(current_user.id, None)
+    drop_collection(current_user.id, name)
 
     # Remove from S3
     if embedding.chunks_path:
         delete_from_s3(embedding.chunks_path)
+        delete_from_s3(s3_key_for(current_user.id, name, "bm25.pkl"))
     if embedding.faiss_path:
         delete_from_s3(embedding.faiss_path)
+    # original uploads and their extracted text, one object per file
+    for folder in ("documents", "extracted"):
+        await asyncio.to_thread(delete_prefix_from_s3, s3_key_for(current_user.id, name, folder + "/"))
 
     return {"status": "success", "message": f"Embedding '{name}' deleted"}
 
 
+def encode_chat_cursor(created_at, message_id):
+    raw = json.dumps({"t": created_at.isoformat(), "id": str(message_id)})
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_chat_cursor(cursor):
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(raw["t"]), uuid.UUID(raw["id"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def chat_message_columns(include_evidence):
+    columns = [Message.id, Message.role, Message.content, Message.created_at]
+    if include_evidence:
+        columns.append(Message.evidence)
+    else:
+        columns.append((Message.evidence.isnot(None)).label("has_evidence"))
+    return columns
+
+
+def chat_message_json(row, include_evidence):
+    item = {
+        "id": str(row.id),
+        "from": row.role,
+        "content": row.content,
+        "created_at": row.created_at.isoformat() if row.created_at else None
+    }
+    if include_evidence:
+        item["evidence"] = row.evidence
+    else:
+        item["has_evidence"] = bool(row.has_evidence)
+    return json.dumps(item)
+
+
 @router.get("/load-chat")
 async def load_chat(
     name: str = Query(...),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    limit: int = Query(None, ge=1, le=500),
+    before: str = Query(None),
+    include_evidence: bool = Query(True),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_readonly)
 ):
-    embedding = db.query(Embedding).filter_by(user_id=current_user.id, name=name).first()
+    """Chat history of a collection, streamed as JSON.
+
+    Without `limit` the whole history is returned oldest first. With `limit`
+    the newest page is returned (still oldest first) together with
+    `next_cursor`; pass it back as `before` to fetch the page of older
+    messages. Pages are read with a keyset on (embedding_id, created_at, id).
+    """
+    embedding = await get_user_embedding(db, current_user.id, name)
     if not embedding:
         raise HTTPException(status_code=404, detail="Embedding not found")
+    embedding_id = embedding.id
+
+    # Read your own writes: land messages still queued for this collection
+    if message_writer.has_pending(embedding_id):
+        await message_writer.flush()
+
+    if limit is None and before is None:
+        async def streamer():
+            async with AsyncSessionLocal() as stream_db:
+                result = await stream_db.stream(
+                    select(*chat_message_columns(include_evidence))
+                    .where(Message.embedding_id == embedding_id)
+                    .order_by(Message.created_at, Message.id)
+                )
+                yield '{"messages": ['
+                first = True
+                async for row in result:
+                    yield ("" if first else ",") + chat_message_json(row, include_evidence)
+                    first = False
+                yield '], "next_cursor": null}'
+
+        return StreamingResponse(streamer(), media_type="application/json")
+
+    limit = limit or 50
+    query = select(*chat_message_columns(include_evidence)).where(Message.embedding_id == embedding_id)
+    if before:
+        created_at, message_id = decode_chat_cursor(before)
+        query = query.where(tuple_(Message.created_at, Message.id) < tuple_(created_at, message_id))
+    result = await db.execute(
+        query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1)
+    )
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = list(reversed(rows[:limit]))
+    next_cursor = encode_chat_cursor(rows[0].created_at, rows[0].id) if has_more else None
+
+    def streamer():
+        yield '{"messages": ['
+        yield ",".join(chat_message_json(row, include_evidence) for row in rows)
+        yield '], "next_cursor": ' + json.dumps(next_cursor) + '}'
+
+    return StreamingResponse(streamer(), media_type="application/json")
 
-    messages = (
-        db.query(Message)
-        .filter_by(embedding_id=embedding.id)
-        .order_by(Message.created_at)
-        .all()
+
+@router.get("/message-evidence")
+async def message_evidence(
+    id: str = Query(...),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user_readonly)
+):
+    try:
+        message_id = uuid.UUID(id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid message id")
+
+    result = await db.execute(
+        select(Message.evidence).where(Message.id == message_id, Message.user_id == current_user.id)
     )
+    row = result.first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return {"id": id, "evidence": row.evidence}
 
-    return {
-        "messages": [
-            {
-                "from": m.role,
-                "content": m.content,
-                "evidence": m.evidence
-            }
-            for m in messages
-        ]
+@router.get("/preview-file")
+async def preview_file(
+    request: Request,
+    filename: str,
+    embeddingName: str,
+    current_user: User = Depends(get_current_user_readonly)
+):
+    """Stream an uploaded document from S3, honouring Range and If-None-Match."""
+    s3_key = document_key_for(current_user.id, embeddingName, filename)
+    byte_range = request.headers.get("range")
+    if byte_range and not BYTE_RANGE_RE.match(byte_range):
+        byte_range = None  # unsupported (e.g. multi-range): serve the whole file
+    if_none_match = request.headers.get("if-none-match")
+
+    try:
+        obj = await asyncio.to_thread(get_object_stream, s3_key, byte_range, if_none_match)
+    except ClientError as e:
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        if status == 304:
+            return Response(status_code=304, headers={"ETag": if_none_match, "Cache-Control": PREVIEW_CACHE_CONTROL})
+        if status == 416:
+            return Response(status_code=416)
+        raise HTTPException(status_code=404, detail="File not found")
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(obj["ContentLength"]),
+        "Cache-Control": PREVIEW_CACHE_CONTROL,
+        "Content-Disposition": f"inline; filename*=UTF-8''{quote(filename)}"
     }
+    if obj.get("ETag"):
+        headers["ETag"] = obj["ETag"]
+    if obj.get("LastModified"):
+        headers["Last-Modified"] = format_datetime(obj["LastModified"].astimezone(timezone.utc), usegmt=True)
+    status_code = 200
+    if obj.get("ContentRange"):
+        headers["Content-Range"] = obj["ContentRange"]
+        status_code = 206
+
+    body = obj["Body"]
+
+    def stream_body():
+        try:
+            yield from body.iter_chunks(PREVIEW_STREAM_CHUNK_SIZE)
+        finally:
+            body.close()
 
-@router.get("/preview-file")
-async def preview_file(filename: str, embeddingName: str, current_user: User = Depends(get_current_user)):
-    from app.aws_s3_utils import download_file_bytes_from_s3
+    return StreamingResponse(stream_body(), status_code=status_code, media_type=document_media_type(filename), headers=headers)
 
-    s3_key = f"{current_user.id}/{embeddingName}/documents/{filename}"
+
+def load_extracted_document(user_id, embedding_name, filename):
+    """Chunks of one document: from the loaded collection, the stored extraction, or (old uploads) a re-extraction."""
+    collection = memory.collections.get((user_id, embedding_name))
+    if collection:
+        doc_chunks = [c for c in live_chunks(collection["chunks"]) if c["filename"] == filename]
+        # near-duplicate chunks are not in the collection; the stored extraction has them
+        if doc_chunks and [c["chunk_index"] for c in doc_chunks] == list(range(len(doc_chunks))):
+            return extracted_document(filename, doc_chunks)
+
+    extracted_key = extracted_key_for(user_id, embedding_name, filename)
     try:
-        file_bytes = download_file_bytes_from_s3(s3_key)
+        return download_json_from_s3(extracted_key)
     except Exception:
-        raise HTTPException(status_code=404, detail="File not found")
+        pass
 
-    return Response(file_bytes, media_type="application/octet-stream")
+    from app.aws_s3_utils import download_file_bytes_from_s3
+    file_bytes = download_file_bytes_from_s3(document_key_for(user_id, embedding_name, filename))
+    document = extracted_document(filename, chunk_document(extract_text_from_file(file_bytes, filename), filename))
+    upload_json_to_s3(document, extracted_key)
+    return document
 
 
 @router.get("/preview-chunks")
-async def preview_chunks(filename: str, embeddingName: str, current_user: User = Depends(get_current_user)):
-    from app.aws_s3_utils import download_file_bytes_from_s3
+async def preview_chunks(
+    filename: str,
+    embeddingName: str = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_user_readonly)
+):
+    if not embeddingName:
+        session = memory.user_sessions.get(current_user.id) or {}
+        embeddingName = memory.selected_embeddings.get(current_user.id) or session.get("name")
+        if not embeddingName:
+            raise HTTPException(status_code=400, detail="Missing embedding name")
 
-    s3_key = f"{current_user.id}/{embeddingName}/documents/{filename}"
     try:
-        file_bytes = download_file_bytes_from_s3(s3_key)
+        document = await asyncio.to_thread(load_extracted_document, current_user.id, embeddingName, filename)
     except Exception:
         raise HTTPException(status_code=404, detail="File not found")
 
-    text = extract_text_from_file(file_bytes, filename)
-    chunks = split_text(text, 4096)
-    return {"chunks": chunks}
-
+    page = document["chunks"][offset:offset + limit]
+    return {
+        "chunks": [c["text"] for c in page],
+        "offsets": [{"chunk_index": c["chunk_index"], "start": c["start"], "end": c["end"]} for c in page],
+        "offset": offset,
+        "limit": limit,
+        "total": len(document["chunks"])
+    }
@@ -0,0 +1,34 @@
+# ingest_worker.py — runs queued ingestion jobs (extraction + embedding) outside the API process
+#   python ingest_worker.py                 # one worker
+#   python ingest_worker.py --processes 4   # four worker processes
+#   python ingest_worker.py --backfill-documents   # list files of collections embedded before the documents table, then exit
+import argparse
+import asyncio
+import multiprocessing
+
+from app.ingest import run_worker, backfill_all_documents
+from app.logging_config import configure_logging
+
+
+def run_process():
+    configure_logging()
+    asyncio.run(run_worker())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Research-GPT ingestion worker")
+    parser.add_argument("--processes", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--backfill-documents", action="store_true", help="backfill the documents table from stored chunks and exit")
+    args = parser.parse_args()
+
+    if args.backfill_documents:
+        configure_logging()
+        print(f"Checked {asyncio.run(backfill_all_documents())} collections")
+    elif args.processes <= 1:
+        run_process()
+    else:
+        processes = [multiprocessing.Process(target=run_process) for _ in range(args.processes)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
@@ -12,6 +12,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from passlib.context import CryptContext
 from typing import List
+from contextlib import asynccontextmanager
 
 from app.auth import router as auth_router
 from embedding import router as embedding_router
@@ -25,17 +26,35 @@ from app.pgsql.models import User
 
 from app.chatbot import extract_text_from_file, split_text, load_document_chunks, load_chunks_from_file, get_text_embedding_async, answer_question, run_mistral_async
 import app.memory as memory
+from app.executors import shutdown_executors
+from app.message_writer import message_writer
+from app.embed_client import embed_client
+from app.warmup import warmup
+from app.metrics import MetricsMiddleware, metrics_payload, CONTENT_TYPE
+from app.logging_config import configure_logging
 
 from app.aws_s3_utils import s3, AWS_S3_BUCKET, upload_pickle_to_s3, download_pickle_from_s3, upload_faiss_to_s3, download_faiss_from_s3, delete_from_s3, s3_key_for
 
 from dotenv import load_dotenv
 
 load_dotenv()
+configure_logging()
 
 UPLOAD_DIR = os.getenv("UPLOAD_DIR")
 EMBEDDING_DIR = os.getenv("EMBEDDING_DIR")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    message_writer.start()
+    warmup.start()
+    yield
+    await warmup.stop()
+    await message_writer.stop()
+    await embed_client.close()
+    shutdown_executors()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -47,7 +66,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# per-stage Server-Timing on the latency-critical endpoints; request histograms everywhere
+app.add_middleware(MetricsMiddleware, server_timing_paths=("/api/ask", "/api/load-embedding"))
 
 app.include_router(auth_router, prefix="/api")
 app.include_router(embedding_router, prefix="/api")
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(metrics_payload(), media_type=CONTENT_TYPE)
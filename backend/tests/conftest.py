@@ -0,0 +1,6 @@
+import os
+import sys
+
+# app modules build their engines and clients at import time; nothing here connects
+os.environ.setdefault("DATABASE_URL", "postgresql+psycopg2://test@localhost/test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,57 @@
+import asyncio
+import uuid
+
+import app.message_writer as message_writer_module
+from app.message_writer import MessageWriter
+from app.metrics import CHAT_MESSAGES_DROPPED
+
+
+class FailingSession:
+    """Session factory stand-in for a database that is down."""
+
+    def __init__(self):
+        self.attempts = 0
+
+    def __call__(self):
+        self.attempts += 1
+        raise ConnectionRefusedError("database is down")
+
+
+def rows(n):
+    return [{"id": uuid.uuid4(), "embedding_id": uuid.uuid4(), "content": "hi"} for _ in range(n)]
+
+
+def test_full_buffer_is_bounded_when_flushes_fail(monkeypatch):
+    factory = FailingSession()
+    monkeypatch.setattr(message_writer_module, "AsyncSessionLocal", factory)
+    dropped = CHAT_MESSAGES_DROPPED._value.get()
+
+    async def scenario():
+        writer = MessageWriter(flush_interval=0.01, flush_batch=100, max_pending=5, max_wait=0.05)
+        writer.start()
+        try:
+            for _ in range(4):
+                await writer.add(*rows(3))
+                assert len(writer._pending) <= writer.max_pending
+        finally:
+            writer._task.cancel()
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert len(writer._pending) == 5
+    assert factory.attempts > 1  # retried before dropping
+    assert CHAT_MESSAGES_DROPPED._value.get() - dropped == 7
+
+
+def test_failed_flush_keeps_rows_under_the_limit(monkeypatch):
+    monkeypatch.setattr(message_writer_module, "AsyncSessionLocal", FailingSession())
+
+    async def scenario():
+        writer = MessageWriter(max_pending=10, max_wait=0)
+        queued = rows(4)
+        await writer.add(*queued)  # no background loop: writes through, fails, keeps the rows
+        return writer, queued
+
+    writer, queued = asyncio.run(scenario())
+    assert writer._pending == queued
+    assert writer.has_pending()
@@ -276,34 +276,31 @@ export default function ChatUI({ onLogout }) {
         body: formData
       });
 
-      const reader = res.body.getReader();
-      const decoder = new TextDecoder("utf-8");
-      let partial = "";
-
-      while (true) {
-        const { value, done } = await reader.read();
-        if (done) break;
-
-        partial += decoder.decode(value, { stream: true });
-        const lines = partial.split("\n");
-        partial = lines.pop(); // Last line may be incomplete
-
-        for (const line of lines) {
-          if (line.startsWith("PROGRESS:")) {
-            const match = line.match(/(\d+)\/(\d+)/);
-            if (match) {
-              const current = parseInt(match[1], 10);
-              const total = parseInt(match[2], 10);
-              setEmbeddedChunks(current);
-              setTotalChunks(total);
-              setUploadProgress((current / total) * 100);
-            }
-          }
+      const queued = await res.json();
+      if (!res.ok) throw new Error(queued.detail || "Failed to queue embedding");
+      if (!queued.job_id) {
+        setEmbeddingStatus(queued.message || "Nothing to embed");
+        return;
+      }
+
+      // Embedding runs in the ingestion worker; poll the job for progress
+      setEmbeddingStatus("Queued for embedding...");
+      let job = queued;
+      while (job.status === "queued" || job.status === "running") {
+        await new Promise((resolve) => setTimeout(resolve, 1500));
+        const poll = await authFetch(`${API_URL}/ingest-jobs/${queued.job_id}`);
+        job = await poll.json();
+        if (!poll.ok) throw new Error(job.detail || "Failed to fetch job status");
+        if (job.status === "running") setEmbeddingStatus("Embedding...");
+        if (job.total_chunks) {
+          setEmbeddedChunks(job.embedded_chunks);
+          setTotalChunks(job.total_chunks);
+          setUploadProgress((job.embedded_chunks / job.total_chunks) * 100);
         }
       }
 
-      const result = JSON.parse(partial || "{}");
-      setEmbeddingStatus(result.message || "Embedding complete");
+      if (job.status === "failed") throw new Error(job.error || "Embedding failed");
+      setEmbeddingStatus(job.result?.message || "Embedding complete");
       setSelectedEmbedding(name);
     } catch (err) {
       console.error("Error during embedding:", err);
@@ -414,7 +411,7 @@ export default function ChatUI({ onLogout }) {
       }, 1500);
     } else if (filename && !loadedFiles.has(filename)) {
       try {
-        const res = await authFetch(`${API_URL}/preview-chunks?filename=${encodeURIComponent(filename)}`);
+        const res = await authFetch(`${API_URL}/preview-chunks?filename=${encodeURIComponent(filename)}&embeddingName=${encodeURIComponent(selectedEmbedding)}`);
         const data = await res.json();
         if (data.chunks) {
           setSelectedFileChunks(data.chunks);
@@ -464,7 +461,7 @@ export default function ChatUI({ onLogout }) {
   };
 
   const handlePreviewChunks = (file) => {
-    authFetch(`${API_URL}/preview-chunks?filename=${encodeURIComponent(file.name)}`)
+    authFetch(`${API_URL}/preview-chunks?filename=${encodeURIComponent(file.name)}&embeddingName=${encodeURIComponent(selectedEmbedding)}`)
       .then(res => res.json())
       .then(data => {
         setSelectedFileChunks(data.chunks || []);
@@ -0,0 +1,236 @@
+# benchmark.py — sweep embed server settings on this host and write the best one as the server config
+#   python benchmark.py                                   # default sweep, writes tuned/embed_config.json
+#   python benchmark.py --batch-sizes 8,32 --threads 4,8 --workers 1,2 --lengths 64,512,mixed --max-p95-ms 2000
+#
+# Every combination of batch size x torch threads x worker processes starts
+# `python server.py` on a free port with EMBED_* overrides, then for every input
+# length distribution sends --requests requests (--texts-per-request texts each,
+# --concurrency at once) and records sequences/sec and request latency percentiles.
+# The winner has the best geometric-mean throughput over the length distributions
+# (among settings meeting --max-p95-ms, if given); server.py reads it at startup.
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG = os.path.join(SERVER_DIR, "tuned", "embed_config.json")
+# short, common words: roughly one WordPiece token each
+VOCABULARY = (
+    "the of and to in is that for it as was with be by on not he this are or his from at which but have an they "
+    "you were her she there been one all we their has would when if so no will more can said who up what some "
+    "time only other new about them into two may than its first any people could now these over most after such "
+    "model data results method study analysis paper system research figure table using based used value"
+).split()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def token_lengths(spec, count, rng):
+    """`count` input lengths in tokens: a fixed number, or "mixed" (log-normal, median 256, 16..4096)."""
+    if spec == "mixed":
+        return np.clip(rng.lognormal(np.log(256), 1.0, count), 16, 4096).astype(int)
+    return np.full(count, int(spec))
+
+
+def make_texts(spec, count, rng):
+    return [" ".join(rng.choice(VOCABULARY, n)) for n in token_lengths(spec, count, rng)]
+
+
+def post_json(url, payload, timeout):
+    request = urllib.request.Request(url, json.dumps(payload).encode(), {"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def wait_ready(url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("embed server exited during startup")
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(1)
+    raise RuntimeError(f"embed server not ready after {timeout}s")
+
+
+def start_server(settings, args):
+    port = free_port()
+    env = dict(
+        os.environ,
+        EMBED_PORT=str(port),
+        EMBED_HOST="127.0.0.1",
+        EMBED_SERVER_CONFIG="",  # measure only the settings under test, not a previous tuned config
+        EMBED_BATCH_SIZE=str(settings["batch_size"]),
+        EMBED_TORCH_THREADS=str(settings["torch_threads"]),
+        EMBED_INTEROP_THREADS=str(settings["interop_threads"]),
+        EMBED_WORKERS=str(settings["workers"]),
+        EMBED_MAX_LENGTH=str(args.max_length),
+        EMBED_BULK_QUEUE=str(max(4096, args.texts_per_request * args.requests)),  # measure throughput, not 429s
+    )
+    process = subprocess.Popen([sys.executable, args.server], cwd=SERVER_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    try:
+        wait_ready(f"http://127.0.0.1:{port}/ready", process, args.startup_timeout)
+    except Exception:
+        stop_server(process)
+        raise
+    return f"http://127.0.0.1:{port}/v1/embeddings", process
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def run_load(url, spec, args, concurrency, rng):
+    """Send args.requests requests of args.texts_per_request texts; returns throughput and latency stats."""
+    payloads = [make_texts(spec, args.texts_per_request, rng) for _ in range(args.requests)]
+    for texts in payloads[:concurrency]:  # warm-up (allocations, kernel selection)
+        post_json(url, {"input": texts}, args.request_timeout)
+
+    def send(texts):
+        start = time.perf_counter()
+        post_json(url, {"input": texts, "priority": "bulk"}, args.request_timeout)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = np.array(list(pool.map(send, payloads)))
+    wall = time.perf_counter() - start
+    return {
+        "lengths": spec,
+        "sequences_per_s": round(args.requests * args.texts_per_request / wall, 2),
+        "requests_per_s": round(args.requests / wall, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 1),
+    }
+
+
+def sweep(args):
+    cpus = os.cpu_count() or 1
+    results = []
+    for workers in args.workers:
+        for threads in args.threads:
+            if not args.oversubscribe and workers * max(threads, 1) > cpus:
+                print(f"skip workers={workers} threads={threads}: more threads than {cpus} CPUs")
+                continue
+            for batch_size in args.batch_sizes:
+                settings = {"batch_size": batch_size, "torch_threads": threads,
+                            "interop_threads": args.interop_threads, "workers": workers}
+                print(f"settings {settings}", flush=True)
+                try:
+                    url, process = start_server(settings, args)
+                except RuntimeError as e:
+                    print(f"  failed to start: {e}")
+                    continue
+                try:
+                    rng = np.random.default_rng(args.seed)
+                    concurrency = args.concurrency or 2 * workers
+                    runs = []
+                    for spec in args.lengths:
+                        run = run_load(url, spec, args, concurrency, rng)
+                        print(f"  lengths={spec:<6} {run['sequences_per_s']:>9} seq/s  "
+                              f"p50 {run['p50_ms']} ms  p95 {run['p95_ms']} ms  p99 {run['p99_ms']} ms", flush=True)
+                        runs.append(run)
+                except OSError as e:
+                    print(f"  load failed: {e}")
+                    continue
+                finally:
+                    stop_server(process)
+                score = float(np.exp(np.mean(np.log([r["sequences_per_s"] for r in runs]))))
+                results.append({"settings": settings, "score": round(score, 2),
+                                "worst_p95_ms": max(r["p95_ms"] for r in runs), "runs": runs})
+    return results
+
+
+def best_result(results, max_p95_ms=None):
+    eligible = [r for r in results if max_p95_ms is None or r["worst_p95_ms"] <= max_p95_ms]
+    return max(eligible, key=lambda r: r["score"]) if eligible else None
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and autotune the local embedding server")
+    parser.add_argument("--batch-sizes", type=int_list, default=[8, 16, 32, 64], help="texts per forward pass")
+    parser.add_argument("--threads", type=int_list, default=None,
+                        help="torch intra-op threads per worker (default: 1, 2, 4 ... up to the CPU count)")
+    parser.add_argument("--interop-threads", type=int, default=1)
+    parser.add_argument("--workers", type=int_list, default=[1, 2], help="model worker processes")
+    parser.add_argument("--lengths", default="64,512,mixed",
+                        help="input length distributions: token counts and/or 'mixed'")
+    parser.add_argument("--max-length", type=int, default=8192, help="server truncation length (tokens)")
+    parser.add_argument("--texts-per-request", type=int, default=16, help="the backend ingests 16 chunks per request")
+    parser.add_argument("--requests", type=int, default=40, help="requests per length distribution")
+    parser.add_argument("--concurrency", type=int, default=0, help="concurrent requests (default: 2 x workers)")
+    parser.add_argument("--max-p95-ms", type=float, help="only accept settings with p95 latency below this")
+    parser.add_argument("--oversubscribe", action="store_true", help="also try workers x threads > CPU count")
+    parser.add_argument("--server", default=os.path.join(SERVER_DIR, "server.py"))
+    parser.add_argument("--startup-timeout", type=float, default=600, help="seconds to wait for the model to load")
+    parser.add_argument("--request-timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=DEFAULT_CONFIG, help="tuned config read by server.py")
+    parser.add_argument("--results", help="also write every measurement to this JSON file")
+    parser.add_argument("--dry-run", action="store_true", help="report the best settings without writing the config")
+    parser.add_argument("--verbose", action="store_true", help="show server logs")
+    args = parser.parse_args()
+    args.lengths = [s for s in args.lengths.split(",") if s]
+    if args.threads is None:
+        cpus = os.cpu_count() or 1
+        args.threads = sorted({min(2 ** i, cpus) for i in range(cpus.bit_length())})
+
+    results = sweep(args)
+    if args.results:
+        with open(args.results, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+    best = best_result(results, args.max_p95_ms)
+    if best is None:
+        print("No settings completed" + (f" within p95 {args.max_p95_ms} ms" if args.max_p95_ms else ""))
+        sys.exit(1)
+    print(f"best: {best['settings']} ({best['score']} seq/s geometric mean, worst p95 {best['worst_p95_ms']} ms)")
+    if args.dry_run:
+        return
+
+    config = dict(best["settings"], max_length=args.max_length)
+    config["benchmark"] = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "host": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "texts_per_request": args.texts_per_request,
+        "lengths": args.lengths,
+        "score_sequences_per_s": best["score"],
+        "runs": best["runs"],
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(config, f, indent=2)
+    print(f"config written to {args.output} (restart the server to apply)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# model_workers.py — model worker processes behind server.py
+# On CPU the model is loaded once in the server process and the workers are
+# forked from it, so they share the (read-only) weights copy-on-write. CUDA
+# cannot be forked, so GPU workers are spawned and load their own copy.
+import multiprocessing as mp
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModel
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def load_model(model_name):
+    model = AutoModel.from_pretrained(model_name, trust_remote_code=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+    model.eval()
+    model.to(device)
+    return model, tokenizer
+
+
+def embed_batch(model, tokenizer, texts, max_length):
+    encoded = tokenizer(texts, padding=True, truncation=True, max_length=max_length, return_tensors="pt").to(device)
+    with torch.no_grad():
+        output = model(**encoded)
+    # mean over real tokens only, so a text's vector does not depend on what it was batched with
+    mask = encoded["attention_mask"].unsqueeze(-1).to(output.last_hidden_state.dtype)
+    summed = (output.last_hidden_state * mask).sum(dim=1)
+    return (summed / mask.sum(dim=1).clamp(min=1)).cpu().numpy().astype(np.float32)
+
+
+def set_threads(config):
+    if config["torch_threads"] > 0:
+        torch.set_num_threads(config["torch_threads"])
+    if config["interop_threads"] > 0:
+        try:
+            torch.set_num_interop_threads(config["interop_threads"])
+        except RuntimeError:
+            pass  # already fixed by the parent process before fork
+
+
+def worker_main(conn, config, model_name, shared_model=None):
+    """Receive (job_id, texts) over `conn`, answer ("ok", job_id, vectors) or ("error", job_id, message).
+
+    Sends ("ready", None, None) once the model is loaded and a warm-up batch has run;
+    a None message stops the worker.
+    """
+    set_threads(config)
+    model, tokenizer = shared_model or load_model(model_name)
+    embed_batch(model, tokenizer, ["warm-up"] * config["batch_size"], config["max_length"])
+    conn.send(("ready", None, None))
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        job_id, texts = message
+        try:
+            conn.send(("ok", job_id, embed_batch(model, tokenizer, texts, config["max_length"])))
+        except Exception as e:
+            conn.send(("error", job_id, repr(e)))
+
+
+class ModelWorker:
+    def __init__(self, slot, config, model_name, shared_model=None):
+        self.slot = slot
+        self.ready = False
+        context = mp.get_context("fork" if shared_model is not None else "spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_main, args=(child_conn, config, model_name, shared_model),
+            name=f"embed-worker-{slot}", daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=10)
+        if self.process.is_alive():
+            self.process.kill()
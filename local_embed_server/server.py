@@ -1,28 +1,240 @@
+import os
+import json
+import math
+import time
+import asyncio
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
-from transformers import AutoTokenizer, AutoModel
-import torch
+from fastapi.responses import JSONResponse
+
+import model_workers
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+# written by `python benchmark.py` for this host; EMBED_* environment variables override it
+CONFIG_PATH = os.getenv("EMBED_SERVER_CONFIG", os.path.join(SERVER_DIR, "tuned", "embed_config.json"))
+DEFAULTS = {
+    "batch_size": 32,        # texts per forward pass
+    "torch_threads": 0,      # intra-op threads per worker (0 = torch default)
+    "interop_threads": 0,    # inter-op threads per worker (0 = torch default)
+    "max_length": 8192,      # tokens per text, longer inputs are truncated
+    "workers": 1,            # model worker processes
+    "priority_queue": 256,   # texts waiting in the query lane before 429
+    "bulk_queue": 4096,      # texts waiting in the bulk (ingestion) lane before 429
+    "query_max_chars": 4096, # single-text requests up to this size default to the query lane
+}
+MODEL_NAME = os.getenv("EMBED_MODEL", "jinaai/jina-embeddings-v2-base-en")
+LANES = ("query", "bulk")  # served in this order
+
+
+def load_config(path=CONFIG_PATH):
+    config = dict(DEFAULTS)
+    if os.path.exists(path):
+        with open(path) as f:
+            config.update({k: int(v) for k, v in json.load(f).items() if k in DEFAULTS})
+    for key in DEFAULTS:
+        value = os.getenv(f"EMBED_{key.upper()}")
+        if value:
+            config[key] = int(value)
+    return config
+
+
+config = load_config()
+
+
+class Lanes:
+    """Bounded per-lane queues of micro-batches; `get` always drains the query lane first."""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.queues = {lane: deque() for lane in LANES}
+        self.queued_texts = {lane: 0 for lane in LANES}
+        self.available = asyncio.Event()
+        self.seconds_per_text = 0.05  # EWMA of worker time per text, for Retry-After
+        self.ids = itertools.count()
+
+    def has_room(self, lane, count):
+        return self.queued_texts[lane] + count <= self.limits[lane]
+
+    def retry_after(self, lane, workers):
+        ahead = sum(self.queued_texts[l] for l in LANES[:LANES.index(lane) + 1])
+        return max(1, math.ceil(ahead * self.seconds_per_text / max(1, workers)))
+
+    def put(self, lane, texts):
+        future = asyncio.get_running_loop().create_future()
+        self.queues[lane].append((next(self.ids), texts, future))
+        self.queued_texts[lane] += len(texts)
+        self.available.set()
+        return future
+
+    async def get(self):
+        while True:
+            for lane in LANES:
+                queue = self.queues[lane]
+                while queue:
+                    job = queue.popleft()
+                    self.queued_texts[lane] -= len(job[1])
+                    if not job[2].done():  # skip batches of requests that were cancelled
+                        return job
+            self.available.clear()
+            await self.available.wait()
+
+    def record(self, texts, seconds):
+        self.seconds_per_text = 0.9 * self.seconds_per_text + 0.1 * seconds / max(1, texts)
+
+
+lanes = None
+workers = []
+shared_model = None
+# one thread per worker waits on its pipe
+pipe_executor = ThreadPoolExecutor(max_workers=config["workers"], thread_name_prefix="embed-pipe")
+
 
-app = FastAPI()
+async def serve_worker(slot):
+    """Feed one model worker process from the lanes; restarts the worker if it dies."""
+    loop = asyncio.get_running_loop()
+    while True:
+        worker = model_workers.ModelWorker(slot, config, MODEL_NAME, shared_model)
+        workers[slot] = worker
+        try:
+            status, _, _ = await loop.run_in_executor(pipe_executor, worker.conn.recv)
+        except (EOFError, OSError):
+            print(f"Worker {slot} died during warm-up; restarting")
+            worker.stop()
+            await asyncio.sleep(1)
+            continue
+        worker.ready = status == "ready"
+        print(f"Worker {slot} ready.")
+
+        while True:
+            job_id, texts, future = await lanes.get()
+            start = time.perf_counter()
+            try:
+                worker.conn.send((job_id, texts))
+                status, _, payload = await loop.run_in_executor(pipe_executor, worker.conn.recv)
+            except (EOFError, OSError) as e:
+                if not future.done():
+                    future.set_exception(RuntimeError(f"embedding worker {slot} died: {e!r}"))
+                worker.ready = False
+                print(f"Worker {slot} died; restarting")
+                worker.stop()
+                break
+            lanes.record(len(texts), time.perf_counter() - start)
+            if future.done():
+                continue
+            if status == "ok":
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global lanes, shared_model
+    lanes = Lanes({"query": config["priority_queue"], "bulk": config["bulk_queue"]})
+    workers[:] = [None] * config["workers"]
+    print(f"Loading model... ({json.dumps(config)})")
+    if model_workers.device.type == "cpu":
+        # loaded here once; forked workers share the weights
+        model_workers.set_threads(config)
+        shared_model = model_workers.load_model(MODEL_NAME)
+    tasks = [asyncio.create_task(serve_worker(slot)) for slot in range(config["workers"])]
+    yield
+    for task in tasks:
+        task.cancel()
+    for worker in workers:
+        if worker is not None:
+            worker.stop()
+    pipe_executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def request_lane(body, request, texts):
+    """Explicit `priority` ("query" / "bulk", body or X-Embed-Priority header), else short single texts are queries."""
+    lane = body.get("priority") or request.headers.get("x-embed-priority")
+    if lane in LANES:
+        return lane
+    return "query" if len(texts) == 1 and len(texts[0]) <= config["query_max_chars"] else "bulk"
 
-print("Loading model...")
-model = AutoModel.from_pretrained("jinaai/jina-embeddings-v2-base-en", trust_remote_code=True)
-tokenizer = AutoTokenizer.from_pretrained("jinaai/jina-embeddings-v2-base-en", trust_remote_code=True)
-model.eval()
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
-print("Model loaded.")
 
 @app.post("/v1/embeddings")
 async def get_embedding(request: Request):
     body = await request.json()
     input_texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
-    encoded = tokenizer(input_texts, padding=True, truncation=True, max_length=8192, return_tensors="pt").to(device)
-    with torch.no_grad():
-        output = model(**encoded)
-        embeddings = output.last_hidden_state.mean(dim=1).cpu().tolist()
+    lane = request_lane(body, request, input_texts)
+
+    if len(input_texts) > lanes.limits[lane]:
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"{len(input_texts)} texts exceed the {lane} queue size ({lanes.limits[lane]}); split the request"}
+        )
+    if not lanes.has_room(lane, len(input_texts)):
+        retry_after = lanes.retry_after(lane, sum(w is not None and w.ready for w in workers))
+        return JSONResponse(
+            status_code=429,
+            content={"detail": f"{lane} queue is full, retry in {retry_after}s"},
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    # micro-batches of similar length (less padding); a bulk request yields the workers
+    # between its batches, so queries queued meanwhile go next
+    order = sorted(range(len(input_texts)), key=lambda i: len(input_texts[i]))
+    batches = [order[i:i + config["batch_size"]] for i in range(0, len(order), config["batch_size"])]
+    futures = [lanes.put(lane, [input_texts[i] for i in batch]) for batch in batches]
+    try:
+        results = await asyncio.gather(*futures)
+    except asyncio.CancelledError:
+        for future in futures:
+            future.cancel()
+        raise
+    except RuntimeError as e:
+        # a worker died on one batch; nobody will read the rest, so workers skip them
+        for future in futures:
+            future.cancel()
+        return JSONResponse(status_code=503, content={"detail": str(e)})
+
+    embeddings = [None] * len(input_texts)
+    for batch, vectors in zip(batches, results):
+        for i, vector in zip(batch, vectors):
+            embeddings[i] = vector.tolist()
     return {
         "object": "list",
         "data": [{"embedding": e, "index": i} for i, e in enumerate(embeddings)],
-        "model": "jinaai/jina-embeddings-v2-base-en",
+        "model": MODEL_NAME,
         "usage": {"total_tokens": sum(len(t) for t in input_texts)}
     }
+
+
+@app.get("/health")
+def health():
+    """Liveness, queue depths and settings."""
+    return {
+        "status": "ok",
+        "ready_workers": sum(w is not None and w.ready for w in workers),
+        "queued_texts": dict(lanes.queued_texts) if lanes else {},
+        "config": config
+    }
+
+
+@app.get("/ready")
+def ready():
+    """200 once every worker has loaded the model and run a warm-up batch, 503 before."""
+    ready_workers = sum(w is not None and w.ready for w in workers)
+    status = {"ready_workers": ready_workers, "workers": config["workers"]}
+    if ready_workers < config["workers"]:
+        return JSONResponse(status_code=503, content={"status": "warming up", **status})
+    return {"status": "ready", **status}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(
+        "server:app",
+        host=os.getenv("EMBED_HOST", "0.0.0.0"),
+        port=int(os.getenv("EMBED_PORT", "8000"))
+    )
@@ -36,4 +36,8 @@ cd /home/ubuntu/Projects/Research-GPT/backend
 conda activate research_gpt2
 nohup conda run -n research_gpt2 uvicorn main:app --reload --host 0.0.0.0 --port 8888 > backend.log 2>&1 &
 
+# Ingestion worker (processes queued /embed-files jobs)
+echo "Starting ingestion worker..."
+nohup conda run -n research_gpt2 python ingest_worker.py > ingest_worker.log 2>&1 &
+
 echo "All services started."